@@ -7,12 +7,28 @@ including:
 1. `ConfigureLogging`: Configures the logger for saving events to a file.
 2. `LoadLangs`: Loads `names` and `strings` variables of all installed
 languages.
+3. `BOT_BRAND`: the brand of the hosted bot which the current task
+serves; log records are tagged with it.
 """
 
+from contextvars import ContextVar
 import logging
 from os import PathLike
 
 
+BOT_BRAND: ContextVar[str] = ContextVar('BOT_BRAND', default='')
+"""The brand of the hosted bot which the current task serves."""
+
+
+class _BrandFilter(logging.Filter):
+    """Tags log records with the brand of the bot being served."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        brand = BOT_BRAND.get()
+        record.brand = f'  [{brand}]' if brand else ''
+        return True
+
+
 def ConfigureLogging(filename: PathLike) -> None:
     """Configures the logger for saving events to a file."""
     # Declaring variables ---------------------------------
@@ -26,10 +42,12 @@ def ConfigureLogging(filename: PathLike) -> None:
     msgOnlyFormatter = logging.Formatter('%(message)s')
     detailedFormatter = logging.Formatter(
         fmt=(
-            '[%(asctime)s]  %(module)s  %(threadName)s'
+            '[%(asctime)s]  %(module)s  %(threadName)s%(brand)s'
             + '\n%(levelname)8s: %(message)s\n\n'),
         datefmt='%Y-%m-%d  %H:%M:%S')
+    brandFilter = _BrandFilter()
     fileHandler = logging.FileHandler(filename, 'a')
+    fileHandler.addFilter(brandFilter)
     fileHandler.setLevel(logging.INFO)
     fileHandler.setFormatter(msgOnlyFormatter)
     rootLogger.addHandler(fileHandler)
@@ -37,7 +55,7 @@ def ConfigureLogging(filename: PathLike) -> None:
     logging.info('=' * 60)
     logNote = (
         f'Operating system: {platform.system()} {platform.release()}'
-        + f'(version: {platform.version()}) {platform.architecture()}')
+        + f'(version: {platform.version()}) {platform.machine()}')
     logging.info(logNote)
     temp = '.'.join(platform.python_version_tuple())
     logNote = f'Python interpreter: {platform.python_implementation()} {temp}'
@@ -48,6 +66,7 @@ def ConfigureLogging(filename: PathLike) -> None:
     fileHandler.setFormatter(detailedFormatter)
     # Setting debugging logger...
     stdoutHandler = logging.StreamHandler()
+    stdoutHandler.addFilter(brandFilter)
     stdoutHandler.setFormatter(detailedFormatter)
     stdoutHandler.setLevel(logging.DEBUG)
     rootLogger.addHandler(stdoutHandler)
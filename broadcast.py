@@ -0,0 +1,192 @@
+#
+#
+#
+"""This module offers the broadcast engine of the Bot which sends a
+message from admins to all users. It streams recipients from the users
+table in chunks, sends with bounded concurrency under a rate limit, and
+checkpoints progress after every chunk so a crash resumes where it left
+off. A cancelled chunk checkpoints the users delivered so far, so a
+restart in the middle of a broadcast does not message them again. Optionally, each user gets the message at their peak hour according
+to their `HourlyFrequencies`.
+
+#### Types:
+1. `Broadcaster`
+"""
+
+from __future__ import annotations
+import asyncio
+import logging
+from typing import TYPE_CHECKING
+
+from db import BroadcastData, IDatabase, UserData
+from utils.types import AsyncTokenBucket
+
+if TYPE_CHECKING:
+    from bale import Bot
+
+
+class Broadcaster:
+    """Runs broadcasts in the background. Arguments are as follow:
+
+    * `bot`: the Bot which sends the messages.
+    * `db`: the database of users and broadcast checkpoints.
+    * `limiter`: the rate limiter of sends; it should leave enough room
+    for interactive replies.
+    * `concurrency`: the maximum number of sends in flight.
+    * `chunk`: the number of users read from the database at a time.
+    * `brand`: the brand of the bot; only the broadcasts of this brand
+    are run and listed.
+    """
+
+    def __init__(
+            self,
+            bot: Bot,
+            db: IDatabase,
+            limiter: AsyncTokenBucket,
+            *,
+            concurrency: int = 4,
+            chunk: int = 500,
+            brand: str = '',
+            ) -> None:
+        self._bot = bot
+        self._brand = brand
+        self._db = db
+        self._limiter = limiter
+        self._concurrency = concurrency
+        self._chunk = chunk
+        self._tasks: dict[int, asyncio.Task] = {}
+        """The running broadcasts as `broadcast ID -> task`."""
+
+    @property
+    def Running(self) -> tuple[int, ...]:
+        """Gets the IDs of the running broadcasts."""
+        return tuple(self._tasks)
+
+    def Start(self, text: str, by_peak: bool = False) -> BroadcastData:
+        """Creates a new broadcast of the text and runs it in the
+        background.
+        """
+        from time import time
+        broadcast = self._db.CreateBroadcast(
+            text,
+            by_peak,
+            int(time()),
+            brand=self._brand)
+        self._Schedule(broadcast)
+        return broadcast
+
+    def ResumeAll(self) -> None:
+        """Resumes all the unfinished broadcasts from their checkpoints.
+        It must be called once the event loop is running.
+        """
+        for broadcast in self._db.GetUnfinishedBroadcasts(brand=self._brand):
+            if broadcast.Id not in self._tasks:
+                logging.info(f'resuming broadcast {broadcast.Id}')
+                self._Schedule(broadcast)
+
+    def GetStatus(self) -> tuple[BroadcastData, ...]:
+        """Gets the checkpoints of all the unfinished broadcasts."""
+        return self._db.GetUnfinishedBroadcasts(brand=self._brand)
+
+    async def Stop(self) -> None:
+        """Cancels the running broadcasts. Their checkpoints stay, so they
+        resume at the next `ResumeAll`.
+        """
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _Schedule(self, broadcast: BroadcastData) -> None:
+        task = asyncio.get_running_loop().create_task(self._Run(broadcast))
+        self._tasks[broadcast.Id] = task
+        task.add_done_callback(
+            lambda _: self._tasks.pop(broadcast.Id, None))
+
+    async def _Run(self, broadcast: BroadcastData) -> None:
+        from time import time
+        nPasses = 24 if broadcast.ByPeak else 1
+        startHour = broadcast.StartedAt // 3_600
+        while broadcast.Pass < nPasses:
+            # Waiting for the hour of this pass...
+            delay = (startHour + broadcast.Pass) * 3_600 - time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            hour = self._GetLocalHour((startHour + broadcast.Pass) * 3_600)
+            firstHour = self._GetLocalHour(broadcast.StartedAt)
+            # Streaming recipients...
+            while True:
+                users = self._db.GetUsers(self._chunk, after=broadcast.Cursor)
+                if not users:
+                    break
+                chunkEnd = users[-1].Id
+                if broadcast.ByPeak:
+                    users = tuple(
+                        user
+                        for user in users
+                        if self._GetPeakHour(user, firstHour) == hour)
+                try:
+                    await self._SendChunk(broadcast, users)
+                except asyncio.CancelledError:
+                    # Saving the progress of the interrupted chunk...
+                    self._db.UpdateBroadcast(broadcast)
+                    raise
+                broadcast.Cursor = chunkEnd
+                self._db.UpdateBroadcast(broadcast)
+                # Yielding to interactive replies...
+                await asyncio.sleep(0)
+            broadcast.Pass += 1
+            broadcast.Cursor = None
+            self._db.UpdateBroadcast(broadcast)
+        broadcast.Done = True
+        self._db.UpdateBroadcast(broadcast)
+        logging.info(f'broadcast {broadcast.Id} finished: {broadcast.Sent} '
+            f'sent, {broadcast.Failed} failed')
+
+    async def _SendChunk(
+            self,
+            broadcast: BroadcastData,
+            users: tuple[UserData, ...],
+            ) -> None:
+        """Sends the message to the users. Meanwhile, the cursor of the
+        broadcast advances to the last user of the contiguous run of
+        finished sends from the start of the chunk.
+        """
+        semaphore = asyncio.Semaphore(self._concurrency)
+        finished = [False] * len(users)
+        # The length of the contiguous run of finished sends...
+        nFinished = 0
+        async def _Send(idx: int, user: UserData) -> None:
+            nonlocal nFinished
+            async with semaphore:
+                await self._limiter.Acquire()
+                try:
+                    await self._bot.send_message(user.Id, broadcast.Text)
+                    broadcast.Sent += 1
+                except Exception:
+                    logging.warning(f'broadcast {broadcast.Id} failed for '
+                        f'{user.Id}', exc_info=True)
+                    broadcast.Failed += 1
+            finished[idx] = True
+            if idx != nFinished:
+                return
+            while nFinished < len(users) and finished[nFinished]:
+                nFinished += 1
+            broadcast.Cursor = users[nFinished - 1].Id
+        await asyncio.gather(*(
+            _Send(idx, user)
+            for idx, user in enumerate(users)))
+
+    @staticmethod
+    def _GetLocalHour(__time: float, /) -> int:
+        from time import localtime
+        return localtime(__time).tm_hour
+
+    @staticmethod
+    def _GetPeakHour(user: UserData, default: int) -> int:
+        """Gets the peak hour of the user or `default` if the user has no
+        recorded activity.
+        """
+        freqs = user.Frequencies.Frequencies
+        max_ = max(freqs)
+        return freqs.index(max_) if max_ else default
@@ -0,0 +1,163 @@
+#
+#
+#
+"""This module offers the catch-up stage of the Bot which runs after
+downtime before the normal dispatch. It fetches the backlog of updates
+in bulk, groups it per user, drops the updates superseded by later ones
+of the same user, and then handles users in parallel, each one in order.
+
+#### Collapsing rules for the updates of a user:
+1. A view command (`/start`, `/help`, `/showcase` & `/mycourses`), typed
+or pressed, is dropped if the user sent any later command.
+2. Of the callbacks on the same message, only the latest is kept.
+3. Everything else is kept, e.g. the input of operations & admin
+commands.
+
+Paging `getUpdates` confirms the previous pages, so a crash in the middle
+of catching up loses at most one round of the backlog.
+
+#### Functions:
+1. `CatchUp`
+2. `Collapse`
+"""
+
+from __future__ import annotations
+import asyncio
+import logging
+from typing import Any, Callable, Coroutine, NamedTuple
+
+from sharding import FetchUpdates, GetSenderId
+from utils.types import Commands
+
+
+_VIEW_CMDS = frozenset((
+    Commands.START.value,
+    Commands.HELP.value,
+    Commands.SHOWCASE.value,
+    Commands.MY_COURSES.value,))
+"""The commands which only show a view and have no effects."""
+
+
+class CatchUpStats(NamedTuple):
+    fetched: int
+    """The number of updates in the backlog."""
+    handled: int
+    """The number of updates left after collapsing."""
+    users: int
+    secs: float
+
+
+async def CatchUp(
+        base_url: str,
+        token: str,
+        handler: Callable[[dict[str, Any]], Coroutine[Any, Any, None]],
+        *,
+        concurrency: int = 32,
+        round_size: int = 1_000,
+        ) -> CatchUpStats:
+    """Handles the backlog of the bot with `handler` until no update is
+    pending and confirms it on the Bale servers. Arguments are as follow:
+
+    * `base_url`: the base URL of the Bale API.
+    * `token`: the token of the bot.
+    * `handler`: the coroutine function which handles a raw update.
+    * `concurrency`: the maximum number of users handled at a time.
+    * `round_size`: the number of updates fetched before handling them.
+    """
+    from time import perf_counter
+    from aiohttp import ClientSession, ClientTimeout
+    start = perf_counter()
+    fetched = 0
+    handled = 0
+    users = 0
+    offset = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    async def _HandleUser(updates: list[dict[str, Any]]) -> None:
+        async with semaphore:
+            for update in updates:
+                try:
+                    await handler(update)
+                except Exception:
+                    logging.error(f'catching up with update '
+                        f'{update.get("update_id")} failed', exc_info=True)
+    async with ClientSession(timeout=ClientTimeout(total=30)) as session:
+        while True:
+            # Fetching a round of the backlog without waiting...
+            backlog: list[dict[str, Any]] = []
+            page = None
+            while len(backlog) < round_size:
+                page = await FetchUpdates(
+                    session,
+                    base_url,
+                    token,
+                    offset,
+                    timeout=0)
+                if not page:
+                    break
+                backlog.extend(page)
+                offset = max(offset, page[-1]['update_id'] + 1)
+            if not backlog:
+                break
+            groups = Collapse(backlog)
+            fetched += len(backlog)
+            handled += sum(len(updates) for updates in groups.values())
+            users += len(groups)
+            await asyncio.gather(*(
+                _HandleUser(updates)
+                for updates in groups.values()))
+            # The empty page has confirmed the whole backlog...
+            if not page:
+                break
+    return CatchUpStats(fetched, handled, users, perf_counter() - start)
+
+
+def Collapse(
+        updates: list[dict[str, Any]],
+        ) -> dict[int | None, list[dict[str, Any]]]:
+    """Groups the raw updates per sender in their order and drops the
+    superseded ones. Updates without a sender are all kept under `None`.
+    """
+    groups: dict[int | None, list[dict[str, Any]]] = {}
+    for update in updates:
+        groups.setdefault(GetSenderId(update), []).append(update)
+    for sender, group in groups.items():
+        if sender is not None:
+            groups[sender] = _CollapseUser(group)
+    return groups
+
+
+def _CollapseUser(updates: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """Drops the superseded updates of a user."""
+    keep = [True] * len(updates)
+    laterCmd = False
+    # Walking backward so that later updates are known...
+    cbMsgs: set[Any] = set()
+    for idx in range(len(updates) - 1, -1, -1):
+        cmd = _GetCommand(updates[idx])
+        if cmd is not None:
+            if laterCmd and cmd in _VIEW_CMDS:
+                keep[idx] = False
+            laterCmd = True
+            continue
+        callback = updates[idx].get('callback_query')
+        if callback is not None:
+            msgId = (callback.get('message') or {}).get('message_id')
+            if msgId in cbMsgs:
+                keep[idx] = False
+            cbMsgs.add(msgId)
+    return [update for update, kept in zip(updates, keep) if kept]
+
+
+def _GetCommand(update: dict[str, Any]) -> str | None:
+    """Gets the command of the raw update, typed or pressed, or `None` if
+    it is not a command.
+    """
+    if update.get('callback_query') is not None:
+        text = update['callback_query'].get('data')
+    elif update.get('message') is not None:
+        text = update['message'].get('text')
+    else:
+        return None
+    if not isinstance(text, str) or not text.startswith('/'):
+        return None
+    return text.split(maxsplit=1)[0].partition('@')[0].lower()
@@ -4,6 +4,8 @@
 """This sub-package offers database-related functionalities."""
 
 from abc import ABC, abstractmethod
+from struct import Struct
+from typing import Iterable
 
 
 type ID = int
@@ -12,6 +14,17 @@ as IDs of users or products in the database.
 """
 
 
+class PhoneTakenError(ValueError):
+    """Raised by `IDatabase.UpsertUser` if another user has already
+    registered the phone.
+    """
+    def __init__(self, user_id: ID, phone: str) -> None:
+        super().__init__(f'the phone {phone!r} of user {user_id} is '
+            'registered by another user')
+        self.UserId = user_id
+        self.Phone = phone
+
+
 class HourlyFrequencies:
     """Instances of this class hold frequencies (integers) for all 24
     hours of a day (from 0 to 23 inclusive). You can specifies the length
@@ -24,6 +37,11 @@ class HourlyFrequencies:
     This class is NOT thread-safe.
     """
 
+    _STRUCTS = {
+        n: Struct(f'>24{code}')
+        for n, code in ((1, 'B'), (2, 'H'), (4, 'I'), (8, 'Q'))}
+    """The layouts of serialized frequencies of the common lengths."""
+
     @classmethod
     def GetMax(cls, n: int) -> int:
         """Gets maximum frequency for the specified number of bytes."""
@@ -98,19 +116,27 @@ class HourlyFrequencies:
         necessary, the remaining part is filled with zeros, or If it is
         larger than necessary, the additional part will be ignored.
         """
-        from io import BytesIO
-        with BytesIO() as bufferObj:
-            for freq in self._freqs:
-                bufferObj.write(freq.to_bytes(self._nBytes))
-            buffer = bufferObj.getvalue()
-        return buffer
+        try:
+            return self._STRUCTS[self._nBytes].pack(*self._freqs)
+        except KeyError:
+            return b''.join(
+                freq.to_bytes(self._nBytes)
+                for freq in self._freqs)
     
     @Bytes.setter
-    def Bytes(self, __buf: bytes) -> None:
-        from io import BytesIO
-        with BytesIO(__buf) as bufObj:
-            for idx in range(24):
-                self._freqs[idx] = int.from_bytes(bufObj.read(self._nBytes))
+    def Bytes(self, __buf: bytes | None) -> None:
+        size = 24 * self._nBytes
+        if __buf is None:
+            __buf = b''
+        if len(__buf) < size:
+            __buf = __buf.ljust(size, b'\x00')
+        try:
+            self._freqs = list(
+                self._STRUCTS[self._nBytes].unpack_from(__buf))
+        except KeyError:
+            self._freqs = [
+                int.from_bytes(__buf[idx:idx + self._nBytes])
+                for idx in range(0, size, self._nBytes)]
     
     @property
     def Frequencies(self) -> tuple[int, ...]:
@@ -164,6 +190,23 @@ class HourlyFrequencies:
         """Increments the specified hour, normalizes if necessary."""
         self.SetHourFreq(__hour, self.GetHourFreq(__hour) + 1)
     
+    def AddFreqs(self, __counts: dict[int, int], /) -> None:
+        """Adds a batch of `hour -> count` to the frequencies and
+        normalizes at most once, which is much cheaper than calling
+        `Increment` for every access.
+
+        #### Exceptions:
+        * `IndexError`: hours must be 0<= hour <= 23
+        """
+        for hour, count in __counts.items():
+            if not 0 <= hour <= 23:
+                raise IndexError('hours must be between 0 and 23 inclusive')
+            self._freqs[hour] += count
+        # Normalizing if necessary...
+        n = self._GetExtraBits(max(self._freqs))
+        if n:
+            self._ShiftFreqs(n)
+    
     def _ShiftFreqs(self, __n: int, /) -> None:
         """Shifts all frequencies `n` bits. For positive integers this
         shift is to the right, for negatives to the left, and for zero
@@ -191,6 +234,207 @@ class HourlyFrequencies:
         return n
 
 
+class WeeklyActivity:
+    """Instances of this class model the activity of a user over the 168
+    hours of a week (7 weekdays × 24 hours, in local time) with
+    exponential time decay: an access counts half as much after each
+    `half_life` seconds, so recent behavior dominates and weekday and
+    weekend patterns stay apart.
+
+    Recording is O(1): instead of decaying all buckets on every access,
+    each access adds a weight which grows exponentially with time relative
+    to a landmark (forward decay). Buckets are rebased to a new landmark
+    only when weights grow too large.
+
+    Serialization (`Bytes`): a format version byte, the half-life and the
+    landmark (unsigned 32-bit integers), a float32 scale, and 168 unsigned
+    16-bit quantized scores; 349 bytes in total.
+
+    This class is NOT thread-safe.
+    """
+
+    VERSION = 1
+    """The format version of the serialized data."""
+
+    SLOTS = 168
+    """The number of weekday×hour buckets."""
+
+    _FORMAT = '>BIIf168H'
+
+    _ZEROS = (0,) * SLOTS
+
+    _MAX_WEIGHT = float(1 << 32)
+    """Rebasing happens once the weight of an access exceeds this."""
+
+    @classmethod
+    def GetSlot(cls, __time: float, /) -> int:
+        """Gets the bucket (`weekday * 24 + hour`, Monday being zero) of
+        the specified POSIX time in local time.
+        """
+        from time import localtime
+        tm = localtime(__time)
+        return tm.tm_wday * 24 + tm.tm_hour
+
+    def __init__(self, *, half_life: int = 14 * 86_400) -> None:
+        """Initializes a new instance of this type:
+        * `half_life`: the time in seconds after which an access counts
+        half as much.
+        """
+        self._halfLife = half_life
+        self._landmark = 0
+        """The POSIX time relative to which scores are scaled."""
+        self._scores = [0.0] * self.SLOTS
+    
+    def __repr__(self) -> str:
+        peak = self.GetPeakSlot()
+        return (f"<'{self.__class__.__qualname__}' object, "
+            f"half-life={self._halfLife}s, peak slot={peak}>")
+    
+    @property
+    def HalfLife(self) -> int:
+        """Gets the half-life of accesses in seconds."""
+        return self._halfLife
+    
+    @property
+    def Bytes(self) -> bytes:
+        """Gets or sets the activity as serialized (raw) data. Setting an
+        empty object resets the activity. It raises `ValueError` for an
+        unsupported format version.
+        """
+        from struct import pack
+        max_ = max(self._scores)
+        if max_:
+            scale = max_ / 0xff_ff
+            quantized = [round(score / scale) for score in self._scores]
+        else:
+            scale = 0.0
+            quantized = self._ZEROS
+        return pack(
+            self._FORMAT,
+            self.VERSION,
+            self._halfLife,
+            self._landmark,
+            scale,
+            *quantized)
+    
+    @Bytes.setter
+    def Bytes(self, __buf: bytes | None) -> None:
+        from struct import unpack
+        if not __buf:
+            self._landmark = 0
+            self._scores = [0.0] * self.SLOTS
+            return
+        if __buf[0] != self.VERSION:
+            raise ValueError('unsupported format version of activity: '
+                f'{__buf[0]}')
+        _, self._halfLife, self._landmark, scale, *quantized = unpack(
+            self._FORMAT,
+            __buf)
+        self._scores = (
+            [q * scale for q in quantized] if scale else
+            [0.0] * self.SLOTS)
+    
+    def Record(self, when: float | None = None, count: int = 1) -> None:
+        """Records `count` accesses at the specified POSIX time or now."""
+        from time import time
+        if when is None:
+            when = time()
+        self.AddToSlot(self.GetSlot(when), count, when)
+    
+    def AddToSlot(self, slot: int, count: int, when: float) -> None:
+        """Records `count` accesses of the specified slot as if they
+        happened at the specified POSIX time. This suits merging counters
+        which have been batched per slot.
+        """
+        if not self._landmark:
+            self._landmark = int(when)
+        weight = self._GetWeight(when)
+        if weight > self._MAX_WEIGHT:
+            self._Rebase(when)
+            weight = self._GetWeight(when)
+        self._scores[slot] += count * weight
+    
+    def GetScores(self, when: float | None = None) -> tuple[float, ...]:
+        """Gets the 168 decayed scores as of the specified POSIX time or
+        now. Each score roughly equals the number of recent accesses in
+        that slot.
+        """
+        from time import time
+        # Avoiding the weight relative to the epoch which overflows...
+        if not self._landmark:
+            return (0.0,) * self.SLOTS
+        if when is None:
+            when = time()
+        factor = 1 / self._GetWeight(when)
+        return tuple(score * factor for score in self._scores)
+    
+    def GetPeakSlot(self) -> int | None:
+        """Gets the most active weekday×hour slot or `None` if there has
+        been no activity. Decay does not change the order of slots.
+        """
+        max_ = max(self._scores)
+        return self._scores.index(max_) if max_ else None
+    
+    def GetPeakHour(self, weekday: int | None = None) -> int | None:
+        """Gets the most active hour of the specified weekday (Monday
+        being zero), or of all weekdays if omitted. It returns `None` if
+        there has been no activity.
+        """
+        if weekday is None:
+            hours = [
+                sum(self._scores[day * 24 + hour] for day in range(7))
+                for hour in range(24)]
+        else:
+            hours = self._scores[weekday * 24:(weekday + 1) * 24]
+        max_ = max(hours)
+        return hours.index(max_) if max_ else None
+    
+    def _GetWeight(self, __time: float, /) -> float:
+        return 2 ** ((__time - self._landmark) / self._halfLife)
+    
+    def _Rebase(self, __time: float, /) -> None:
+        """Moves the landmark to the specified time and scales scores."""
+        factor = 1 / self._GetWeight(__time)
+        self._scores = [score * factor for score in self._scores]
+        self._landmark = int(__time)
+
+
+class ProductData:
+    """This data structure contains information associated with a product
+    (course) of the Bot.
+
+    #### Characteristics
+    * Hash protocol: instances are hashable.
+    * Equality comparison
+    """
+    def __init__(self, id: ID, name: str) -> None:
+        self._id = id
+        self._name = name
+    
+    def __eq__(self, __other, /) -> bool:
+        if not isinstance(__other, self.__class__):
+            return NotImplemented
+        return self._id == __other._id
+    
+    def __hash__(self) -> int:
+        return self._id
+    
+    def __repr__(self) -> str:
+        return (f"<'{self.__class__.__qualname__}' object; ID={self._id}; "
+            f"name={self._name}>")
+    
+    @property
+    def Id(self) -> ID:
+        return self._id
+    
+    @property
+    def Name(self) -> str:
+        return self._name
+    
+    def AsTuple(self) -> tuple[int, str]:
+        return (self._id, self._name)
+
+
 class UserData:
     """This data structure contains information associated with a typical
     user of the Bot.
@@ -206,12 +450,18 @@ class UserData:
             last_name: str,
             phone: str,
             freqs: HourlyFrequencies | None = None,
+            activity: WeeklyActivity | None = None,
             ) -> None:
         self._id = id
         self._firstName = first_name
         self._lastName = last_name
         self._phone = phone
         self._hFreqs = freqs if freqs else HourlyFrequencies()
+        self._activity = activity if activity else WeeklyActivity()
+        self._courses: tuple[ProductData, ...] | None = None
+        """The cached courses of the user or `None` if not loaded yet."""
+        self._coursesAt = 0.0
+        """The monotonic time the courses were cached at."""
     
     def __eq__(self, __other, /) -> bool:
         if not isinstance(__other, self.__class__):
@@ -248,6 +498,30 @@ class UserData:
         """Gets hourly access frequencies."""
         return self._hFreqs
     
+    @property
+    def Activity(self) -> WeeklyActivity:
+        """Gets the time-decayed weekday×hour activity."""
+        return self._activity
+    
+    @property
+    def Courses(self) -> tuple[ProductData, ...] | None:
+        """Gets or sets the cached courses of the user. `None` means they
+        have not been loaded yet; set it to `None` to invalidate.
+        """
+        return self._courses
+    
+    @Courses.setter
+    def Courses(self, __courses: tuple[ProductData, ...] | None, /) -> None:
+        from time import monotonic
+        self._courses = __courses
+        self._coursesAt = monotonic()
+    
+    @property
+    def CoursesAge(self) -> float:
+        """Gets the seconds since the courses were cached."""
+        from time import monotonic
+        return monotonic() - self._coursesAt
+    
     def AsTuple(self) -> tuple[int, str, str, str, bytes]:
         return (
             self._id,
@@ -257,6 +531,73 @@ class UserData:
             self._hFreqs.Bytes)
 
 
+class BroadcastData:
+    """This data structure contains the state of a broadcast of a message
+    to all users. The progress attributes are checkpoints, so a broadcast
+    can resume after a crash:
+
+    * `Pass`: the current pass. A broadcast by peak hours makes 24 passes,
+    one per hour starting at `StartedAt`; others make only one.
+    * `Cursor`: the last user ID processed in the current pass or `None`.
+
+    A broadcast belongs to the bot of its `Brand`, so bots sharing a
+    database do not run the broadcasts of each other.
+    """
+    def __init__(
+            self,
+            id: ID,
+            text: str,
+            by_peak: bool,
+            started_at: int,
+            pass_: int = 0,
+            cursor: ID | None = None,
+            sent: int = 0,
+            failed: int = 0,
+            done: bool = False,
+            brand: str = '',
+            ) -> None:
+        self._id = id
+        self._text = text
+        self._brand = brand
+        self._byPeak = by_peak
+        self._startedAt = started_at
+        self.Pass = pass_
+        self.Cursor = cursor
+        self.Sent = sent
+        self.Failed = failed
+        self.Done = done
+    
+    def __repr__(self) -> str:
+        return (f"<'{self.__class__.__qualname__}' object; ID={self._id}; "
+            f"pass={self.Pass}; cursor={self.Cursor}; sent={self.Sent}; "
+            f"failed={self.Failed}; done={self.Done}>")
+    
+    @property
+    def Id(self) -> ID:
+        return self._id
+    
+    @property
+    def Text(self) -> str:
+        return self._text
+    
+    @property
+    def ByPeak(self) -> bool:
+        """Specifies whether each user gets the message at their peak
+        hour or not.
+        """
+        return self._byPeak
+    
+    @property
+    def StartedAt(self) -> int:
+        """Gets the POSIX time at which the broadcast was created."""
+        return self._startedAt
+    
+    @property
+    def Brand(self) -> str:
+        """Gets the brand of the bot which runs the broadcast."""
+        return self._brand
+
+
 class IDatabase(ABC):
     """This interface defines a blueprint to work with a database for
     the Bot.
@@ -286,7 +627,30 @@ class IDatabase(ABC):
     @abstractmethod
     def UpsertUser(self, user_data: UserData) -> None:
         """Updates the specified user in the users table or if the user
-        does not exist in the tablt, it will insert it.
+        does not exist in the tablt, it will insert it. Phones must be
+        unique among users once normalized (see `GetUserIdByPhone`), so
+        registering a phone of another user raises `PhoneTakenError`; a
+        stored duplicate phone (see `UpsertUsers`) stays unindexed as long
+        as it is unchanged.
+        """
+        pass
+
+    @abstractmethod
+    def UpsertUsers(self, users: Iterable[UserData]) -> int:
+        """Upserts many users in one transaction, consuming `users` in
+        chunks so that an iterator of any length takes constant memory.
+        Derived data (normalized phones, the full-text index & statistics)
+        stays in sync. A phone already registered by another user is kept
+        but not indexed, like the backfill of migration 6. It returns the
+        number of users upserted; upon errors nothing is written.
+        """
+        pass
+
+    @abstractmethod
+    def GetUserIdByPhone(self, phone: str) -> ID | None:
+        """Gets the ID of the user who has registered the phone, compared
+        in the normalized form of `utils.funcs.NormalizePhone`, or `None`
+        if no user has.
         """
         pass
 
@@ -295,3 +659,171 @@ class IDatabase(ABC):
         """Specifies whether an ID exists in the database or not."""
         pass
 
+    @abstractmethod
+    def GetProducts(
+            self,
+            limit: int,
+            *,
+            after: ID | None = None,
+            before: ID | None = None,
+            ) -> tuple[ProductData, ...]:
+        """Gets a page of at most `limit` products ordered by their IDs
+        (keyset pagination). If `after` is provided, the page starts just
+        after that product ID; if `before` is provided, the page ends just
+        before it. Without both, it returns the first page.
+        """
+        pass
+
+    @abstractmethod
+    def UpsertProduct(self, product: ProductData) -> None:
+        """Updates the specified product in the products table or if it
+        does not exist in the table, it will insert it.
+        """
+        pass
+
+    @abstractmethod
+    def UpsertProducts(self, products: Iterable[ProductData]) -> int:
+        """Upserts many products in one transaction and returns their
+        number. Like `UpsertUsers`, it takes constant memory.
+        """
+        pass
+
+    @abstractmethod
+    def AddUsersProducts(self, pairs: Iterable[tuple[ID, ID]]) -> int:
+        """Grants many `(user ID, product ID)` pairs in one transaction,
+        ignoring existing ones, and returns the number of pairs read.
+        """
+        pass
+
+    @abstractmethod
+    def GetUsersProductsPairs(
+            self,
+            limit: int,
+            *,
+            after: tuple[ID, ID] | None = None,
+            ) -> tuple[tuple[ID, ID], ...]:
+        """Gets a chunk of at most `limit` `(user ID, product ID)` pairs
+        ordered by both IDs, starting just after the `after` pair if
+        provided. This is suitable for streaming all the pairs.
+        """
+        pass
+
+    @abstractmethod
+    def GetUserProducts(self, __id: ID, /) -> tuple[ProductData, ...]:
+        """Gets the products (courses) of the specified user ordered by
+        their IDs.
+        """
+        pass
+
+    @abstractmethod
+    def GetUsersProducts(
+            self,
+            ids: Iterable[ID],
+            ) -> dict[ID, tuple[ProductData, ...]]:
+        """Gets the products of many users at once as a mapping of
+        `user ID -> products`. Users without products are mapped to empty
+        tuples.
+        """
+        pass
+
+    @abstractmethod
+    def GetProductOwners(self, __id: ID, /) -> tuple[ID, ...]:
+        """Gets the IDs of the users who own the specified product."""
+        pass
+
+    @abstractmethod
+    def GetUsers(
+            self,
+            limit: int,
+            *,
+            after: ID | None = None,
+            ) -> tuple[UserData, ...]:
+        """Gets a chunk of at most `limit` users ordered by their IDs,
+        starting just after the `after` user ID if provided. This is
+        suitable for streaming all users with constant memory.
+        """
+        pass
+
+    @abstractmethod
+    def CreateBroadcast(
+            self,
+            text: str,
+            by_peak: bool,
+            started_at: int,
+            *,
+            brand: str = '',
+            ) -> BroadcastData:
+        """Creates and returns a new broadcast of the bot of the brand."""
+        pass
+
+    @abstractmethod
+    def GetUnfinishedBroadcasts(
+            self,
+            *,
+            brand: str = '',
+            ) -> tuple[BroadcastData, ...]:
+        """Gets the broadcasts of the bot of the brand which have not
+        finished yet.
+        """
+        pass
+
+    @abstractmethod
+    def UpdateBroadcast(self, broadcast: BroadcastData) -> None:
+        """Saves the progress of the broadcast (checkpoint)."""
+        pass
+
+    @abstractmethod
+    def GetUsersCount(self) -> int:
+        """Gets the number of users from the statistics in O(1)."""
+        pass
+
+    @abstractmethod
+    def IncrementSignups(self, day: str) -> None:
+        """Counts a completed sign-up on the specified ISO day."""
+        pass
+
+    @abstractmethod
+    def GetSignups(self, days: int) -> tuple[tuple[str, int], ...]:
+        """Gets the sign-ups of the last `days` local days, today
+        included, as `(ISO day, count)` pairs, most recent first. Days
+        without sign-ups are left out.
+        """
+        pass
+
+    @abstractmethod
+    def AddActiveUsers(self, day: str, hour: int, count: int) -> None:
+        """Adds `count` distinct active users to the specified hour of the
+        ISO day.
+        """
+        pass
+
+    @abstractmethod
+    def GetActiveUsers(self, day: str) -> tuple[tuple[int, int], ...]:
+        """Gets the active users of the ISO day as `(hour, count)` pairs
+        for the hours with activity.
+        """
+        pass
+
+    @abstractmethod
+    def RebuildStats(self) -> tuple[int, int]:
+        """Recomputes the statistics which derive from the users table by
+        a full scan, for consistency checks. It returns the number of
+        users before and after the rebuild.
+        """
+        pass
+
+    @abstractmethod
+    def SearchUsers(
+            self,
+            query: str,
+            limit: int,
+            *,
+            after: ID | None = None,
+            ) -> tuple[UserData, ...]:
+        """Searches users by partial name or phone and returns a page of
+        at most `limit` matches ordered by their IDs, starting just after
+        the `after` user ID if provided. Persian characters and digits of
+        the query are normalized; terms shorter than three characters are
+        ignored.
+        """
+        pass
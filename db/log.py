@@ -0,0 +1,370 @@
+#
+#
+#
+"""This module realizes the `IDatabase` interface as an in-memory
+database (`MemoryDb`) backed by an append-only log file. Every change is
+appended as a record, so writes cost one `write` system call and no
+random I/O, which suits the write-heavy updates of access frequencies.
+Upon opening, the log is replayed to rebuild the state; a torn or
+corrupt tail, left by a crash in the middle of an append, is truncated.
+Once the log grows well beyond the live data, it is compacted into a
+snapshot of the current state. This module only offers `LogDb` class.
+
+#### Record layout:
+A fixed 9-byte header `>BII` (kind, payload length & CRC-32 of the kind
+and the payload) followed by the payload. Payloads start with a fixed
+part laid out by the `struct` formats below, followed by the UTF-8 texts
+and blobs whose lengths the fixed part holds.
+"""
+
+from contextlib import contextmanager
+import logging
+import os
+from os import PathLike
+from pathlib import Path
+from struct import Struct
+from typing import Iterator
+from zlib import crc32
+
+from . import ID, BroadcastData
+from .memory import MemoryDb, _UserRow
+from utils.funcs import NormalizePhone, PathLikeToPath
+
+
+_HEADER = Struct('>BII')
+
+_MAX_PAYLOAD = 1 << 24
+"""Longer payloads only come from corrupt headers."""
+
+_USER = (1, Struct('>qHHHHH'))
+"""A user: ID & the lengths of first name, last name, phone, hourly
+frequencies & weekly activity; followed by them.
+"""
+
+_USER_NO_PHONE = (2, _USER[1])
+"""A user whose phone is not indexed, being invalid or a duplicate."""
+
+_PRODUCT = (3, Struct('>qH'))
+"""A product: ID & the length of the name; followed by the name."""
+
+_PAIR = (4, Struct('>qq'))
+"""A product of a user: user ID & product ID."""
+
+_BROADCAST = (5, Struct('>q?qIq?II?I'))
+"""A broadcast: ID, by peak, started at, pass, cursor, whether the
+cursor is set, sent, failed, done & the length of the text; followed by
+the text.
+"""
+
+_SIGNUPS = (6, Struct('>10sI'))
+"""The sign-ups of an ISO day."""
+
+_ACTIVE = (7, Struct('>10sBI'))
+"""The active users of an hour of an ISO day."""
+
+_BRANDED_BROADCAST = (8, Struct('>q?qIq?II?IH'))
+"""A broadcast like `_BROADCAST` with the length of its brand too;
+followed by the text and the brand. Broadcasts are written in this kind
+and the old one is read as of the empty brand.
+"""
+
+
+class LogDb(MemoryDb):
+    """A `MemoryDb` persisted to an append-only log. Arguments are as
+    follow:
+
+    * `log_file`: the path of the log file; it is created if missing.
+    * `compact_ratio`: the log is compacted once it holds this many
+    times more records than the live data does.
+    * `compact_min`: the log is never compacted below this many records.
+    * `fsync`: whether every append is flushed to the disk. Otherwise
+    appends survive crashes of the process but not of the OS, and the log
+    is flushed to the disk at compactions and upon closing.
+    """
+
+    def __init__(
+            self,
+            log_file: PathLike,
+            *,
+            compact_ratio: float = 2.0,
+            compact_min: int = 100_000,
+            fsync: bool = False,
+            ) -> None:
+        super().__init__()
+        self._path = PathLikeToPath(log_file)
+        self._compactRatio = compact_ratio
+        self._compactMin = compact_min
+        self._fsync = fsync
+        self._nRecords = 0
+        """The number of records in the log."""
+        # Discarding a half-written snapshot of a crashed compaction...
+        self._TmpPath().unlink(missing_ok=True)
+        self._Replay()
+        self._fd = os.open(
+            self._path,
+            os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+            0o644)
+        """The file descriptor of the log opened for appending."""
+
+    def Close(self) -> None:
+        """Flushes the log to the disk and closes it."""
+        if self._fd < 0:
+            return
+        os.fsync(self._fd)
+        os.close(self._fd)
+        self._fd = -1
+
+    def Compact(self) -> None:
+        """Rewrites the log as a snapshot of the current state. The new
+        log replaces the old one atomically, so a crash in the middle
+        leaves the old log intact.
+        """
+        tmpPath = self._TmpPath()
+        nRecords = 0
+        with open(tmpPath, mode='wb') as fileObj:
+            for record in self._DumpRecords():
+                fileObj.write(record)
+                nRecords += 1
+            fileObj.flush()
+            os.fsync(fileObj.fileno())
+        os.close(self._fd)
+        os.replace(tmpPath, self._path)
+        self._FsyncDir()
+        self._fd = os.open(self._path, os.O_WRONLY | os.O_APPEND)
+        logging.info(f'compacted {self._path.name} from {self._nRecords} '
+            f'to {nRecords} records')
+        self._nRecords = nRecords
+
+    def _PutUser(self, id_: ID, row: _UserRow) -> None:
+        super()._PutUser(id_, row)
+        self._Append(self._PackUser(id_, row))
+
+    def _PutProduct(self, id_: ID, name: str) -> None:
+        super()._PutProduct(id_, name)
+        self._Append(self._PackProduct(id_, name))
+
+    def _PutPair(self, user_id: ID, prod_id: ID) -> None:
+        if prod_id in self._userProds.get(user_id, ()):
+            return
+        super()._PutPair(user_id, prod_id)
+        self._Append(self._Pack(_PAIR, (user_id, prod_id,)))
+
+    def _PutBroadcast(self, broadcast: BroadcastData) -> None:
+        super()._PutBroadcast(broadcast)
+        self._Append(self._PackBroadcast(
+            broadcast.Id,
+            self._broadcasts[broadcast.Id]))
+
+    def _PutSignups(self, day: str, count: int) -> None:
+        super()._PutSignups(day, count)
+        self._Append(self._Pack(_SIGNUPS, (day.encode(), count,)))
+
+    def _PutActive(self, day: str, hour: int, count: int) -> None:
+        super()._PutActive(day, hour, count)
+        self._Append(self._Pack(_ACTIVE, (day.encode(), hour, count,)))
+
+    @contextmanager
+    def _Bulk(self) -> Iterator[None]:
+        """Like `MemoryDb._Bulk`, it also cuts the records of a failed
+        bulk operation from the log.
+        """
+        offset = os.lseek(self._fd, 0, os.SEEK_END)
+        nRecords = self._nRecords
+        try:
+            with super()._Bulk():
+                yield
+        except BaseException:
+            os.ftruncate(self._fd, offset)
+            self._nRecords = nRecords
+            raise
+
+    def _Append(self, record: bytes) -> None:
+        """Appends the record to the log and compacts the log if it has
+        grown too much.
+        """
+        os.write(self._fd, record)
+        if self._fsync:
+            os.fsync(self._fd)
+        self._nRecords += 1
+        if self._undo is None and self._nRecords >= self._compactMin and \
+                self._nRecords > self._compactRatio * self._CountLive():
+            self.Compact()
+
+    def _Replay(self) -> None:
+        """Rebuilds the state from the log and truncates a corrupt tail."""
+        try:
+            fileObj = open(self._path, mode='r+b', buffering=1 << 20)
+        except FileNotFoundError:
+            return
+        with fileObj:
+            offset = 0
+            while True:
+                header = fileObj.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    break
+                kind, length, crc = _HEADER.unpack(header)
+                if length > _MAX_PAYLOAD:
+                    break
+                payload = fileObj.read(length)
+                if len(payload) < length or \
+                        crc32(payload, crc32(bytes((kind,)))) != crc:
+                    break
+                self._ApplyRecord(kind, memoryview(payload))
+                offset += _HEADER.size + length
+                self._nRecords += 1
+            size = fileObj.seek(0, os.SEEK_END)
+            if offset < size:
+                logging.warning(f'truncating {size - offset} bytes of a '
+                    f'corrupt tail of {self._path.name} at offset {offset}')
+                fileObj.truncate(offset)
+                fileObj.flush()
+                os.fsync(fileObj.fileno())
+
+    def _ApplyRecord(self, kind: int, payload: memoryview) -> None:
+        match kind:
+            case 1 | 2:
+                fmt = _USER[1]
+                id_, *lens = fmt.unpack_from(payload)
+                fields: list[bytes] = []
+                offset = fmt.size
+                for len_ in lens:
+                    fields.append(bytes(payload[offset:offset + len_]))
+                    offset += len_
+                first, last, phone, freqs, activity = fields
+                norm = None
+                if kind == _USER[0]:
+                    norm = NormalizePhone(phone.decode())
+                MemoryDb._PutUser(
+                    self,
+                    id_,
+                    (
+                        first.decode(),
+                        last.decode(),
+                        phone.decode(),
+                        freqs,
+                        activity,
+                        norm,))
+            case 3:
+                fmt = _PRODUCT[1]
+                id_, len_ = fmt.unpack_from(payload)
+                name = bytes(payload[fmt.size:fmt.size + len_]).decode()
+                MemoryDb._PutProduct(self, id_, name)
+            case 4:
+                MemoryDb._PutPair(self, *_PAIR[1].unpack_from(payload))
+            case 5 | 8:
+                if kind == _BROADCAST[0]:
+                    fmt = _BROADCAST[1]
+                    (id_, byPeak, startedAt, pass_, cursor, hasCursor, sent,
+                        failed, done, len_) = fmt.unpack_from(payload)
+                    brandLen = 0
+                else:
+                    fmt = _BRANDED_BROADCAST[1]
+                    (id_, byPeak, startedAt, pass_, cursor, hasCursor, sent,
+                        failed, done, len_, brandLen) = fmt.unpack_from(
+                            payload)
+                offset = fmt.size + len_
+                text = bytes(payload[fmt.size:offset]).decode()
+                brand = bytes(payload[offset:offset + brandLen]).decode()
+                MemoryDb._PutBroadcast(self, BroadcastData(
+                    id_,
+                    text,
+                    byPeak,
+                    startedAt,
+                    pass_,
+                    cursor if hasCursor else None,
+                    sent,
+                    failed,
+                    done,
+                    brand))
+            case 6:
+                day, count = _SIGNUPS[1].unpack_from(payload)
+                MemoryDb._PutSignups(self, day.decode(), count)
+            case 7:
+                day, hour, count = _ACTIVE[1].unpack_from(payload)
+                MemoryDb._PutActive(self, day.decode(), hour, count)
+            case _:
+                raise ValueError(f'unknown record kind {kind} in '
+                    f'{self._path.name}')
+
+    def _DumpRecords(self) -> Iterator[bytes]:
+        """Yields the records of a snapshot of the current state."""
+        for id_ in self._userIds:
+            yield self._PackUser(id_, self._users[id_])
+        for id_ in self._productIds:
+            yield self._PackProduct(id_, self._products[id_])
+        for pair in self._pairs:
+            yield self._Pack(_PAIR, pair)
+        for id_, row in self._broadcasts.items():
+            yield self._PackBroadcast(id_, row)
+        for day, count in self._signups.items():
+            yield self._Pack(_SIGNUPS, (day.encode(), count,))
+        for (day, hour), count in self._active.items():
+            yield self._Pack(_ACTIVE, (day.encode(), hour, count,))
+
+    def _CountLive(self) -> int:
+        """Counts the records of a snapshot of the current state."""
+        return (len(self._users) + len(self._products) + len(self._pairs) +
+            len(self._broadcasts) + len(self._signups) + len(self._active))
+
+    def _PackUser(self, id_: ID, row: _UserRow) -> bytes:
+        first, last, phone = (text.encode() for text in row[:3])
+        fields = (first, last, phone, row[3], row[4],)
+        kind = _USER if row[5] is not None else _USER_NO_PHONE
+        return self._Pack(
+            kind,
+            (id_, *(len(field) for field in fields),),
+            *fields)
+
+    def _PackProduct(self, id_: ID, name: str) -> bytes:
+        nameBytes = name.encode()
+        return self._Pack(_PRODUCT, (id_, len(nameBytes),), nameBytes)
+
+    def _PackBroadcast(self, id_: ID, row: tuple) -> bytes:
+        text, byPeak, startedAt, pass_, cursor, sent, failed, done, brand = row
+        textBytes = text.encode()
+        brandBytes = brand.encode()
+        return self._Pack(
+            _BRANDED_BROADCAST,
+            (
+                id_,
+                byPeak,
+                startedAt,
+                pass_,
+                0 if cursor is None else cursor,
+                cursor is not None,
+                sent,
+                failed,
+                done,
+                len(textBytes),
+                len(brandBytes),
+            ),
+            textBytes,
+            brandBytes)
+
+    @staticmethod
+    def _Pack(
+            kind: tuple[int, Struct],
+            values: tuple,
+            *tail: bytes,
+            ) -> bytes:
+        """Makes a record of the kind from the values of its fixed part
+        and the tail.
+        """
+        code, fmt = kind
+        payload = b''.join((fmt.pack(*values), *tail))
+        crc = crc32(payload, crc32(bytes((code,))))
+        return _HEADER.pack(code, len(payload), crc) + payload
+
+    def _TmpPath(self) -> Path:
+        return self._path.with_name(self._path.name + '.tmp')
+
+    def _FsyncDir(self) -> None:
+        """Makes the replacement of the log durable."""
+        try:
+            fd = os.open(self._path.parent, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
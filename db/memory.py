@@ -0,0 +1,380 @@
+#
+#
+#
+"""This module realizes the `IDatabase` interface on plain dictionaries
+in memory, which suits tests and benchmarks of the pools without the
+noise of Sqlite3. Nothing survives the process unless a subclass
+persists it (see `db.log`). This module only offers `MemoryDb` class.
+"""
+
+from bisect import bisect_left, bisect_right, insort
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator
+
+from . import (
+    ID, BroadcastData, HourlyFrequencies, IDatabase, PhoneTakenError,
+    ProductData, UserData, WeeklyActivity)
+from utils.funcs import NormalizeFaText, NormalizePhone
+
+
+type _UserRow = tuple[str, str, str, bytes, bytes, str | None]
+"""A stored user as `(first name, last name, phone, hourly frequencies,
+weekly activity, normalized phone)`. Users are stored serialized, like in
+a real database, so callers never share objects with the storage.
+"""
+
+type _BroadcastRow = tuple[
+    str, bool, int, int, ID | None, int, int, bool, str]
+"""A stored broadcast as `(text, by peak, started at, pass, cursor, sent,
+failed, done, brand)`.
+"""
+
+
+class MemoryDb(IDatabase):
+    """An in-memory database. It follows the semantics of `SqliteDb`:
+    keyset pages are ordered by IDs, phones are unique once normalized,
+    and bulk methods are all-or-nothing.
+    """
+
+    def __init__(self) -> None:
+        self._users: dict[ID, _UserRow] = {}
+        self._userIds: list[ID] = []
+        """The sorted IDs of users for keyset pagination."""
+        self._nUsers = 0
+        """The statistics of the number of users, maintained like the
+        counting triggers of `SqliteDb`.
+        """
+        self._phones: dict[str, ID] = {}
+        """The index of `normalized phone -> user ID`."""
+        self._fts: dict[ID, str] = {}
+        """The normalized searchable text of every user."""
+        self._products: dict[ID, str] = {}
+        self._productIds: list[ID] = []
+        """The sorted IDs of products for keyset pagination."""
+        self._pairs: list[tuple[ID, ID]] = []
+        """The sorted `(user ID, product ID)` pairs."""
+        self._userProds: dict[ID, set[ID]] = {}
+        self._owners: dict[ID, set[ID]] = {}
+        self._broadcasts: dict[ID, _BroadcastRow] = {}
+        self._signups: dict[str, int] = {}
+        self._active: dict[tuple[str, int], int] = {}
+        self._undo: list[Callable[[], None]] | None = None
+        """The undo actions of the running bulk operation, or `None`
+        outside bulk operations.
+        """
+
+    def Close(self) -> None:
+        pass
+
+    def GetAllUserIds(self) -> tuple[int, ...]:
+        return tuple(self._userIds)
+
+    def GetUser(self, __id: ID) -> UserData | None:
+        try:
+            return self._RowToUser(__id, self._users[__id])
+        except KeyError:
+            return None
+
+    def GetUsers(
+            self,
+            limit: int,
+            *,
+            after: ID | None = None,
+            ) -> tuple[UserData, ...]:
+        start = 0 if after is None else bisect_right(self._userIds, after)
+        return tuple(
+            self._RowToUser(id_, self._users[id_])
+            for id_ in self._userIds[start:start + limit])
+
+    def UpsertUser(self, user_data: UserData) -> None:
+        """Upserts the user. It raises `PhoneTakenError` if another user
+        has already registered the phone, unless the user is a stored
+        duplicate whose phone is unchanged.
+        """
+        row = self._UserToRow(user_data)
+        owner = self._phones.get(row[5], user_data._id)
+        if owner != user_data._id:
+            old = self._users.get(user_data._id)
+            if old is None or old[5] is not None or old[2] != row[2]:
+                raise PhoneTakenError(user_data._id, user_data._phone)
+            # Keeping the duplicate phone without indexing it...
+            row = row[:5] + (None,)
+        self._PutUser(user_data._id, row)
+
+    def UpsertUsers(self, users: Iterable[UserData]) -> int:
+        count = 0
+        with self._Bulk():
+            for user in users:
+                row = self._UserToRow(user)
+                # Keeping duplicate phones without indexing them...
+                if self._phones.get(row[5], user._id) != user._id:
+                    row = row[:5] + (None,)
+                self._PutUser(user._id, row)
+                count += 1
+        return count
+
+    def GetUserIdByPhone(self, phone: str) -> ID | None:
+        norm = NormalizePhone(phone)
+        return None if norm is None else self._phones.get(norm)
+
+    def DoesIdExist(self, __id: int) -> bool:
+        return __id in self._users
+
+    def GetProducts(
+            self,
+            limit: int,
+            *,
+            after: ID | None = None,
+            before: ID | None = None,
+            ) -> tuple[ProductData, ...]:
+        if before is not None:
+            end = bisect_left(self._productIds, before)
+            ids = self._productIds[max(0, end - limit):end]
+        else:
+            start = 0 if after is None else bisect_right(
+                self._productIds,
+                after)
+            ids = self._productIds[start:start + limit]
+        return tuple(ProductData(id_, self._products[id_]) for id_ in ids)
+
+    def UpsertProduct(self, product: ProductData) -> None:
+        self._PutProduct(product.Id, product.Name)
+
+    def UpsertProducts(self, products: Iterable[ProductData]) -> int:
+        count = 0
+        with self._Bulk():
+            for product in products:
+                self._PutProduct(product.Id, product.Name)
+                count += 1
+        return count
+
+    def GetUserProducts(self, __id: ID, /) -> tuple[ProductData, ...]:
+        return tuple(
+            ProductData(prodId, self._products[prodId])
+            for prodId in sorted(self._userProds.get(__id, ())))
+
+    def GetUsersProducts(
+            self,
+            ids: Iterable[ID],
+            ) -> dict[ID, tuple[ProductData, ...]]:
+        return {id_: self.GetUserProducts(id_) for id_ in ids}
+
+    def GetProductOwners(self, __id: ID, /) -> tuple[ID, ...]:
+        return tuple(sorted(self._owners.get(__id, ())))
+
+    def AddUsersProducts(self, pairs: Iterable[tuple[ID, ID]]) -> int:
+        count = 0
+        with self._Bulk():
+            for userId, prodId in pairs:
+                self._PutPair(userId, prodId)
+                count += 1
+        return count
+
+    def GetUsersProductsPairs(
+            self,
+            limit: int,
+            *,
+            after: tuple[ID, ID] | None = None,
+            ) -> tuple[tuple[ID, ID], ...]:
+        start = 0 if after is None else bisect_right(self._pairs, after)
+        return tuple(self._pairs[start:start + limit])
+
+    def CreateBroadcast(
+            self,
+            text: str,
+            by_peak: bool,
+            started_at: int,
+            *,
+            brand: str = '',
+            ) -> BroadcastData:
+        id_ = max(self._broadcasts, default=0) + 1
+        broadcast = BroadcastData(id_, text, by_peak, started_at, brand=brand)
+        self._PutBroadcast(broadcast)
+        return broadcast
+
+    def GetUnfinishedBroadcasts(
+            self,
+            *,
+            brand: str = '',
+            ) -> tuple[BroadcastData, ...]:
+        return tuple(
+            BroadcastData(id_, *row)
+            for id_, row in sorted(self._broadcasts.items())
+            if not row[7] and row[8] == brand)
+
+    def UpdateBroadcast(self, broadcast: BroadcastData) -> None:
+        if broadcast.Id in self._broadcasts:
+            self._PutBroadcast(broadcast)
+
+    def GetUsersCount(self) -> int:
+        return self._nUsers
+
+    def IncrementSignups(self, day: str) -> None:
+        self._PutSignups(day, self._signups.get(day, 0) + 1)
+
+    def GetSignups(self, days: int) -> tuple[tuple[str, int], ...]:
+        from datetime import date, timedelta
+        first = (date.today() - timedelta(days=days - 1)).isoformat()
+        return tuple(
+            (day, self._signups[day],)
+            for day in sorted(self._signups, reverse=True)
+            if day >= first)
+
+    def AddActiveUsers(self, day: str, hour: int, count: int) -> None:
+        self._PutActive(day, hour, self._active.get((day, hour), 0) + count)
+
+    def GetActiveUsers(self, day: str) -> tuple[tuple[int, int], ...]:
+        return tuple(
+            (hour, self._active[(day, hour)],)
+            for hour in range(24)
+            if (day, hour) in self._active)
+
+    def RebuildStats(self) -> tuple[int, int]:
+        before = self._nUsers
+        self._nUsers = len(self._users)
+        return (before, self._nUsers,)
+
+    def SearchUsers(
+            self,
+            query: str,
+            limit: int,
+            *,
+            after: ID | None = None,
+            ) -> tuple[UserData, ...]:
+        terms = [
+            term
+            for term in NormalizeFaText(query).split()
+            if len(term) >= 3]
+        if not terms:
+            return ()
+        start = 0 if after is None else bisect_right(self._userIds, after)
+        result: list[UserData] = []
+        for id_ in self._userIds[start:]:
+            text = self._fts[id_]
+            if all(term in text for term in terms):
+                result.append(self._RowToUser(id_, self._users[id_]))
+                if len(result) >= limit:
+                    break
+        return tuple(result)
+
+    def _PutUser(self, id_: ID, row: _UserRow) -> None:
+        """Stores the user row and maintains the indexes. All changes of
+        users go through this method.
+        """
+        old = self._users.get(id_)
+        if old is None:
+            insort(self._userIds, id_)
+            self._nUsers += 1
+        elif old[5] is not None and self._phones.get(old[5]) == id_:
+            del self._phones[old[5]]
+        self._users[id_] = row
+        if row[5] is not None:
+            self._phones[row[5]] = id_
+        # Separating the columns so that terms do not match across them...
+        self._fts[id_] = '\n'.join((
+            NormalizeFaText(f'{row[0]} {row[1]}'),
+            NormalizeFaText(row[2]),))
+        if self._undo is not None:
+            self._undo.append(lambda: self._RestoreUser(id_, old))
+
+    def _RestoreUser(self, id_: ID, old: _UserRow | None) -> None:
+        if old is not None:
+            # Bypassing the overrides as undoing is not a change...
+            MemoryDb._PutUser(self, id_, old)
+            return
+        row = self._users.pop(id_)
+        del self._userIds[bisect_right(self._userIds, id_) - 1]
+        self._nUsers -= 1
+        del self._fts[id_]
+        if row[5] is not None and self._phones.get(row[5]) == id_:
+            del self._phones[row[5]]
+
+    def _PutProduct(self, id_: ID, name: str) -> None:
+        """Stores the product. All changes of products go through this
+        method.
+        """
+        old = self._products.get(id_)
+        if old is None:
+            insort(self._productIds, id_)
+        self._products[id_] = name
+        if self._undo is not None:
+            self._undo.append(lambda: self._RestoreProduct(id_, old))
+
+    def _RestoreProduct(self, id_: ID, old: str | None) -> None:
+        if old is not None:
+            self._products[id_] = old
+            return
+        del self._products[id_]
+        del self._productIds[bisect_right(self._productIds, id_) - 1]
+
+    def _PutPair(self, user_id: ID, prod_id: ID) -> None:
+        """Grants the product to the user unless already granted. All
+        changes of the products of users go through this method.
+        """
+        prods = self._userProds.setdefault(user_id, set())
+        if prod_id in prods:
+            return
+        prods.add(prod_id)
+        self._owners.setdefault(prod_id, set()).add(user_id)
+        insort(self._pairs, (user_id, prod_id,))
+        if self._undo is not None:
+            self._undo.append(lambda: self._RemovePair(user_id, prod_id))
+
+    def _RemovePair(self, user_id: ID, prod_id: ID) -> None:
+        self._userProds[user_id].discard(prod_id)
+        self._owners[prod_id].discard(user_id)
+        del self._pairs[bisect_right(self._pairs, (user_id, prod_id,)) - 1]
+
+    def _PutBroadcast(self, broadcast: BroadcastData) -> None:
+        """Stores the checkpoint of the broadcast."""
+        self._broadcasts[broadcast.Id] = (
+            broadcast.Text,
+            broadcast.ByPeak,
+            broadcast.StartedAt,
+            broadcast.Pass,
+            broadcast.Cursor,
+            broadcast.Sent,
+            broadcast.Failed,
+            broadcast.Done,
+            broadcast.Brand,)
+
+    def _PutSignups(self, day: str, count: int) -> None:
+        """Sets the sign-ups of the ISO day."""
+        self._signups[day] = count
+
+    def _PutActive(self, day: str, hour: int, count: int) -> None:
+        """Sets the active users of the hour of the ISO day."""
+        self._active[(day, hour)] = count
+
+    @contextmanager
+    def _Bulk(self) -> Iterator[None]:
+        """Rolls back all the changes made inside this context if an
+        exception propagates.
+        """
+        self._undo = []
+        try:
+            yield
+        except BaseException:
+            undo, self._undo = self._undo, None
+            for action in reversed(undo):
+                action()
+            raise
+        finally:
+            self._undo = None
+
+    def _UserToRow(self, user_data: UserData) -> _UserRow:
+        return (
+            user_data._firstName,
+            user_data._lastName,
+            user_data._phone,
+            user_data._hFreqs.Bytes,
+            user_data._activity.Bytes,
+            NormalizePhone(user_data._phone),)
+
+    def _RowToUser(self, id_: ID, row: _UserRow) -> UserData:
+        hourlyFreqs = HourlyFrequencies()
+        hourlyFreqs.Bytes = row[3]
+        activity = WeeklyActivity()
+        activity.Bytes = row[4]
+        return UserData(id_, row[0], row[1], row[2], hourlyFreqs, activity)
+
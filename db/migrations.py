@@ -0,0 +1,285 @@
+#
+#
+#
+"""This module offers the versioned schema migrations of the Sqlite3
+database of the Bot. Migrations are applied in order, each one inside
+its own transaction, and recorded in the `schema_version` table. Indexes
+are declared separately and verified on every start, so a new query path
+ships together with the indexes it needs.
+
+#### Functions:
+1. `Upgrade`: migrates the database, verifies indexes, and then analyzes
+the database if anything changed.
+2. `Migrate`
+3. `VerifyIndexes`
+"""
+
+import logging
+import sqlite3
+from typing import Callable, NamedTuple
+
+
+class Migration(NamedTuple):
+    """A version of the schema made of steps. Each step is either an SQL
+    statement or a callable which accepts the connection. Steps should be
+    idempotent (e.g. `IF NOT EXISTS`) so that a database created by hand
+    before versioning upgrades cleanly.
+    """
+    version: int
+    name: str
+    steps: tuple[str | Callable[[sqlite3.Connection], None], ...]
+
+
+class IndexDecl(NamedTuple):
+    """The declaration of an index which must exist in the database."""
+    name: str
+    table: str
+    columns: tuple[str, ...]
+    unique: bool = False
+    where: str | None = None
+
+    def GetSql(self) -> str:
+        """Gets the `CREATE INDEX` statement of this declaration."""
+        unique = 'UNIQUE ' if self.unique else ''
+        sql = (f'CREATE {unique}INDEX {self.name} ON {self.table} '
+            f'({", ".join(self.columns)})')
+        if self.where:
+            sql += f' WHERE {self.where}'
+        return sql
+
+
+def _AddColumn(
+        table: str,
+        column: str,
+        decl: str,
+        ) -> Callable[[sqlite3.Connection], None]:
+    """Gets an idempotent migration step which adds a column to a table
+    unless it already exists.
+    """
+    def _Step(conn: sqlite3.Connection) -> None:
+        columns = {row[1] for row in conn.execute(
+            f'PRAGMA table_info({table});')}
+        if column not in columns:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {decl};')
+    return _Step
+
+
+def _FillUsersFts(conn: sqlite3.Connection) -> None:
+    """Fills the full-text index of users from the users table."""
+    from utils.funcs import NormalizeFaText
+    cur = conn.execute(
+        'SELECT user_id, first_name, last_name, phone FROM users;')
+    while rows := cur.fetchmany(1_000):
+        conn.executemany(
+            'INSERT OR REPLACE INTO users_fts(rowid, name, phone) '
+            'VALUES (?, ?, ?);',
+            (
+                (id_, NormalizeFaText(f'{first} {last}'), NormalizeFaText(ph))
+                for id_, first, last, ph in rows))
+
+
+def _FillPhoneNorm(conn: sqlite3.Connection) -> None:
+    """Fills the normalized phones of users. Later duplicates of a phone
+    and invalid phones are left `NULL` to satisfy the unique index.
+    """
+    from utils.funcs import NormalizePhone
+    seen: set[str] = set()
+    updates: list[tuple[str, int]] = []
+    cur = conn.execute('SELECT user_id, phone FROM users ORDER BY user_id;')
+    while rows := cur.fetchmany(1_000):
+        for id_, phone in rows:
+            norm = NormalizePhone(phone)
+            if norm is None:
+                continue
+            if norm in seen:
+                logging.warning(f'phone of user {id_} is a duplicate')
+                continue
+            seen.add(norm)
+            updates.append((norm, id_,))
+    conn.executemany(
+        'UPDATE users SET phone_norm = ? WHERE user_id = ?;',
+        updates)
+
+
+MIGRATIONS: tuple[Migration, ...] = (
+    Migration(1, 'baseline schema', (
+        """CREATE TABLE IF NOT EXISTS users (
+            user_id INT PRIMARY KEY,
+            first_name TEXT NOT NULL,
+            last_name TEXT NOT NULL,
+            phone TEXT NOT NULL,
+            hourly_freqs BLOB) WITHOUT ROWID, STRICT;""",
+        """CREATE TABLE IF NOT EXISTS products (
+            prod_id INTEGER PRIMARY KEY,
+            prod_name TEXT NOT NULL) WITHOUT ROWID, STRICT;""",
+        """CREATE TABLE IF NOT EXISTS user_proc (
+            user_id REFERENCES users (user_id) ON DELETE CASCADE NOT NULL,
+            proc_id REFERENCES products (prod_id) NOT NULL,
+            UNIQUE (user_id, proc_id));""",)),
+    Migration(2, 'weekly activity of users', (
+        _AddColumn('users', 'weekly_activity', 'BLOB'),)),
+    Migration(3, 'broadcasts', (
+        """CREATE TABLE IF NOT EXISTS broadcasts (
+            bc_id INTEGER PRIMARY KEY,
+            text TEXT NOT NULL,
+            by_peak INT NOT NULL,
+            started_at INT NOT NULL,
+            pass INT NOT NULL DEFAULT 0,
+            cursor INT,
+            sent INT NOT NULL DEFAULT 0,
+            failed INT NOT NULL DEFAULT 0,
+            done INT NOT NULL DEFAULT 0) STRICT;""",)),
+    Migration(4, 'statistics', (
+        """CREATE TABLE IF NOT EXISTS stats_totals (
+            key TEXT PRIMARY KEY,
+            value INT NOT NULL) WITHOUT ROWID, STRICT;""",
+        """CREATE TABLE IF NOT EXISTS stats_signups (
+            day TEXT PRIMARY KEY,
+            count INT NOT NULL) WITHOUT ROWID, STRICT;""",
+        """CREATE TABLE IF NOT EXISTS stats_active (
+            day TEXT NOT NULL,
+            hour INT NOT NULL,
+            count INT NOT NULL,
+            PRIMARY KEY (day, hour)) WITHOUT ROWID, STRICT;""",
+        """INSERT OR IGNORE INTO
+            stats_totals(key, value)
+        SELECT
+            'users', COUNT(*)
+        FROM
+            users;""",
+        """CREATE TRIGGER IF NOT EXISTS users_count_ins
+        AFTER INSERT ON users
+        BEGIN
+            UPDATE stats_totals SET value = value + 1 WHERE key = 'users';
+        END;""",
+        """CREATE TRIGGER IF NOT EXISTS users_count_del
+        AFTER DELETE ON users
+        BEGIN
+            UPDATE stats_totals SET value = value - 1 WHERE key = 'users';
+        END;""",)),
+    Migration(5, 'full-text search of users', (
+        """CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+            name,
+            phone,
+            tokenize = 'trigram');""",
+        """CREATE TRIGGER IF NOT EXISTS users_fts_del
+        AFTER DELETE ON users
+        BEGIN
+            DELETE FROM users_fts WHERE rowid = old.user_id;
+        END;""",
+        _FillUsersFts,)),
+    Migration(6, 'normalized phones of users', (
+        _AddColumn('users', 'phone_norm', 'TEXT'),
+        _FillPhoneNorm,)),
+    Migration(7, 'brands of broadcasts', (
+        _AddColumn('broadcasts', 'brand', "TEXT NOT NULL DEFAULT ''"),)),
+)
+"""All the migrations in the order of their versions."""
+
+INDEXES: tuple[IndexDecl, ...] = (
+    IndexDecl('user_proc_proc_id_idx', 'user_proc', ('proc_id',)),
+    IndexDecl('broadcasts_done_idx', 'broadcasts', ('done',), where='NOT done'),
+    IndexDecl(
+        'users_phone_norm_idx',
+        'users',
+        ('phone_norm',),
+        unique=True,
+        where='phone_norm IS NOT NULL'),
+)
+"""All the indexes the queries of `SqliteDb` rely on."""
+
+
+def Upgrade(conn: sqlite3.Connection) -> None:
+    """Brings the database up to date: applies pending migrations,
+    verifies the declared indexes, and runs `ANALYZE` afterwards if
+    anything changed.
+    """
+    migrated = Migrate(conn)
+    indexed = VerifyIndexes(conn)
+    if migrated or indexed:
+        conn.execute('ANALYZE;')
+        conn.commit()
+
+
+def GetVersion(conn: sqlite3.Connection) -> int:
+    """Gets the current schema version of the database or zero for an
+    unversioned database.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP);""")
+    conn.commit()
+    row = conn.execute('SELECT MAX(version) FROM schema_version;').fetchone()
+    return row[0] or 0
+
+
+def Migrate(conn: sqlite3.Connection) -> bool:
+    """Applies the pending migrations in order and returns whether any
+    migration was applied. A failed migration is rolled back and its
+    exception propagates. Several processes may migrate the same
+    database at once; each migration is applied by only one of them.
+    """
+    version = GetVersion(conn)
+    applied = False
+    for migration in MIGRATIONS:
+        if migration.version <= version:
+            continue
+        conn.execute('BEGIN IMMEDIATE;')
+        # Reading the version again as another process might have
+        # migrated the database meanwhile...
+        version = conn.execute(
+            'SELECT MAX(version) FROM schema_version;').fetchone()[0] or 0
+        if migration.version <= version:
+            conn.rollback()
+            continue
+        logging.info(f'migrating the database to version '
+            f'{migration.version}: {migration.name}')
+        try:
+            for step in migration.steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(
+                'INSERT INTO schema_version(version, name) VALUES (?, ?);',
+                (migration.version, migration.name,))
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+        applied = True
+    return applied
+
+
+def VerifyIndexes(conn: sqlite3.Connection) -> bool:
+    """Creates the declared indexes which are missing and re-creates
+    those which differ from their declarations. It returns whether any
+    index was created. Indexes are read and changed in one immediate
+    transaction, so processes verifying at once do not race.
+    """
+    sql = "SELECT name, sql FROM sqlite_master WHERE type = 'index';"
+    changed = False
+    conn.execute('BEGIN IMMEDIATE;')
+    try:
+        existing = {
+            name: ' '.join(sql.split())
+            for name, sql in conn.execute(sql)
+            if sql is not None}
+        for index in INDEXES:
+            expected = index.GetSql()
+            if existing.get(index.name) == ' '.join(expected.split()):
+                continue
+            if index.name in existing:
+                logging.info(f're-creating the {index.name} index')
+                conn.execute(f'DROP INDEX {index.name};')
+            else:
+                logging.info(f'creating the {index.name} index')
+            conn.execute(expected)
+            changed = True
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+    return changed
@@ -4,24 +4,176 @@
 """This module realizes the `IDatabase` interface on top of Python
 Sqlite3. This module only offers `SqliteDb` class."""
 
+import logging
 from os import PathLike
 import sqlite3
+from typing import Any, Iterable
 
 from db import UserData
 
-from . import HourlyFrequencies, IDatabase
+from . import (
+    ID, BroadcastData, HourlyFrequencies, IDatabase, PhoneTakenError,
+    ProductData, WeeklyActivity)
+from .migrations import Upgrade
+from utils.funcs import NormalizeFaText, NormalizePhone
 
 
 class SqliteDb(IDatabase):
-    def __init__(self, db_file: PathLike) -> None:
-        """Initializes a new database instance from the provided path."""
-        self._conn = sqlite3.connect(db_file)
-        """The connection object of the database."""
+
+    _MAX_VARS = 500
+    """The maximum number of variables in a single SQL statement."""
+
+    _BULK_CHUNK = 10_000
+    """The number of rows of every `executemany` of bulk methods."""
+
+    _SYNC_PAGES = 1_024
+    """The number of pages every step of syncing copies to the file."""
+
+    _USER_COLS = ('user_id, first_name, last_name, phone, hourly_freqs, '
+        'weekly_activity')
+    """The columns of the users table in the order of `UserData`."""
+
+    def __init__(
+            self,
+            db_file: PathLike,
+            *,
+            wal: bool = False,
+            in_memory: bool = False,
+            sync_interval: float = 30.0,
+            ) -> None:
+        """Initializes a new database instance from the provided path and
+        upgrades its schema if necessary (see `db.migrations`). If `wal` is
+        `True`, the database is switched to WAL journal mode so that several
+        processes can share it.
+
+        If `in_memory` is `True`, the database is loaded into memory and
+        serves all queries from there. Changes are copied back to the file
+        at most `sync_interval` seconds after they are made (the window of
+        changes a crash can lose), by `SyncAsync`, `Sync`, and upon
+        closing.
+        """
+        from asyncio import Task, TimerHandle
+        from threading import Lock
+        self._disk: sqlite3.Connection | None = None
+        """The connection of the file in the in-memory mode, otherwise
+        `None`. Syncing uses it on worker threads under `_diskLock`.
+        """
+        self._diskLock = Lock()
+        self._syncInterval = sync_interval
+        self._syncTimer: TimerHandle | None = None
+        self._syncTask: Task | None = None
+        """The running scheduled sync, if any."""
+        self._syncedChanges = 0
+        """The total changes of the connection at the last sync."""
+        if in_memory:
+            self._disk = sqlite3.connect(db_file, check_same_thread=False)
+            Upgrade(self._disk)
+            self._conn = sqlite3.connect(':memory:')
+            self._disk.backup(self._conn)
+            self._syncedChanges = self._conn.total_changes
+        else:
+            self._conn = sqlite3.connect(db_file)
+            """The connection object of the database."""
+            if wal:
+                self._conn.execute('PRAGMA journal_mode=WAL;')
+                self._conn.execute('PRAGMA synchronous=NORMAL;')
+            Upgrade(self._conn)
     
     def Close(self) -> None:
-        """Closes the database."""
+        """Closes the database. In the in-memory mode, it syncs the file
+        first.
+        """
+        if self._disk is not None:
+            self.Sync()
+            self._disk.close()
         self._conn.close()
     
+    def Sync(self) -> bool:
+        """Copies the in-memory database to the file if anything has
+        changed since the last sync, and returns whether it copied. The
+        file is replaced in a single transaction, so it always holds a
+        consistent snapshot. It blocks until the copy is on the file; use
+        `SyncAsync` on the event loop.
+        """
+        self._CancelSyncTimer()
+        if self._disk is None or \
+                self._conn.total_changes == self._syncedChanges:
+            return False
+        changes = self._conn.total_changes
+        self._CopyToDisk(self._conn.serialize())
+        self._syncedChanges = changes
+        return True
+    
+    async def SyncAsync(self) -> bool:
+        """Like `Sync` but only takes a snapshot of the in-memory database
+        (a copy in memory) on the event loop; the snapshot is written to
+        the file in steps on a worker thread.
+        """
+        import asyncio
+        self._CancelSyncTimer()
+        if self._disk is None or \
+                self._conn.total_changes == self._syncedChanges:
+            return False
+        changes = self._conn.total_changes
+        await asyncio.to_thread(self._CopyToDisk, self._conn.serialize())
+        self._syncedChanges = max(self._syncedChanges, changes)
+        return True
+    
+    def _CancelSyncTimer(self) -> None:
+        if self._syncTimer is not None:
+            self._syncTimer.cancel()
+            self._syncTimer = None
+    
+    def _StartSync(self) -> None:
+        """Runs `SyncAsync` in the background unless it is running."""
+        import asyncio
+        loop = asyncio.get_running_loop()
+        self._syncTimer = None
+        if self._syncTask is not None:
+            # Trying again later to take the changes after the snapshot...
+            self._syncTimer = loop.call_later(
+                self._syncInterval,
+                self._StartSync)
+            return
+        self._syncTask = loop.create_task(self.SyncAsync())
+        self._syncTask.add_done_callback(self._OnSyncDone)
+    
+    def _OnSyncDone(self, task) -> None:
+        self._syncTask = None
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(
+                'syncing the database failed',
+                exc_info=task.exception())
+    
+    def _CopyToDisk(self, data: bytes) -> None:
+        """Copies the serialized database to the file with the backup API
+        in steps of `_SYNC_PAGES` pages. It is thread-safe.
+        """
+        from time import perf_counter
+        start = perf_counter()
+        snapshot = sqlite3.connect(':memory:')
+        try:
+            snapshot.deserialize(data)
+            with self._diskLock:
+                snapshot.backup(self._disk, pages=self._SYNC_PAGES)
+        finally:
+            snapshot.close()
+        logging.debug(f'synced the database in {perf_counter() - start:.3f}s')
+    
+    def _Commit(self) -> None:
+        """Commits the transaction and, in the in-memory mode, schedules a
+        sync if an event loop is running.
+        """
+        self._conn.commit()
+        if self._disk is None or self._syncTimer is not None:
+            return
+        import asyncio
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._syncTimer = loop.call_later(self._syncInterval, self._StartSync)
+    
     def GetAllUserIds(self) -> tuple[int, ...]:
         sql = "SELECT user_id FROM users"
         cur = self._conn.cursor()
@@ -29,9 +181,9 @@ class SqliteDb(IDatabase):
         return tuple(cur)
     
     def GetUser(self, __id: int) -> UserData | None:
-        sql = """
+        sql = f"""
             SELECT
-                user_id, first_name, last_name, phone, hourly_freqs
+                {self._USER_COLS}
             FROM
                 users
             WHERE
@@ -42,28 +194,176 @@ class SqliteDb(IDatabase):
         res = cur.fetchone()
         if res is None:
             return None
+        return self._RowToUser(res)
+    
+    def GetUsers(
+            self,
+            limit: int,
+            *,
+            after: ID | None = None,
+            ) -> tuple[UserData, ...]:
+        sql = f"""
+            SELECT
+                {self._USER_COLS}
+            FROM
+                users
+            WHERE
+                user_id > ?
+            ORDER BY
+                user_id
+            LIMIT ?;
+        """
+        cur = self._conn.cursor()
+        cur = cur.execute(sql, (-(1 << 63) if after is None else after, limit,))
+        return tuple(self._RowToUser(row) for row in cur)
+    
+    def _RowToUser(self, row: tuple) -> UserData:
         hourlyFreqs = HourlyFrequencies()
-        hourlyFreqs.Bytes = res[4]
-        return UserData(res[0], res[1], res[2], res[3], hourlyFreqs)
+        hourlyFreqs.Bytes = row[4]
+        activity = WeeklyActivity()
+        activity.Bytes = row[5]
+        return UserData(
+            row[0],
+            row[1],
+            row[2],
+            row[3],
+            hourlyFreqs,
+            activity)
     
     def UpsertUser(self, user_data: UserData) -> None:
         sql = """
+            INSERT INTO
+                users(user_id, first_name, last_name, phone, hourly_freqs,
+                    weekly_activity, phone_norm)
+            VALUES
+                (:id, :first_name, :last_name, :phone, :hourly_freqs,
+                    :weekly_activity,
+                    CASE WHEN EXISTS(
+                        SELECT 1
+                        FROM users
+                        WHERE phone_norm = :phone_norm AND user_id <> :id)
+                    AND EXISTS(
+                        SELECT 1
+                        FROM users
+                        WHERE user_id = :id AND phone = :phone
+                            AND phone_norm IS NULL)
+                    THEN NULL ELSE :phone_norm END)
+            ON CONFLICT (user_id) DO UPDATE SET
+                first_name = excluded.first_name,
+                last_name = excluded.last_name,
+                phone = excluded.phone,
+                hourly_freqs = excluded.hourly_freqs,
+                weekly_activity = excluded.weekly_activity,
+                phone_norm = excluded.phone_norm;
+        """
+        cur = self._conn.cursor()
+        try:
+            cur = cur.execute(sql, self._UserToParams(user_data))
+            self._UpsertUserFts(cur, user_data)
+        except sqlite3.IntegrityError as err:
+            self._conn.rollback()
+            if 'phone_norm' in str(err):
+                raise PhoneTakenError(user_data._id, user_data._phone) \
+                    from err
+            raise
+        except BaseException:
+            self._conn.rollback()
+            raise
+        self._Commit()
+    
+    def UpsertUsers(self, users: Iterable[UserData]) -> int:
+        from itertools import batched
+        usersSql = """
+            INSERT INTO
+                users(user_id, first_name, last_name, phone, hourly_freqs,
+                    weekly_activity, phone_norm)
+            VALUES
+                (:id, :first_name, :last_name, :phone, :hourly_freqs,
+                    :weekly_activity,
+                    CASE WHEN EXISTS(
+                        SELECT 1
+                        FROM users
+                        WHERE phone_norm = :phone_norm AND user_id <> :id)
+                    THEN NULL ELSE :phone_norm END)
+            ON CONFLICT (user_id) DO UPDATE SET
+                first_name = excluded.first_name,
+                last_name = excluded.last_name,
+                phone = excluded.phone,
+                hourly_freqs = excluded.hourly_freqs,
+                weekly_activity = excluded.weekly_activity,
+                phone_norm = excluded.phone_norm;
+        """
+        ftsSql = """
             INSERT OR REPLACE INTO
-                users(user_id, first_name, last_name, phone, hourly_freqs)
+                users_fts(rowid, name, phone)
             VALUES
-                (?, ?, ?, ?, ?);
+                (?, ?, ?);
         """
+        count = 0
         cur = self._conn.cursor()
-        cur = cur.execute(
+        try:
+            for chunk in batched(users, self._BULK_CHUNK):
+                cur.executemany(
+                    usersSql,
+                    (self._UserToParams(user) for user in chunk))
+                cur.executemany(
+                    ftsSql,
+                    (
+                        (
+                            user._id,
+                            NormalizeFaText(
+                                f'{user._firstName} {user._lastName}'),
+                            NormalizeFaText(user._phone),
+                        )
+                        for user in chunk))
+                count += len(chunk)
+        except BaseException:
+            self._conn.rollback()
+            raise
+        self._Commit()
+        return count
+    
+    def _UserToParams(self, user_data: UserData) -> dict[str, Any]:
+        """Gets the named parameters of the upserts of the user."""
+        return {
+            'id': user_data._id,
+            'first_name': user_data._firstName,
+            'last_name': user_data._lastName,
+            'phone': user_data._phone,
+            'hourly_freqs': user_data._hFreqs.Bytes,
+            'weekly_activity': user_data._activity.Bytes,
+            'phone_norm': NormalizePhone(user_data._phone),}
+    
+    def GetUserIdByPhone(self, phone: str) -> ID | None:
+        norm = NormalizePhone(phone)
+        if norm is None:
+            return None
+        sql = "SELECT user_id FROM users WHERE phone_norm = ?;"
+        cur = self._conn.cursor()
+        cur = cur.execute(sql, (norm,))
+        res = cur.fetchone()
+        return None if res is None else res[0]
+    
+    def _UpsertUserFts(
+            self,
+            cur: sqlite3.Cursor,
+            user_data: UserData,
+            ) -> None:
+        """Keeps the full-text index of the user in sync."""
+        sql = """
+            INSERT OR REPLACE INTO
+                users_fts(rowid, name, phone)
+            VALUES
+                (?, ?, ?);
+        """
+        cur.execute(
             sql,
             (
                 user_data._id,
-                user_data._firstName,
-                user_data._lastName,
-                user_data._phone,
-                user_data._hFreqs.Bytes
+                NormalizeFaText(
+                    f'{user_data._firstName} {user_data._lastName}'),
+                NormalizeFaText(user_data._phone),
             ))
-        self._conn.commit()
     
     def DoesIdExist(self, __id: int) -> bool:
         sql = """
@@ -76,3 +376,350 @@ class SqliteDb(IDatabase):
         cur = self._conn.cursor()
         cur = cur.execute(sql, (__id,))
         return bool(cur.fetchone()[0])
+    
+    def GetProducts(
+            self,
+            limit: int,
+            *,
+            after: ID | None = None,
+            before: ID | None = None,
+            ) -> tuple[ProductData, ...]:
+        cur = self._conn.cursor()
+        if before is not None:
+            sql = """
+                SELECT prod_id, prod_name
+                FROM products
+                WHERE prod_id < ?
+                ORDER BY prod_id DESC
+                LIMIT ?;
+            """
+            cur = cur.execute(sql, (before, limit,))
+            return tuple(ProductData(*row) for row in reversed(cur.fetchall()))
+        elif after is not None:
+            sql = """
+                SELECT prod_id, prod_name
+                FROM products
+                WHERE prod_id > ?
+                ORDER BY prod_id
+                LIMIT ?;
+            """
+            cur = cur.execute(sql, (after, limit,))
+        else:
+            sql = """
+                SELECT prod_id, prod_name
+                FROM products
+                ORDER BY prod_id
+                LIMIT ?;
+            """
+            cur = cur.execute(sql, (limit,))
+        return tuple(ProductData(*row) for row in cur)
+    
+    def UpsertProduct(self, product: ProductData) -> None:
+        sql = """
+            INSERT OR REPLACE INTO
+                products(prod_id, prod_name)
+            VALUES
+                (?, ?);
+        """
+        cur = self._conn.cursor()
+        cur = cur.execute(sql, product.AsTuple())
+        self._Commit()
+    
+    def UpsertProducts(self, products: Iterable[ProductData]) -> int:
+        from itertools import batched
+        sql = """
+            INSERT OR REPLACE INTO
+                products(prod_id, prod_name)
+            VALUES
+                (?, ?);
+        """
+        count = 0
+        cur = self._conn.cursor()
+        try:
+            for chunk in batched(products, self._BULK_CHUNK):
+                cur.executemany(sql, (prod.AsTuple() for prod in chunk))
+                count += len(chunk)
+        except BaseException:
+            self._conn.rollback()
+            raise
+        self._Commit()
+        return count
+    
+    def AddUsersProducts(self, pairs: Iterable[tuple[ID, ID]]) -> int:
+        from itertools import batched
+        sql = """
+            INSERT OR IGNORE INTO
+                user_proc(user_id, proc_id)
+            VALUES
+                (?, ?);
+        """
+        count = 0
+        cur = self._conn.cursor()
+        try:
+            for chunk in batched(pairs, self._BULK_CHUNK):
+                cur.executemany(sql, chunk)
+                count += len(chunk)
+        except BaseException:
+            self._conn.rollback()
+            raise
+        self._Commit()
+        return count
+    
+    def GetUsersProductsPairs(
+            self,
+            limit: int,
+            *,
+            after: tuple[ID, ID] | None = None,
+            ) -> tuple[tuple[ID, ID], ...]:
+        sql = """
+            SELECT user_id, proc_id
+            FROM user_proc
+            WHERE (user_id, proc_id) > (?, ?)
+            ORDER BY user_id, proc_id
+            LIMIT ?;
+        """
+        if after is None:
+            after = (-(1 << 63), -(1 << 63),)
+        cur = self._conn.cursor()
+        cur = cur.execute(sql, (*after, limit,))
+        return tuple(cur)
+    
+    def GetUserProducts(self, __id: ID, /) -> tuple[ProductData, ...]:
+        sql = """
+            SELECT
+                products.prod_id, products.prod_name
+            FROM
+                user_proc
+                JOIN products ON products.prod_id = user_proc.proc_id
+            WHERE
+                user_proc.user_id = ?
+            ORDER BY
+                products.prod_id;
+        """
+        cur = self._conn.cursor()
+        cur = cur.execute(sql, (__id,))
+        return tuple(ProductData(*row) for row in cur)
+    
+    def GetUsersProducts(
+            self,
+            ids: Iterable[ID],
+            ) -> dict[ID, tuple[ProductData, ...]]:
+        ids = list(ids)
+        result: dict[ID, list[ProductData]] = {id_: [] for id_ in ids}
+        cur = self._conn.cursor()
+        # Staying below the limit of SQL variables...
+        for idx in range(0, len(ids), self._MAX_VARS):
+            chunk = ids[idx:idx + self._MAX_VARS]
+            sql = f"""
+                SELECT
+                    user_proc.user_id, products.prod_id, products.prod_name
+                FROM
+                    user_proc
+                    JOIN products ON products.prod_id = user_proc.proc_id
+                WHERE
+                    user_proc.user_id IN ({', '.join('?' * len(chunk))})
+                ORDER BY
+                    user_proc.user_id, products.prod_id;
+            """
+            for userId, prodId, prodName in cur.execute(sql, chunk):
+                result[userId].append(ProductData(prodId, prodName))
+        return {id_: tuple(prods) for id_, prods in result.items()}
+    
+    def GetProductOwners(self, __id: ID, /) -> tuple[ID, ...]:
+        sql = """
+            SELECT user_id
+            FROM user_proc
+            WHERE proc_id = ?
+            ORDER BY user_id;
+        """
+        cur = self._conn.cursor()
+        cur = cur.execute(sql, (__id,))
+        return tuple(row[0] for row in cur)
+    
+    def CreateBroadcast(
+            self,
+            text: str,
+            by_peak: bool,
+            started_at: int,
+            *,
+            brand: str = '',
+            ) -> BroadcastData:
+        sql = """
+            INSERT INTO
+                broadcasts(text, by_peak, started_at, brand)
+            VALUES
+                (?, ?, ?, ?);
+        """
+        cur = self._conn.cursor()
+        cur = cur.execute(sql, (text, int(by_peak), started_at, brand,))
+        self._Commit()
+        return BroadcastData(
+            cur.lastrowid,
+            text,
+            by_peak,
+            started_at,
+            brand=brand)
+    
+    def GetUnfinishedBroadcasts(
+            self,
+            *,
+            brand: str = '',
+            ) -> tuple[BroadcastData, ...]:
+        sql = """
+            SELECT
+                bc_id, text, by_peak, started_at, pass, cursor, sent,
+                failed, done
+            FROM
+                broadcasts
+            WHERE
+                NOT done AND brand = ?
+            ORDER BY
+                bc_id;
+        """
+        cur = self._conn.cursor()
+        cur = cur.execute(sql, (brand,))
+        return tuple(
+            BroadcastData(
+                row[0],
+                row[1],
+                bool(row[2]),
+                row[3],
+                row[4],
+                row[5],
+                row[6],
+                row[7],
+                bool(row[8]),
+                brand)
+            for row in cur)
+    
+    def UpdateBroadcast(self, broadcast: BroadcastData) -> None:
+        sql = """
+            UPDATE
+                broadcasts
+            SET
+                pass = ?, cursor = ?, sent = ?, failed = ?, done = ?
+            WHERE
+                bc_id = ?;
+        """
+        cur = self._conn.cursor()
+        cur = cur.execute(
+            sql,
+            (
+                broadcast.Pass,
+                broadcast.Cursor,
+                broadcast.Sent,
+                broadcast.Failed,
+                int(broadcast.Done),
+                broadcast.Id,
+            ))
+        self._Commit()
+    
+    def GetUsersCount(self) -> int:
+        sql = "SELECT value FROM stats_totals WHERE key = 'users';"
+        cur = self._conn.cursor()
+        cur = cur.execute(sql)
+        res = cur.fetchone()
+        return res[0] if res else 0
+    
+    def IncrementSignups(self, day: str) -> None:
+        sql = """
+            INSERT INTO
+                stats_signups(day, count)
+            VALUES
+                (?, 1)
+            ON CONFLICT (day) DO UPDATE SET
+                count = count + 1;
+        """
+        cur = self._conn.cursor()
+        cur = cur.execute(sql, (day,))
+        self._Commit()
+    
+    def GetSignups(self, days: int) -> tuple[tuple[str, int], ...]:
+        sql = """
+            SELECT day, count
+            FROM stats_signups
+            WHERE day >= date('now', 'localtime', ?)
+            ORDER BY day DESC;
+        """
+        cur = self._conn.cursor()
+        cur = cur.execute(sql, (f'{1 - days} days',))
+        return tuple(cur)
+    
+    def AddActiveUsers(self, day: str, hour: int, count: int) -> None:
+        sql = """
+            INSERT INTO
+                stats_active(day, hour, count)
+            VALUES
+                (?, ?, ?)
+            ON CONFLICT (day, hour) DO UPDATE SET
+                count = count + excluded.count;
+        """
+        cur = self._conn.cursor()
+        cur = cur.execute(sql, (day, hour, count,))
+        self._Commit()
+    
+    def GetActiveUsers(self, day: str) -> tuple[tuple[int, int], ...]:
+        sql = """
+            SELECT hour, count
+            FROM stats_active
+            WHERE day = ?
+            ORDER BY hour;
+        """
+        cur = self._conn.cursor()
+        cur = cur.execute(sql, (day,))
+        return tuple(cur)
+    
+    def RebuildStats(self) -> tuple[int, int]:
+        before = self.GetUsersCount()
+        sql = """
+            INSERT OR REPLACE INTO
+                stats_totals(key, value)
+            SELECT
+                'users', COUNT(*)
+            FROM
+                users;
+        """
+        cur = self._conn.cursor()
+        cur = cur.execute(sql)
+        self._Commit()
+        return (before, self.GetUsersCount())
+    
+    def SearchUsers(
+            self,
+            query: str,
+            limit: int,
+            *,
+            after: ID | None = None,
+            ) -> tuple[UserData, ...]:
+        # Making an FTS5 query of quoted terms...
+        terms = [
+            '"{}"'.format(term.replace('"', '""'))
+            for term in NormalizeFaText(query).split()
+            if len(term) >= 3]
+        if not terms:
+            return ()
+        # Matching in the full-text index first, then joining the page...
+        sql = f"""
+            WITH matches AS (
+                SELECT rowid
+                FROM users_fts
+                WHERE users_fts MATCH ? AND rowid > ?
+                ORDER BY rowid
+                LIMIT ?)
+            SELECT
+                {self._USER_COLS}
+            FROM
+                matches
+                CROSS JOIN users ON users.user_id = matches.rowid
+            ORDER BY
+                users.user_id;
+        """
+        cur = self._conn.cursor()
+        cur = cur.execute(
+            sql,
+            (
+                ' AND '.join(terms),
+                -(1 << 63) if after is None else after,
+                limit,
+            ))
+        return tuple(self._RowToUser(row) for row in cur)
@@ -38,12 +38,55 @@ ADMIN_PANEL_NO_ACCESS = f'شما به {PANEL} {ADMIN} دسترسی ندارید'
 Admin Panel.
 """
 
+ADMIN_CMDS = (
+    '/admin broadcast <متن>: ارسال همگانی پیام\n'
+    '/admin broadcast-peak <متن>: ارسال همگانی در ساعت پرفعالیت هر '
+        f'{USER}\n'
+    '/admin broadcast: وضعیت ارسال های همگانی\n'
+    '/admin stats: آمار\n'
+    '/admin stats rebuild: بازسازی آمار\n'
+    f'/admin search <نام یا {PHONE}>: جستجوی {USER}ان\n'
+    '/admin profile [ثانیه]: نمونه برداری از پشته و تخصیص حافظه')
+"""The list of admin sub-commands."""
+
+ADMIN_BROADCAST_STARTED = 'ارسال همگانی شماره {} آغاز شد.'
+
+ADMIN_BROADCAST_STATUS = 'ارسال همگانی {0} (مرحله {1}): {2} موفق، {3} ناموفق'
+
+ADMIN_STATS_USERS = f'تعداد {USER}ان: {{}}'
+
+ADMIN_STATS_SIGNUPS = '\nثبت نام های هفت روز اخیر:'
+
+ADMIN_STATS_ACTIVE = f'\n{USER}ان فعال امروز در هر ساعت:'
+
+ADMIN_STATS_REBUILT = f'آمار بازسازی شد. تعداد {USER}ان: {{0}} ← {{1}}'
+
+ADMIN_SEARCH_NOTHING = f'هیچ {USER}ی پیدا نشد. (حداقل سه حرف وارد کنید)'
+
+ADMIN_SEARCH_EXPIRED = 'این جستجو منقضی شده است. لطفا دوباره جستجو کنید.'
+
+ADMIN_NO_BROADCASTS = 'هیچ ارسال همگانی در حال انجامی وجود ندارد.'
+
+ADMIN_PROFILE_STARTED = 'نمونه برداری به مدت {} ثانیه آغاز شد.'
+
+ADMIN_PROFILE_BUSY = 'یک نمونه برداری دیگر در حال انجام است.'
+
+ADMIN_PROFILE_DONE = 'نمونه برداری پایان یافت: {0} نمونه در {1:.1f} ثانیه\nفایل: {2}'
+
+ADMIN_PROFILE_FUNCS = '\nتوابع پرتکرار بالای پشته:'
+
+ADMIN_PROFILE_ALLOCS = '\nبیشترین تغییر حافظه:'
+
 HELP = 'راهنمایی'
 
 HELP_CMD_INTRO = f'{HELP}: برای نمایش همین {PANEL}'
 
 MY_COURSES = 'دوره های من'
 
+NO_COURSES = 'شما هنوز در هیچ دوره ای ثبت نام نکرده اید.'
+
+NOT_SIGNED_IN = 'شما هنوز ثبت نام نکرده اید.'
+
 PRODUCTS_CMD_INTRO = f'{PRODUCTS}: نمایش یک لیست از تمام {PRODUCTS}'
 """The introduction of Products command."""
 
@@ -57,6 +100,10 @@ SIGN_IN_ENTER_LAST_NAME = f'لطفا {LAST_NAME} خود را وارد کنید:'
 
 SIGN_IN_ENTER_PHONE = f'لطفا {PHONE} خود را وارد کنید:'
 
+SIGN_IN_INVALID_PHONE = f'{PHONE} وارد شده معتبر نیست. لطفا یک شماره همراه مانند 09123456789 وارد کنید:'
+
+SIGN_IN_PHONE_TAKEN = f'این {PHONE} قبلا توسط کاربر دیگری ثبت شده است. لطفا {PHONE} دیگری وارد کنید:'
+
 START = f'{PANEL} من'
 """The title of the user panel."""
 
@@ -78,6 +125,12 @@ UNKNOWN_USER = f'{USER} شما ناشناس است'
 
 SHOWCASE = f'ویترین {PRODUCTS}'
 
+SHOWCASE_EMPTY = 'در حال حاضر محصولی برای نمایش وجود ندارد.'
+
+NEXT_PAGE = 'صفحه بعد'
+
+PREV_PAGE = 'صفحه قبل'
+
 SHOWCASE_CMD_INTRO = F'{COMMANDS}: برای نمایش خلاصه همه {COMMANDS}'
 
 UNEX_DATA = 'شما مجاز به وارد کردن اطلاعات نیستید. اگر در میانه فرآیندی بودید، از ابتدا آن را انجام دهید.'
@@ -86,8 +139,16 @@ DISRUPTIVE_CMD = 'شما در حال انجام یک فرآیند هستید. ب
 
 CONFIRM_DATA = 'آیا اطلاعات زیر مورد تایید شما می باشد؟'
 
+SIGN_IN_CONFIRM_DATA = f'{CONFIRM_DATA}\n{FIRST_NAME}: {{}}\n{LAST_NAME}: {{}}\n{PHONE}: {{}}'
+"""The confirmation of sign-in data formatted by first name, last name &
+phone.
+"""
+
 CONFIRM = 'تایید'
 
 RESTART = 'شروع دوباره'
 
 EXPIRED_CB = 'فرآیند مربوط به این دکمه منقضی شده است.'
+
+SLOW_DOWN = 'درخواست های شما بیش از حد سریع است. لطفا چند لحظه صبر کنید.'
+"""The notice to users who flood the Bot."""
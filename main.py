@@ -1,71 +1,371 @@
 #
 #
 #
+"""The entry point of the Bot. Importing this module has no side effects
+and no heavy imports; `main` runs the startup as an explicit sequence of
+timed stages (see `Startup`) and then the Bot.
+"""
 
 from __future__ import annotations
+from contextvars import ContextVar
 import logging
 from pathlib import Path
-from typing import Any, Callable, Coroutine
-
-from bale import Bot, Update, Message, CallbackQuery, Chat, User, SuccessfulPayment
+from typing import (
+	TYPE_CHECKING, Any, Callable, Coroutine, Iterable, NamedTuple)
 
-from app_utils import ConfigureLogging
-from db import IDatabase
-from db.sqlite3 import SqliteDb
-import lang
-from panels import (
-	GetAdminReply, GetHelpReply, GetShowcaseReply, GetUnexDataReply,
-	GetStartReply ,GetUnexCommandReply, GetSiginReply)
-from utils.types import (
-    AbsOperation, Commands, HappyEngBot, ID, InputType, OperationPool,
-	SDelPool, UserData,	UserPool)
+if TYPE_CHECKING:
+	import asyncio
+	from bale import (
+		Update, Message, CallbackQuery, Chat, User, SuccessfulPayment)
+	from db import IDatabase
+	from profiler import Profiler
+	from utils.types import HappyEngBot
+	from webhook import WebhookServer
 
 
 # Bot-wide variables & contants =====================================
 APP_DIR = Path(__file__).resolve().parent
 """The directory of the Bot."""
 
-# Configuring the logger ============================================
-ConfigureLogging(APP_DIR / 'log.log')
-
-# Preparing global variables ========================================
-import tomllib
-ADMIN_IDS: tuple[int, ...]
-"""A tuple of ID's of admin users."""
-_TOKEN: str
-"""The token of the Bale bot."""
-with open(APP_DIR / 'config.toml', mode='rb') as tomlObj:
-	settings = tomllib.load(tomlObj)
-	ADMIN_IDS = settings['ADMIN_IDS']
-	_TOKEN = settings['BALE_BOT_TOKEN']
-
-DB: IDatabase = SqliteDb(APP_DIR / 'db.db3')
-"""The database."""
-
-userPool = UserPool(DB)
-"""A mapping of `ID -> UserData` contains all information of recent users
-of the Bot.
+
+class _BotConfig(NamedTuple):
+	"""The settings of a hosted bot."""
+	brand: str
+	"""The unique name of the bot; empty for a lone bot."""
+	token: str
+	admin_ids: tuple[int, ...]
+	db_name: str
+	"""The name of the database file without extension. Bots with the
+	same name share the database.
+	"""
+
+
+# Global variables set by the startup stages ========================
+_BOTS: tuple[_BotConfig, ...]
+"""The bots hosted by this process. They come from the `BOTS` array of
+tables (with `NAME`, `BALE_BOT_TOKEN`, `ADMIN_IDS` & `DB` keys), or else
+the lone bot is made of the top-level `BALE_BOT_TOKEN` & `ADMIN_IDS`.
+"""
+_BASE_URL: str | None
+"""The optional base URL of the Bale API, e.g. a local stand-in server
+from `tools.fake_bale`. `None` means the default Bale servers.
+"""
+_BROADCAST_RATE: float
+"""The maximum number of broadcast messages per second. It must leave
+room for interactive replies under the limits of Bale.
+"""
+_SHARDS: int
+"""The number of worker processes. Values larger than one run the Bot in
+the sharded mode (see `sharding` module).
+"""
+_DB_BACKEND: str
+"""The backend of databases: `sqlite` (`db.db3`), `sqlite-memory`
+(`db.db3` loaded into memory & synced back periodically), `log` (the
+append-log `db.log`, see `db.log` module) or `memory` (nothing is
+persisted). Only `sqlite` can be shared by the sharded mode.
+"""
+_DB_SYNC_INTERVAL: float
+"""The maximum seconds changes of the `sqlite-memory` backend stay only
+in memory, i.e. the window of changes a crash can lose.
+"""
+_WEBHOOK: dict[str, Any] | None
+"""The optional settings of the webhook mode (see `webhook` module) with
+these keys: `URL` (the public URL registered with Bale), `SECRET`
+(mandatory), `HOST`, `PORT`, `PATH` & `DRAIN_DEADLINE`. `None` means
+polling.
+"""
+_FLOOD_RATE: float
+"""The number of inputs per second each user is allowed."""
+_FLOOD_BURST: float
+"""The maximum number of inputs of each user in a row."""
+_CATCH_UP: bool
+"""Whether the backlog of updates is caught up with, collapsed, before
+polling (see `catchup` module).
+"""
+_SHUTDOWN_DEADLINE: float
+"""The maximum seconds the shutdown waits for in-flight updates before
+cancelling them.
+"""
+
+_shard: int | None = None
+"""The shard of this process in the sharded mode, otherwise `None`."""
+
+_dbs: dict[str, IDatabase]
+"""The databases of hosted bots as `name -> database`."""
+
+_bots: tuple[HappyEngBot, ...]
+"""The hosted bots in the order of `_BOTS`."""
+
+happyEngBot: HappyEngBot
+"""The first hosted bot, which is the only one in the sharded & webhook
+modes.
+"""
+
+profiler: Profiler
+"""The profiler which admins toggle at runtime, shared by all bots."""
+
+_inFlight: set[asyncio.Task] = set()
+"""The tasks handling updates at the moment."""
+
+_catchingUp: ContextVar[bool] = ContextVar('_catchingUp', default=False)
+"""Whether the current task handles the backlog, whose timing does not
+reflect the rate of users.
 """
 
-opPool = OperationPool(userPool, None)
-"""The ongoing operations."""
+
+# Startup stages ====================================================
+def _ConfigureLogging() -> None:
+	from app_utils import ConfigureLogging
+	ConfigureLogging(APP_DIR / 'log.log')
+
+
+def _LoadConfig() -> None:
+	global _BOTS, _BASE_URL, _BROADCAST_RATE, _SHARDS, _DB_BACKEND, \
+		_DB_SYNC_INTERVAL, _WEBHOOK, _SHUTDOWN_DEADLINE, _FLOOD_RATE, \
+		_FLOOD_BURST, _CATCH_UP
+	import tomllib
+	with open(APP_DIR / 'config.toml', mode='rb') as tomlObj:
+		settings = tomllib.load(tomlObj)
+	if 'BOTS' in settings:
+		_BOTS = tuple(
+			_BotConfig(
+				bot['NAME'],
+				bot['BALE_BOT_TOKEN'],
+				tuple(bot['ADMIN_IDS']),
+				bot.get('DB', 'db'))
+			for bot in settings['BOTS'])
+	else:
+		_BOTS = (_BotConfig(
+			'',
+			settings['BALE_BOT_TOKEN'],
+			tuple(settings['ADMIN_IDS']),
+			'db'),)
+	_BASE_URL = settings.get('BALE_BASE_URL')
+	_BROADCAST_RATE = settings.get('BROADCAST_RATE', 10.0)
+	_SHARDS = settings.get('SHARDS', 1)
+	_DB_BACKEND = settings.get('DB_BACKEND', 'sqlite')
+	_DB_SYNC_INTERVAL = settings.get('DB_SYNC_INTERVAL', 30.0)
+	_WEBHOOK = settings.get('WEBHOOK')
+	_SHUTDOWN_DEADLINE = settings.get('SHUTDOWN_DEADLINE', 10.0)
+	_FLOOD_RATE = settings.get('FLOOD_RATE', 1.0)
+	_FLOOD_BURST = settings.get('FLOOD_BURST', 5.0)
+	_CATCH_UP = settings.get('CATCH_UP', True)
+	if _WEBHOOK is not None and not _WEBHOOK.get('SECRET'):
+		raise ValueError('the webhook mode requires WEBHOOK.SECRET')
+	if _SHARDS > 1 and _DB_BACKEND != 'sqlite':
+		raise ValueError(f"the '{_DB_BACKEND}' backend cannot be sharded")
+	if not _BOTS:
+		raise ValueError('no bots are configured')
+	if len(_BOTS) > 1:
+		if _SHARDS > 1 or _WEBHOOK is not None:
+			raise ValueError('several bots can only be hosted by polling '
+				'in one process')
+		if len({bot.brand for bot in _BOTS}) < len(_BOTS):
+			raise ValueError('names of bots must be unique')
+
+
+def _OpenDatabases() -> None:
+	global _dbs
+	_dbs = {}
+	for bot in _BOTS:
+		if bot.db_name not in _dbs:
+			_dbs[bot.db_name] = _OpenDatabase(bot.db_name)
+
+
+def _OpenDatabase(name: str) -> IDatabase:
+	"""Opens the database of the name on the configured backend."""
+	match _DB_BACKEND:
+		case 'sqlite':
+			from db.sqlite3 import SqliteDb
+			return SqliteDb(APP_DIR / f'{name}.db3', wal=_SHARDS > 1)
+		case 'sqlite-memory':
+			from db.sqlite3 import SqliteDb
+			return SqliteDb(
+				APP_DIR / f'{name}.db3',
+				in_memory=True,
+				sync_interval=_DB_SYNC_INTERVAL)
+		case 'log':
+			from db.log import LogDb
+			return LogDb(APP_DIR / f'{name}.log')
+		case 'memory':
+			from db.memory import MemoryDb
+			return MemoryDb()
+		case _:
+			raise ValueError(f"unknown database backend '{_DB_BACKEND}'")
+
+
+def _UpgradeDatabases() -> None:
+	"""Brings the schema of the Sqlite3 databases up to date once, so
+	that workers of the sharded mode do not all migrate at the same time.
+	"""
+	import sqlite3
+	from db.migrations import Upgrade
+	if _DB_BACKEND not in ('sqlite', 'sqlite-memory',):
+		return
+	for name in dict.fromkeys(bot.db_name for bot in _BOTS):
+		conn = sqlite3.connect(APP_DIR / f'{name}.db3')
+		try:
+			Upgrade(conn)
+		finally:
+			conn.close()
+
+
+def _CreateBots() -> None:
+	global _bots, happyEngBot, profiler
+	from profiler import Profiler
+	from utils.types import AsyncTokenBucket, HappyEngBot, UserPool
+	# Sharing one budget of outbound broadcasts among all bots...
+	limiter = AsyncTokenBucket(_BROADCAST_RATE)
+	kwargs = {} if _BASE_URL is None else {'base_url': _BASE_URL}
+	bots: list[HappyEngBot] = []
+	# Sharing one pool of users per database, otherwise pools of bots
+	# overwrite the users of each other...
+	userPools: dict[str, UserPool] = {}
+	for config in _BOTS:
+		if config.db_name not in userPools:
+			userPools[config.db_name] = UserPool(_dbs[config.db_name])
+		bot = HappyEngBot(
+			config.token,
+			_dbs[config.db_name],
+			_DispatchCmd,
+			limiter,
+			brand=config.brand,
+			admin_ids=config.admin_ids,
+			hwm=_LoadHwm(config.brand),
+			flood_rate=_FLOOD_RATE,
+			flood_burst=_FLOOD_BURST,
+			user_pool=userPools[config.db_name],
+			**kwargs)
+		_RegisterHandlers(bot)
+		bots.append(bot)
+	_bots = tuple(bots)
+	happyEngBot = _bots[0]
+	# Importing the panels now rather than in the first reply...
+	import panels
+	profiler = Profiler(APP_DIR / 'profiles')
+
+
+def _RegisterHandlers(bot: HappyEngBot) -> None:
+	"""Registers the event handlers on the bot, bound to it. Records
+	logged by the handlers are tagged with the brand of the bot.
+	"""
+	from app_utils import BOT_BRAND
+	def _Bind(handler: Callable[..., Coroutine[Any, Any, None]]):
+		async def _Bound(*args) -> None:
+			BOT_BRAND.set(bot.brand)
+			await handler(bot, *args)
+		# Keeping the name as the Bot registers events by names...
+		_Bound.__name__ = handler.__name__
+		_Bound.__qualname__ = handler.__qualname__
+		return _Bound
+	for handler in _EVENT_HANDLERS:
+		bot.event(_Bind(handler))
+
+
+_BASE_STAGES: tuple[tuple[str, Callable[[], None]], ...] = (
+	('logging', _ConfigureLogging),
+	('config', _LoadConfig),)
+"""The stages every process runs, including the front process of the
+sharded mode.
+"""
+
+_FRONT_STAGES: tuple[tuple[str, Callable[[], None]], ...] = (
+	('schema', _UpgradeDatabases),)
+"""The stages the front process of the sharded mode runs before it
+starts the workers.
+"""
+
+_APP_STAGES: tuple[tuple[str, Callable[[], None]], ...] = (
+	('databases', _OpenDatabases),
+	('bots', _CreateBots),)
+"""The stages of processes which handle updates."""
+
+
+def _RunStages(
+		stages: tuple[tuple[str, Callable[[], None]], ...],
+		) -> dict[str, float]:
+	"""Runs the stages in order and returns their durations in seconds
+	as `stage -> duration`.
+	"""
+	from time import perf_counter
+	durations: dict[str, float] = {}
+	for name, stage in stages:
+		start = perf_counter()
+		stage()
+		durations[name] = perf_counter() - start
+		logging.info(f'startup stage {name!r} took '
+			f'{durations[name] * 1e3:.1f} ms')
+	return durations
+
+
+def Startup() -> dict[str, float]:
+	"""Runs all the startup stages of a process which handles updates
+	and returns their durations in seconds as `stage -> duration`.
+	"""
+	durations = _RunStages(_BASE_STAGES + _APP_STAGES)
+	logging.info(f'startup took {sum(durations.values()) * 1e3:.1f} ms')
+	return durations
+
+
+def _GetHwmFile(brand: str) -> Path:
+	"""Gets the file which persists the high-water mark of processed
+	updates of the bot. Every shard keeps its own mark as it only sees
+	the updates of its users; marks of another number of shards are not
+	used.
+	"""
+	name = f'update_hwm.{brand}' if brand else 'update_hwm'
+	if _shard is not None:
+		name += f'.{_shard}of{_SHARDS}'
+	return APP_DIR / name
+
+
+def _LoadHwm(brand: str) -> int:
+	try:
+		return int(_GetHwmFile(brand).read_text())
+	except (OSError, ValueError):
+		return 0
+
+
+def _SaveHwms() -> None:
+	for bot in _bots:
+		_GetHwmFile(bot.brand).write_text(
+			str(bot.recent_updates.HighWaterMark))
+
+
+def _CloseDatabases() -> None:
+	for db in _dbs.values():
+		db.Close()
 
 
 # Reply functions =========================================
 async def _Reply(
+		bot: HappyEngBot,
 		message: Message,
 		bale_user: User,
 		input_: str | None,
 		type_: InputType,
 		) -> Coroutine[Any, Any, None]:
 	"""Disptaches the user input."""
+	from utils.types import FloodVerdict, InputType
+	if bale_user is not None and not _catchingUp.get():
+		# Dropping floods before any dispatch...
+		match bot.flood_guard.Check(bale_user.id):
+			case FloodVerdict.DROP:
+				return
+			case FloodVerdict.WARN:
+				import lang
+				logging.info(f'user {bale_user.id} is flooding')
+				await message.reply(lang.SLOW_DOWN)
+				return
+	if bale_user is not None:
+		bot.user_pool.RecordAccess(bale_user.id)
 	# Getting reply...
 	if input_.startswith('/'):
-		reply = _DispatchCmd(message, bale_user, input_)
+		reply = _DispatchCmd(bot, message, bale_user, input_)
 	elif type_ == InputType.TEXT:
-		reply = _DispatchText(message, bale_user, input_)
+		reply = _DispatchText(bot, message, bale_user, input_)
 	elif type_ == InputType.CALLBACK:
-		reply = _DispatchCallback(message, bale_user, input_)
+		reply = _DispatchCallback(bot, message, bale_user, input_)
 	else:
 		logging.error('E1-2', exc_info=True)
 	# Returning reply to the user...
@@ -74,13 +374,18 @@ async def _Reply(
 
 
 def _DispatchCmd(
+		bot: HappyEngBot,
 		bale_msg: Message,
 		bale_user: User,
 		cmd: str | None,
 		) -> Coroutine[Any, Any, Message] | None:
+	from panels import (
+		GetAdminReply, GetHelpReply, GetMyCoursesReply, GetShowcaseReply,
+		GetStartReply ,GetUnexCommandReply, GetSiginReply)
+	from utils.types import Commands
 	# Checking interference with an ongoing operation...
 	try:
-		return opPool.CancelByCmdReply(bale_msg, bale_user, cmd)
+		return bot.op_pool.CancelByCmdReply(bale_msg, bale_user, cmd)
 	except (KeyError, ValueError):
 		pass
 	# Initiating a new operation...
@@ -88,106 +393,154 @@ def _DispatchCmd(
 	cmdParts[0] = cmdParts[0].lower()
 	match cmdParts[0]:
 		case Commands.ADMIN.value:
-			return GetAdminReply(bale_msg, ADMIN_IDS)
+			return GetAdminReply(
+				bale_msg,
+				bale_user,
+				bot.admin_ids,
+				cmd,
+				bot.db,
+				bot.broadcaster,
+				profiler)
 		case Commands.HELP.value:
 			return GetHelpReply(bale_msg)
 		case Commands.START.value:
 			return GetStartReply(
 				bale_msg,
 				bale_user,
-				userPool,
-				ADMIN_IDS)
+				bot.user_pool,
+				bot.admin_ids)
 		case Commands.SHOWCASE.value:
-			return GetShowcaseReply(bale_msg)
+			return GetShowcaseReply(
+				bale_msg,
+				bot.db,
+				cmdParts[1] if len(cmdParts) > 1 else None)
 		case Commands.SIGN_IN.value:
 			return GetSiginReply(
 				bale_msg,
 				bale_user,
-				userPool,
-				opPool)
+				bot.user_pool,
+				bot.op_pool)
 		case Commands.MY_COURSES.value:
-			pass
+			return GetMyCoursesReply(
+				bale_msg,
+				bale_user,
+				bot.user_pool,
+				bot.db)
 		case _:
 			return GetUnexCommandReply(bale_msg, cmd)
 
 
 def _DispatchText(
+		bot: HappyEngBot,
 		bale_msg: Message,
 		bale_user: User,
 		text: str | None,
 		) -> Coroutine[Any, Any, Message] | None:
+	import lang
 	try:
-		return opPool.GetTextReply(bale_msg, bale_user, text)
+		return bot.op_pool.GetTextReply(bale_msg, bale_user, text)
 	except KeyError:
 		return bale_msg.reply(lang.UNEX_DATA)
 
 
 def _DispatchCallback(
+		bot: HappyEngBot,
 		bale_msg: Message,
 		bale_user: User,
 		cb_data: str | None,
 		) -> Coroutine[Any, Any, Message] | None:
+	import lang
 	try:
-		return opPool.GetCallbackReply(bale_msg, bale_user, cb_data)
+		return bot.op_pool.GetCallbackReply(bale_msg, bale_user, cb_data)
 	except KeyError:
 		return bale_msg.reply(lang.EXPIRED_CB)
 
 
-opPool._cmdDispatcher = _DispatchCmd
-
+# Input handlers ====================================================
+async def _HandleUpdate(bot: HappyEngBot, update: Update) -> None:
+	"""Handles an update of any kind. This is the entry point for all
+	updates, whether polled, pushed to the webhook, or routed to a shard.
+	"""
+	import asyncio
+	# Dropping duplicates, e.g. redelivered after reconnects...
+	if not bot.recent_updates.Add(update.update_id):
+		logging.info(f'update {update.update_id} is a duplicate')
+		return
+	# Tracking the handling for draining at shutdown...
+	task = asyncio.current_task()
+	_inFlight.add(task)
+	try:
+		if update.callback_query is not None:
+			await _HandleCallback(bot, update.callback_query)
+		elif update.message is not None:
+			await _HandleMessage(bot, update.message)
+	finally:
+		_inFlight.discard(task)
 
-# Creating & running the Bot ======================================== 
-happyEngBot = Bot(token=_TOKEN)
-"""The Bot object for this @happy_eng_bot."""
 
-@happyEngBot.event
-async def on_before_ready() -> None:
-	logging.debug("'on_before_ready' event is raised.")
+async def _HandleRawUpdate(raw: dict[str, Any]) -> None:
+	"""Handles a raw (JSON-decoded) update of the lone bot."""
+	from bale import Update
+	await _HandleUpdate(happyEngBot, Update.from_dict(raw, happyEngBot))
 
-@happyEngBot.event
-async def on_ready():
-	logging.debug(f"{happyEngBot.user.username} is ready to respond!")
 
-@happyEngBot.event
-async def on_message(bale_msg: Message):
-	pass
-	"""logging.debug('A message is received '.ljust(70, '='))
-	logging.debug(message)"""
+async def _HandleMessage(bot: HappyEngBot, bale_msg: Message) -> None:
+	from utils.types import InputType
 	# Looking for empty or None messages...
 	if not bale_msg.content:
 		logging.warning('an empty or None message')
 		return
 	await _Reply(
+		bot,
 		bale_msg,
 		bale_msg.from_user,
 		bale_msg.text,
 		InputType.TEXT)
 
-@happyEngBot.event
-async def on_message_edit(message: Message) -> None:
-	logging.debug('A message is edited '.ljust(70, '='))
-	logging.debug(message)
-
-@happyEngBot.event
-async def on_update(update: Update) -> None:
-	logging.debug('An update is received from “Bale” servers '.ljust(70, '='))
-	logging.debug(update)
 
-@happyEngBot.event
-async def on_callback(callback: CallbackQuery) -> None:
-	logging.debug('A callback query is created '.ljust(70, '='))
-	logging.debug(callback)
+async def _HandleCallback(
+		bot: HappyEngBot,
+		callback: CallbackQuery,
+		) -> None:
+	from utils.types import InputType
 	if not callback.data:
 		logging.info('A callback with no data.')
 		return
 	await _Reply(
+		bot,
 		callback.message,
 		callback.from_user,
 		callback.data,
 		InputType.CALLBACK)
 
-@happyEngBot.event
+
+# Events of the Bot =================================================
+async def on_before_ready(bot: HappyEngBot) -> None:
+	logging.debug("'on_before_ready' event is raised.")
+
+async def on_ready(bot: HappyEngBot):
+	logging.debug(f"{bot.user.username} is ready to respond!")
+	bot.broadcaster.ResumeAll()
+
+async def on_message(bot: HappyEngBot, bale_msg: Message):
+	logging.debug('A message is received '.ljust(70, '='))
+	logging.debug(bale_msg)
+
+async def on_message_edit(bot: HappyEngBot, message: Message) -> None:
+	logging.debug('A message is edited '.ljust(70, '='))
+	logging.debug(message)
+
+async def on_update(bot: HappyEngBot, update: Update) -> None:
+	logging.debug('An update is received from “Bale” servers '.ljust(70, '='))
+	logging.debug(update)
+	await _HandleUpdate(bot, update)
+
+async def on_callback(bot: HappyEngBot, callback: CallbackQuery) -> None:
+	logging.debug('A callback query is created '.ljust(70, '='))
+	logging.debug(callback)
+
 async def on_member_chat_join(
+		bot: HappyEngBot,
 		message: Message,
 		chat: Chat,
 		user: User
@@ -197,8 +550,8 @@ async def on_member_chat_join(
 	logging.debug(chat)
 	logging.debug(user)
 
-@happyEngBot.event
 async def on_member_chat_leave(
+		bot: HappyEngBot,
 		message: Message,
 		chat: Chat,
 		user: User
@@ -208,32 +561,207 @@ async def on_member_chat_leave(
 	logging.debug(chat)
 	logging.debug(user)
 
-@happyEngBot.event
 async def on_successful_payment(
+		bot: HappyEngBot,
 		payment: SuccessfulPayment,
 		) -> None:
 	logging.debug('A successful payment '.ljust(70, '='))
 	logging.debug(payment)
 
 
+_EVENT_HANDLERS = (
+	on_before_ready, on_ready, on_message, on_message_edit, on_update,
+	on_callback, on_member_chat_join, on_member_chat_leave,
+	on_successful_payment,)
+"""The handlers registered on every bot by the `bots` startup stage. They
+take the bot as the first argument.
+"""
+
+
+# Running the Bot ===================================================
+async def _Shutdown(pending: Iterable[asyncio.Task] = ()) -> None:
+	"""Shuts the bots down once the intake of updates has stopped:
+	drains the in-flight updates (and `pending` tasks) up to the deadline,
+	cancels the profiling window if any, then for every bot stops
+	broadcasts at their checkpoints, cancels the timers of the pools in
+	bulk, and saves all resident users in one transaction.
+	"""
+	import asyncio
+	from time import perf_counter
+	start = perf_counter()
+	# Letting the handlers of already received updates start...
+	await asyncio.sleep(0)
+	# Draining in-flight updates...
+	tasks = _inFlight | set(pending)
+	if tasks:
+		_, unfinished = await asyncio.wait(tasks, timeout=_SHUTDOWN_DEADLINE)
+		for task in unfinished:
+			task.cancel()
+		if unfinished:
+			logging.warning(f'{len(unfinished)} updates were cancelled '
+				'at shutdown')
+	await profiler.Cancel()
+	for bot in _bots:
+		await bot.broadcaster.Stop()
+		bot.op_pool.CancelTimers()
+	# Cancelling timers & saving users of every shared pool once...
+	for userPool in dict.fromkeys(bot.user_pool for bot in _bots):
+		userPool.close()
+	logging.info(f'shutdown took {(perf_counter() - start) * 1e3:.1f} ms')
+
+
+def _RunShardWorker(shard: int, queue) -> None:
+	"""Runs a shard worker of the sharded mode. It reads raw updates from
+	`queue` until it gets `None`. The pools of this process only ever see
+	the users of this shard.
+	"""
+	global _shard
+	import asyncio
+	import signal
+	async def _main() -> None:
+		loop = asyncio.get_running_loop()
+		tasks: set[asyncio.Task] = set()
+		async with happyEngBot:
+			# Resuming broadcasts in only one shard...
+			if shard == 0:
+				happyEngBot.broadcaster.ResumeAll()
+			while True:
+				raw = await loop.run_in_executor(None, queue.get)
+				if raw is None:
+					break
+				task = loop.create_task(_HandleRawUpdate(raw))
+				tasks.add(task)
+				task.add_done_callback(tasks.discard)
+			await _Shutdown(tasks)
+	# Leaving Ctrl+C & SIGTERM, which might be sent to the whole group, to
+	# the front process which stops us via the queue...
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	signal.signal(signal.SIGTERM, signal.SIG_IGN)
+	_shard = shard
+	Startup()
+	logging.info(f'shard {shard} is ready')
+	try:
+		asyncio.run(_main())
+	finally:
+		_CloseDatabases()
+		_SaveHwms()
+
+
+async def _Poll(bot: HappyEngBot, token: str) -> None:
+	"""Catches up with the backlog of the bot, if enabled, and then polls
+	updates.
+	"""
+	if _CATCH_UP:
+		try:
+			await _CatchUp(bot, token)
+		except Exception:
+			# Leaving the backlog to the normal dispatch...
+			logging.error('catching up failed', exc_info=True)
+	await bot.connect()
+
+
+async def _CatchUp(bot: HappyEngBot, token: str) -> None:
+	"""Handles the backlog of the bot collapsed, in parallel per user."""
+	from bale import Update
+	from app_utils import BOT_BRAND
+	from catchup import CatchUp
+	from sharding import BALE_API_URL
+	async def _Handle(raw: dict[str, Any]) -> None:
+		# Marking the task of the user...
+		BOT_BRAND.set(bot.brand)
+		_catchingUp.set(True)
+		await _HandleUpdate(bot, Update.from_dict(raw, bot))
+	stats = await CatchUp(_BASE_URL or BALE_API_URL, token, _Handle)
+	if stats.fetched:
+		logging.info(f'caught up with {stats.fetched} updates of '
+			f'{stats.users} users: {stats.handled} handled in '
+			f'{stats.secs:.1f}s')
+
+
+async def _StartWebhook() -> WebhookServer:
+	"""Starts the webhook server and registers it with Bale."""
+	from sharding import BALE_API_URL
+	from webhook import WebhookServer, SetWebhook
+	server = WebhookServer(
+		_HandleRawUpdate,
+		path=_WEBHOOK.get('PATH', '/webhook'),
+		secret=_WEBHOOK['SECRET'])
+	await server.Start(
+		_WEBHOOK.get('HOST', '0.0.0.0'),
+		_WEBHOOK.get('PORT', 8443))
+	await SetWebhook(
+		_BASE_URL or BALE_API_URL,
+		_BOTS[0].token,
+		_WEBHOOK['URL'],
+		_WEBHOOK['SECRET'])
+	return server
+
+
+def _OnStopSignal(
+		loop: asyncio.AbstractEventLoop,
+		stop: asyncio.Event,
+		) -> None:
+	"""Sets `stop` upon SIGINT & SIGTERM."""
+	import signal
+	for sig in (signal.SIGINT, signal.SIGTERM):
+		try:
+			loop.add_signal_handler(sig, stop.set)
+		except NotImplementedError:
+			# Falling back on Windows...
+			signal.signal(
+				sig,
+				lambda *_: loop.call_soon_threadsafe(stop.set))
+
+
 def main() -> None:
 	# Declaring of variables -----------------
 	import asyncio
-	task: asyncio.Task | None
 	# Local functions ------------------------
 	async def _main() -> None:
-		async with happyEngBot:
-			await happyEngBot.connect()
-
+		from contextlib import AsyncExitStack
+		loop = asyncio.get_running_loop()
+		stop = asyncio.Event()
+		_OnStopSignal(loop, stop)
+		async with AsyncExitStack() as stack:
+			for bot in _bots:
+				await stack.enter_async_context(bot)
+			# Starting the intake of updates...
+			server = None
+			tasks = {loop.create_task(stop.wait())}
+			if _WEBHOOK is None:
+				tasks.update(
+					loop.create_task(_Poll(bot, config.token))
+					for bot, config in zip(_bots, _BOTS))
+			else:
+				server = await _StartWebhook()
+				happyEngBot.broadcaster.ResumeAll()
+			await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+			logging.info('shutting down')
+			# Stopping the intake...
+			for task in tasks:
+				task.cancel()
+			await asyncio.gather(*tasks, return_exceptions=True)
+			if server is not None:
+				await server.Drain(
+					_WEBHOOK.get('DRAIN_DEADLINE', _SHUTDOWN_DEADLINE))
+			await _Shutdown()
+
+	# The front process of the sharded mode needs only the config...
+	durations = _RunStages(_BASE_STAGES)
+	if _SHARDS > 1:
+		from sharding import RunSharded
+		_RunStages(_FRONT_STAGES)
+		RunSharded(_SHARDS, _BOTS[0].token, _BASE_URL, _RunShardWorker)
+		return
+	durations |= _RunStages(_APP_STAGES)
+	logging.info(f'startup took {sum(durations.values()) * 1e3:.1f} ms')
 	try:
 		asyncio.run(_main())
 	except KeyboardInterrupt:
-		asyncio.create_task(happyEngBot.close())
-	except SystemExit:
-		asyncio.create_task(happyEngBot.close())
+		logging.warning('interrupted before the shutdown finished')
 	finally:
-		userPool.close()
-		DB.Close()
+		_CloseDatabases()
+		_SaveHwms()
 
 
 if __name__ == '__main__':
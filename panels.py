@@ -5,19 +5,67 @@
 and stage of work.
 """
 
+from collections import OrderedDict
 from typing import Any, Coroutine
 
 from bale import (
     Message, User, InlineKeyboardMarkup, InlineKeyboardButton,
     MenuKeyboardMarkup, MenuKeyboardButton)
 
-from db import IDatabase
+from broadcast import Broadcaster
+from db import ID, IDatabase
 import lang
+from profiler import Profiler, ProfileResult
 from utils.types import Commands, UserPool, OperationPool
 
 
 COMING_SOON = 'Coming soon...'
 
+SHOWCASE_PAGE_SIZE = 10
+"""The number of products on each page of the showcase."""
+
+USER_SEARCH_PAGE_SIZE = 20
+"""The number of users on each page of the search results of admins."""
+
+_COURSES_TTL = 300.0
+"""The seconds the courses of a user are served from the entry of the
+user in the pool. It bounds how stale they get after products are
+granted, e.g. by imports of another process.
+"""
+
+_SHOWCASE_CACHE_MAX = 256
+"""The maximum number of rendered showcase pages kept in the cache. The
+least recently used page is evicted beyond it.
+"""
+
+_SHOWCASE_CACHE_TTL = 60.0
+"""The seconds a rendered showcase page is served from the cache. It
+bounds how stale pages get after products change in another process,
+e.g. by imports; writers in this process call `InvalidateShowcase`.
+"""
+
+type _Page = tuple[str, tuple[tuple[str, str], ...]]
+"""A rendered page as a 2-tuple of the text and the `(label, callback
+data)` pairs of its buttons.
+"""
+
+_showcasePages: OrderedDict[
+    tuple[IDatabase, str | None],
+    tuple[float, _Page]] = OrderedDict()
+"""The read-through cache of rendered showcase pages as `(database,
+cursor) -> (expiry, page)` in the order of use, where expiry is a
+monotonic time.
+"""
+
+_SEARCH_QUERIES_MAX = 256
+"""The maximum number of queries of user searches kept for paging."""
+
+_searchQueries: OrderedDict[str, str] = OrderedDict()
+"""The recent queries of user searches as `key -> query` in the order of
+use. Buttons of next pages carry the short key, as queries might exceed
+the 64-byte limit of callback data.
+"""
+
 
 def _GetCommandInfoButton(
         cmd: Commands,
@@ -62,20 +110,167 @@ def GetUnexDataReply(
 def GetAdminReply(
         bale_msg: Message | None,
         bale_user: User,
-        admin_ids: tuple[int, ...]
+        admin_ids: tuple[int, ...],
+        cmd: str,
+        db: IDatabase,
+        broadcaster: Broadcaster,
+        profiler: Profiler,
         ) -> Coroutine[Any, Any, Message]:
-    """Responds the message with the admin panel. Parameters are as
-    follow:
+    """Responds the message with the admin panel or runs an admin
+    sub-command. Parameters are as follow:
     * `message`: the end user.
     * `admin_ids`: the IDs of all admin users.
+    * `cmd`: the whole command, e.g. `/admin broadcast <text>`.
+    * `db`: the database.
+    * `broadcaster`: the broadcast engine.
+    * `profiler`: the profiler of the event loop.
     """
     if bale_user is None or bale_user.id not in admin_ids:
         # Prompting no access...
         return bale_msg.reply(lang.ADMIN_PANEL_NO_ACCESS)
-    else:
-        # Prompting admin panel...
-        text = lang.ADMIN_PANEL
-        return bale_msg.reply(text)
+    # Running the sub-command...
+    parts = cmd.split(maxsplit=2)
+    subCmd = parts[1].lower() if len(parts) > 1 else ''
+    arg = parts[2] if len(parts) > 2 else ''
+    match subCmd:
+        case 'broadcast' | 'broadcast-peak' if arg:
+            broadcast = broadcaster.Start(arg, subCmd == 'broadcast-peak')
+            return bale_msg.reply(
+                lang.ADMIN_BROADCAST_STARTED.format(broadcast.Id))
+        case 'broadcast' | 'broadcast-peak':
+            lines = [
+                lang.ADMIN_BROADCAST_STATUS.format(
+                    bc.Id,
+                    bc.Pass,
+                    bc.Sent,
+                    bc.Failed)
+                for bc in broadcaster.GetStatus()]
+            return bale_msg.reply(
+                '\n'.join(lines) if lines else lang.ADMIN_NO_BROADCASTS)
+        case 'stats':
+            if arg.lower() == 'rebuild':
+                before, after = db.RebuildStats()
+                return bale_msg.reply(
+                    lang.ADMIN_STATS_REBUILT.format(before, after))
+            return bale_msg.reply(_RenderStats(db))
+        case 'search' if arg:
+            return _GetUserSearchReply(bale_msg, db, arg)
+        case 'profile':
+            try:
+                secs = float(arg) if arg else 10.0
+            except ValueError:
+                secs = 10.0
+            if not secs > 0:
+                secs = 10.0
+            return _GetProfileReply(bale_msg, profiler, secs)
+        case _:
+            # Prompting admin panel...
+            text = f'{lang.ADMIN_PANEL}\n\n{lang.ADMIN_CMDS}'
+            return bale_msg.reply(text)
+
+
+def _GetUserSearchReply(
+        bale_msg: Message | None,
+        db: IDatabase,
+        arg: str,
+        ) -> Coroutine[Any, Any, Message]:
+    """Replies a page of users matching the query. `arg` is the query,
+    optionally preceded by `@<user ID>` to get the page after that user.
+    After `@<user ID>`, `#<key>` stands for a query kept by a previous
+    page.
+    """
+    after: ID | None = None
+    first, _, rest = arg.partition(' ')
+    if first[0] == '@' and first[1:].isdecimal() and rest:
+        after = int(first[1:])
+        arg = rest
+        if arg[0] == '#':
+            try:
+                arg = _searchQueries[arg[1:]]
+            except KeyError:
+                return bale_msg.reply(lang.ADMIN_SEARCH_EXPIRED)
+    users = db.SearchUsers(arg, USER_SEARCH_PAGE_SIZE, after=after)
+    if not users:
+        return bale_msg.reply(lang.ADMIN_SEARCH_NOTHING)
+    lines = [
+        f'{user.Id}: {user.FirstName} {user.LastName} - {user.Phone}'
+        for user in users]
+    buttons = InlineKeyboardMarkup()
+    if len(users) == USER_SEARCH_PAGE_SIZE:
+        buttons.add(InlineKeyboardButton(
+            lang.NEXT_PAGE,
+            callback_data=(
+                f'{Commands.ADMIN.value} search @{users[-1].Id} '
+                f'#{_KeepSearchQuery(arg)}')))
+    return bale_msg.reply('\n'.join(lines), components=buttons)
+
+
+def _KeepSearchQuery(query: str) -> str:
+    """Keeps the query of a user search for its next pages and returns
+    its short key.
+    """
+    from base64 import urlsafe_b64encode
+    from hashlib import blake2b
+    key = urlsafe_b64encode(
+        blake2b(query.encode(), digest_size=6).digest()).decode()
+    _searchQueries[key] = query
+    _searchQueries.move_to_end(key)
+    if len(_searchQueries) > _SEARCH_QUERIES_MAX:
+        _searchQueries.popitem(last=False)
+    return key
+
+
+def _GetProfileReply(
+        bale_msg: Message | None,
+        profiler: Profiler,
+        secs: float,
+        ) -> Coroutine[Any, Any, Message]:
+    """Starts profiling the Bot for the window and replies. The summary
+    is replied by the profiler once the window ends, so the handler of
+    the update does not wait for it.
+    """
+    if profiler.Running:
+        return bale_msg.reply(lang.ADMIN_PROFILE_BUSY)
+    secs = min(secs, profiler.MaxSecs)
+    profiler.Start(secs, lambda result: _ReplyProfile(bale_msg, result))
+    return bale_msg.reply(lang.ADMIN_PROFILE_STARTED.format(f'{secs:g}'))
+
+
+async def _ReplyProfile(
+        bale_msg: Message | None,
+        result: ProfileResult,
+        ) -> Message:
+    """Replies the summary of the profiling window."""
+    lines = [lang.ADMIN_PROFILE_DONE.format(
+        result.samples,
+        result.secs,
+        result.path)]
+    lines.append(lang.ADMIN_PROFILE_FUNCS)
+    lines.extend(
+        f'{percent:.1f}% {func}'
+        for func, percent in result.top_funcs)
+    lines.append(lang.ADMIN_PROFILE_ALLOCS)
+    lines.extend(
+        f'{size / 1024:+.1f} KiB ({count:+}) {line}'
+        for line, size, count in result.top_allocs)
+    return await bale_msg.reply('\n'.join(lines))
+
+
+def _RenderStats(db: IDatabase) -> str:
+    """Renders the admin statistics. It only reads the incrementally
+    maintained statistics tables.
+    """
+    from datetime import date
+    lines = [lang.ADMIN_STATS_USERS.format(db.GetUsersCount())]
+    lines.append(lang.ADMIN_STATS_SIGNUPS)
+    lines.extend(
+        f'{day}: {count}'
+        for day, count in db.GetSignups(7))
+    lines.append(lang.ADMIN_STATS_ACTIVE)
+    lines.extend(
+        f'{hour:02}: {count}'
+        for hour, count in db.GetActiveUsers(date.today().isoformat()))
+    return '\n'.join(lines)
 
 
 def GetHelpReply(
@@ -95,10 +290,112 @@ def GetHelpReply(
     return bale_msg.reply(text, components=buttons)
 
 
+def GetMyCoursesReply(
+        bale_msg: Message | None,
+        bale_user: User,
+        user_pool: UserPool,
+        db: IDatabase,
+        ) -> Coroutine[Any, Any, Message]:
+    """Responds the message with the courses of the user. The courses are
+    cached on the entry of the user in the pool for `_COURSES_TTL`
+    seconds, so repeated views cost no I/O.
+    """
+    try:
+        userData = user_pool[bale_user.id]
+    except KeyError:
+        buttons = InlineKeyboardMarkup()
+        _GetCommandInfoButton(Commands.SIGN_IN, None, buttons)
+        return bale_msg.reply(lang.NOT_SIGNED_IN, components=buttons)
+    if userData.Courses is None or userData.CoursesAge >= _COURSES_TTL:
+        userData.Courses = db.GetUserProducts(userData.Id)
+    if not userData.Courses:
+        return bale_msg.reply(lang.NO_COURSES)
+    lines = [lang.MY_COURSES]
+    lines.extend(f'• {course.Name}' for course in userData.Courses)
+    return bale_msg.reply('\n'.join(lines))
+
+
 def GetShowcaseReply(
         bale_msg: Message | None,
+        db: IDatabase,
+        cursor: str | None = None,
         ) -> Coroutine[Any, Any, Message]:
-    return bale_msg.reply(COMING_SOON)
+    """Responds the message with a page of the showcase. `cursor` is
+    `>ID` for the page after the product ID, `<ID` for the page before
+    it, and `None` for the first page. Pages are served from an in-process
+    LRU cache for `_SHOWCASE_CACHE_TTL` seconds or until
+    `InvalidateShowcase` is called.
+    """
+    from time import monotonic
+    if cursor and not (cursor[0] in '<>' and cursor[1:].isdecimal()):
+        cursor = None
+    now = monotonic()
+    key = (db, cursor,)
+    try:
+        expiry, (text, btnsSpec) = _showcasePages[key]
+        if expiry <= now:
+            raise KeyError(cursor)
+        _showcasePages.move_to_end(key)
+    except KeyError:
+        text, btnsSpec = _RenderShowcasePage(db, cursor)
+        _showcasePages[key] = (now + _SHOWCASE_CACHE_TTL, (text, btnsSpec),)
+        _showcasePages.move_to_end(key)
+        if len(_showcasePages) > _SHOWCASE_CACHE_MAX:
+            _showcasePages.popitem(last=False)
+    buttons = InlineKeyboardMarkup()
+    for label, cbData in btnsSpec:
+        buttons.add(InlineKeyboardButton(label, callback_data=cbData))
+    return bale_msg.reply(text, components=buttons)
+
+
+def InvalidateShowcase(db: IDatabase | None = None) -> None:
+    """Drops the cached showcase pages of the database, or of all
+    databases if `None`. It must be called after changing the products
+    of a database in this process.
+    """
+    if db is None:
+        _showcasePages.clear()
+        return
+    for key in [key for key in _showcasePages if key[0] is db]:
+        del _showcasePages[key]
+
+
+def _RenderShowcasePage(db: IDatabase, cursor: str | None) -> _Page:
+    """Reads a page of products from the database and renders it."""
+    # Reading one extra product to know if there is another page...
+    after: ID | None = None
+    before: ID | None = None
+    if cursor and cursor[0] == '>':
+        after = int(cursor[1:])
+    elif cursor and cursor[0] == '<':
+        before = int(cursor[1:])
+    products = db.GetProducts(
+        SHOWCASE_PAGE_SIZE + 1,
+        after=after,
+        before=before)
+    if before is None:
+        hasPrev = after is not None
+        hasNext = len(products) > SHOWCASE_PAGE_SIZE
+        products = products[:SHOWCASE_PAGE_SIZE]
+    else:
+        hasPrev = len(products) > SHOWCASE_PAGE_SIZE
+        hasNext = True
+        products = products[-SHOWCASE_PAGE_SIZE:]
+    # Rendering the page...
+    if not products:
+        return (lang.SHOWCASE_EMPTY, ())
+    lines = [lang.SHOWCASE]
+    lines.extend(f'• {product.Name}' for product in products)
+    btnsSpec: list[tuple[str, str]] = []
+    if hasPrev:
+        btnsSpec.append((
+            lang.PREV_PAGE,
+            f'{Commands.SHOWCASE.value} <{products[0].Id}'))
+    if hasNext:
+        btnsSpec.append((
+            lang.NEXT_PAGE,
+            f'{Commands.SHOWCASE.value} >{products[-1].Id}'))
+    return ('\n'.join(lines), tuple(btnsSpec))
 
 
 def GetStartReply(
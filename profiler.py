@@ -0,0 +1,253 @@
+#
+#
+#
+"""This module offers a profiler of the running Bot which admins toggle
+at runtime for a bounded window. Throughout the window, a thread samples
+the stack of the event-loop thread at a fixed interval, and `tracemalloc`
+snapshots taken at both ends are diffed. The results are written to a
+text file and summarized for the reply.
+
+As the sampler needs the GIL, it mostly catches the loop where it waits
+for I/O or where code holds the loop beyond the switch interval of the
+interpreter; the latter is exactly what raises the latency of replies.
+
+#### Types:
+1. `Profiler`
+2. `ProfileResult`
+"""
+
+from __future__ import annotations
+import asyncio
+from collections import Counter
+import logging
+from pathlib import Path
+import sys
+import threading
+import tracemalloc
+from types import CodeType
+from typing import Any, Awaitable, Callable, NamedTuple
+
+
+class ProfileResult(NamedTuple):
+    """The outcome of a profiling window."""
+    path: Path
+    """The file of the full results."""
+    secs: float
+    samples: int
+    top_funcs: tuple[tuple[str, float], ...]
+    """The functions most often on top of the stack as `(function,
+    percent of samples)` pairs.
+    """
+    top_allocs: tuple[tuple[str, int, int], ...]
+    """The lines whose allocations grew the most as `(line, size diff,
+    count diff)` triples.
+    """
+
+
+class Profiler:
+    """Profiles the event loop for a window at a time. Arguments are as
+    follow:
+
+    * `out_dir`: the directory of result files; it is created if missing.
+    * `interval`: the seconds between two samples of the stack.
+    * `max_secs`: the longest window allowed.
+    * `top`: the number of entries in summaries.
+    """
+
+    def __init__(
+            self,
+            out_dir: Path,
+            *,
+            interval: float = 0.005,
+            max_secs: float = 120.0,
+            top: int = 5,
+            ) -> None:
+        self._outDir = out_dir
+        self._interval = interval
+        self._maxSecs = max_secs
+        self._top = top
+        self._running = False
+        self._task: asyncio.Task | None = None
+        """The detached task of the window started by `Start`."""
+        self._labels: dict[CodeType, str] = {}
+        """The cache of labels of code objects, so that samples do not
+        format strings.
+        """
+
+    @property
+    def Running(self) -> bool:
+        """Specifies whether a window is being profiled."""
+        return self._running or (
+            self._task is not None and not self._task.done())
+
+    @property
+    def MaxSecs(self) -> float:
+        return self._maxSecs
+
+    def Start(
+            self,
+            secs: float,
+            on_done: Callable[[ProfileResult], Awaitable[Any]],
+            ) -> None:
+        """Profiles a window as a task owned by this profiler, then awaits
+        `on_done` with the result, so that callers such as update handlers
+        return at once. It raises `RuntimeError` if another window is
+        being profiled. `Cancel` stops the task.
+        """
+        if self.Running:
+            raise RuntimeError('a profile is already running')
+        self._task = asyncio.create_task(
+            self._ProfileThen(secs, on_done),
+            name='profiler')
+        self._task.add_done_callback(self._OnTaskDone)
+
+    async def Cancel(self) -> None:
+        """Cancels the window started by `Start`, if any, and waits for it
+        to stop.
+        """
+        task = self._task
+        if task is None or task.done():
+            return
+        task.cancel()
+        await asyncio.wait((task,))
+
+    async def Profile(self, secs: float) -> ProfileResult:
+        """Profiles the event loop running this coroutine for `secs`
+        seconds, capped at `max_secs`. It raises `RuntimeError` if another
+        window is being profiled.
+        """
+        from time import perf_counter, strftime
+        if self._running:
+            raise RuntimeError('a profile is already running')
+        secs = min(max(secs, self._interval), self._maxSecs)
+        self._running = True
+        stacks: Counter[tuple[str, ...]] = Counter()
+        stop = threading.Event()
+        sampler = threading.Thread(
+            target=self._Sample,
+            args=(threading.get_ident(), stacks, stop,),
+            name='profiler',
+            daemon=True)
+        # Leaving tracing on if someone else has started it...
+        wasTracing = tracemalloc.is_tracing()
+        try:
+            if not wasTracing:
+                tracemalloc.start()
+            before = tracemalloc.take_snapshot()
+            start = perf_counter()
+            sampler.start()
+            try:
+                await asyncio.sleep(secs)
+            finally:
+                stop.set()
+                after = tracemalloc.take_snapshot()
+                secs = perf_counter() - start
+                if not wasTracing:
+                    tracemalloc.stop()
+                await asyncio.to_thread(sampler.join)
+            path = self._outDir / f'profile-{strftime("%Y%m%d-%H%M%S")}.txt'
+            result = await asyncio.to_thread(
+                self._Report,
+                path,
+                secs,
+                stacks,
+                before,
+                after)
+        finally:
+            self._running = False
+        logging.info(f'profiled {secs:.1f}s into {path}')
+        return result
+
+    async def _ProfileThen(
+            self,
+            secs: float,
+            on_done: Callable[[ProfileResult], Awaitable[Any]],
+            ) -> None:
+        result = await self.Profile(secs)
+        await on_done(result)
+
+    def _OnTaskDone(self, task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(
+                'profiling failed',
+                exc_info=task.exception())
+
+    def _Sample(
+            self,
+            thread_id: int,
+            stacks: Counter[tuple[str, ...]],
+            stop: threading.Event,
+            ) -> None:
+        """Counts the stacks of the thread until `stop` is set."""
+        labels = self._labels
+        while not stop.wait(self._interval):
+            frame = sys._current_frames().get(thread_id)
+            stack: list[str] = []
+            while frame is not None:
+                code = frame.f_code
+                try:
+                    stack.append(labels[code])
+                except KeyError:
+                    label = (f'{Path(code.co_filename).name}:'
+                        f'{code.co_qualname}')
+                    labels[code] = label
+                    stack.append(label)
+                frame = frame.f_back
+            if stack:
+                stack.reverse()
+                stacks[tuple(stack)] += 1
+
+    def _Report(
+            self,
+            path: Path,
+            secs: float,
+            stacks: Counter[tuple[str, ...]],
+            before: tracemalloc.Snapshot,
+            after: tracemalloc.Snapshot,
+            ) -> ProfileResult:
+        """Writes the full results to the file and summarizes them. Stacks
+        are written in the folded format of flame graphs.
+        """
+        # Leaving out the allocations of profiling itself...
+        filters = (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),)
+        diffs = [
+            diff
+            for diff in after.filter_traces(filters).compare_to(
+                before.filter_traces(filters),
+                'lineno')
+            if diff.size_diff]
+        samples = stacks.total()
+        percent = 100 / max(samples, 1)
+        leaves: Counter[str] = Counter()
+        for stack, count in stacks.items():
+            leaves[stack[-1]] += count
+        # Writing the results...
+        self._outDir.mkdir(parents=True, exist_ok=True)
+        with open(path, mode='wt', encoding='utf-8') as fileObj:
+            fileObj.write(f'# {samples} samples in {secs:.3f}s every '
+                f'{self._interval * 1e3:g}ms\n')
+            fileObj.write('\n# Top of stacks\n')
+            for label, count in leaves.most_common():
+                fileObj.write(f'{count * percent:6.2f}% {label}\n')
+            fileObj.write('\n# Allocation diffs\n')
+            for diff in diffs:
+                fileObj.write(f'{diff}\n')
+            fileObj.write('\n# Folded stacks\n')
+            for stack, count in stacks.most_common():
+                fileObj.write(f'{";".join(stack)} {count}\n')
+        return ProfileResult(
+            path,
+            secs,
+            samples,
+            tuple(
+                (label, count * percent,)
+                for label, count in leaves.most_common(self._top)),
+            tuple(
+                (
+                    f'{Path(diff.traceback[0].filename).name}:'
+                        f'{diff.traceback[0].lineno}',
+                    diff.size_diff,
+                    diff.count_diff,)
+                for diff in diffs[:self._top]))
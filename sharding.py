@@ -0,0 +1,149 @@
+#
+#
+#
+"""This module offers the sharded worker mode of the Bot. In this mode a
+front process long-polls the Bale servers and routes each raw update, by
+a hash of the ID of its sender, to one of N worker processes. Every
+worker owns its own `UserPool` & `OperationPool` shard, so the state of a
+user always stays local to one process, and all workers share the
+database in WAL mode.
+
+#### Functions:
+1. `ShardOf`: gets the shard of a user ID.
+2. `GetSenderId`: gets the ID of the sender of a raw update.
+3. `RunSharded`: runs the front process and the worker processes.
+"""
+
+from __future__ import annotations
+import asyncio
+import logging
+from multiprocessing.queues import Queue
+from typing import Any, Callable
+
+
+BALE_API_URL = 'https://tapi.bale.ai'
+"""The default base URL of the Bale Bot API."""
+
+_POLL_TIMEOUT = 30
+"""The long-polling timeout of `getUpdates` in seconds."""
+
+
+def ShardOf(user_id: int | None, n_shards: int) -> int:
+    """Gets the shard index of the specified user ID among `n_shards`
+    shards. Updates without a sender all go to the first shard.
+    """
+    if user_id is None:
+        return 0
+    # Fibonacci hashing to spread sequential IDs evenly...
+    mixed = (user_id * 0x9E37_79B9_7F4A_7C15) & 0xFFFF_FFFF_FFFF_FFFF
+    return (mixed >> 32) % n_shards
+
+
+def GetSenderId(update: dict[str, Any]) -> int | None:
+    """Gets the ID of the user who caused the raw update or `None` if it
+    cannot be determined.
+    """
+    for key in ('callback_query', 'message', 'edited_message'):
+        try:
+            return update[key]['from']['id']
+        except (KeyError, TypeError):
+            pass
+    return None
+
+
+async def FetchUpdates(
+        session,
+        base_url: str,
+        token: str,
+        offset: int,
+        *,
+        timeout: int = _POLL_TIMEOUT,
+        limit: int = 100,
+        ) -> list[dict[str, Any]]:
+    """Fetches raw updates from `getUpdates` starting from `offset`. The
+    `session` must be an `aiohttp.ClientSession`. It returns an empty list
+    upon API errors after logging them, and raises `ValueError` if the
+    response is not a JSON object.
+    """
+    url = f'{base_url}/bot{token}/getUpdates'
+    params = {'offset': offset, 'limit': limit, 'timeout': timeout}
+    async with session.post(url, json=params) as resp:
+        body = await resp.json()
+    if not isinstance(body, dict):
+        raise ValueError(f'getUpdates returned {body!r}')
+    if not body.get('ok'):
+        logging.error(f'getUpdates failed: {body}')
+        retryAfter = body.get('parameters', {}).get('retry_after', 1)
+        await asyncio.sleep(retryAfter)
+        return []
+    return body['result']
+
+
+async def _RunFront(
+        base_url: str,
+        token: str,
+        queues: list[Queue],
+        ) -> None:
+    """Long-polls the Bale servers and routes updates to `queues`. Failed
+    polls, including malformed responses of gateways, are retried.
+    """
+    from aiohttp import ClientError, ClientSession, ClientTimeout
+    offset = 0
+    timeout = ClientTimeout(total=_POLL_TIMEOUT + 10)
+    async with ClientSession(timeout=timeout) as session:
+        while True:
+            try:
+                updates = await FetchUpdates(session, base_url, token, offset)
+            except (
+                    OSError,
+                    asyncio.TimeoutError,
+                    ClientError,
+                    ValueError,):
+                logging.error('polling Bale servers failed', exc_info=True)
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                offset = max(offset, update['update_id'] + 1)
+                shard = ShardOf(GetSenderId(update), len(queues))
+                queues[shard].put(update)
+
+
+def RunSharded(
+        n_shards: int,
+        token: str,
+        base_url: str | None,
+        worker: Callable[[int, Queue], None],
+        ) -> None:
+    """Runs the front process in the current process and `n_shards`
+    worker processes. `worker` must be a picklable function which accepts
+    the shard index and its queue of raw updates; a `None` item on the
+    queue asks the worker to stop. Upon SIGINT or SIGTERM, the front stops
+    polling, asks the workers to stop, and waits for them.
+    """
+    import multiprocessing
+    import signal
+    def _OnTerm(*_) -> None:
+        raise KeyboardInterrupt
+    ctx = multiprocessing.get_context('spawn')
+    queues: list[Queue] = [ctx.Queue() for _ in range(n_shards)]
+    workers = [
+        ctx.Process(
+            target=worker,
+            args=(idx, queue),
+            name=f'shard-{idx}',
+            daemon=False)
+        for idx, queue in enumerate(queues)]
+    for proc in workers:
+        proc.start()
+    logging.info(f'{n_shards} shard workers started')
+    # Stopping the workers upon SIGTERM, the signal of deploys, as well...
+    signal.signal(signal.SIGTERM, _OnTerm)
+    try:
+        asyncio.run(_RunFront(base_url or BALE_API_URL, token, queues))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for queue in queues:
+            queue.put(None)
+        for proc in workers:
+            proc.join()
@@ -0,0 +1,280 @@
+#
+#
+#
+"""Checks that all the backends of `IDatabase` behave the same. Run it
+from the root of the repository with `python -m pytest`.
+"""
+
+import pytest
+
+from db import IDatabase, PhoneTakenError, ProductData, UserData
+from db.log import LogDb
+from db.memory import MemoryDb
+from db.sqlite3 import SqliteDb
+
+
+_PHONE = '09121234567'
+"""A phone and another form of it follow."""
+_PHONE_INTL = '+98 912 123 4567'
+
+
+@pytest.fixture(params=('sqlite', 'sqlite_in_memory', 'memory', 'log',))
+def db(request, tmp_path):
+    match request.param:
+        case 'sqlite':
+            database = SqliteDb(tmp_path / 'db.db3')
+        case 'sqlite_in_memory':
+            database = SqliteDb(tmp_path / 'db.db3', in_memory=True)
+        case 'memory':
+            database = MemoryDb()
+        case 'log':
+            database = LogDb(tmp_path / 'db.log')
+    yield database
+    database.Close()
+
+
+def _User(id_: int, phone: str = '', first_name: str = 'Ali') -> UserData:
+    return UserData(id_, first_name, f'Last{id_}', phone or f'0912{id_:07}')
+
+
+def test_phone_unique(db: IDatabase) -> None:
+    db.UpsertUser(_User(1, _PHONE))
+    assert db.GetUserIdByPhone(_PHONE_INTL) == 1
+    with pytest.raises(PhoneTakenError):
+        db.UpsertUser(_User(2, _PHONE_INTL))
+    assert not db.DoesIdExist(2)
+    # Saving the owner again must not conflict with itself...
+    db.UpsertUser(_User(1, _PHONE, 'Reza'))
+    assert db.GetUser(1).FirstName == 'Reza'
+
+
+def test_duplicate_phone_upsert(db: IDatabase) -> None:
+    db.UpsertUser(_User(1, _PHONE))
+    assert db.UpsertUsers([_User(2, _PHONE_INTL)]) == 1
+    assert db.GetUserIdByPhone(_PHONE) == 1
+    # A stored duplicate can still be saved one at a time...
+    db.UpsertUser(_User(2, _PHONE_INTL, 'Reza'))
+    assert db.GetUser(2).FirstName == 'Reza'
+    assert db.GetUserIdByPhone(_PHONE) == 1
+    # but not moved to another taken phone...
+    db.UpsertUser(_User(3))
+    with pytest.raises(PhoneTakenError):
+        db.UpsertUser(_User(2, _User(3).Phone))
+    assert db.GetUser(2).Phone == _PHONE_INTL
+
+
+def _Ids(users) -> list[int]:
+    return [user.Id for user in users]
+
+
+def _Fail(items, after: int):
+    """Yields the items and raises `RuntimeError` after `after` of them
+    to check that bulk methods roll back.
+    """
+    for idx, item in enumerate(items):
+        if idx == after:
+            raise RuntimeError('bulk failure')
+        yield item
+
+
+def test_keyset_paging(db: IDatabase) -> None:
+    db.UpsertUsers(_User(id_) for id_ in (5, 1, 9, 3, 7))
+    assert _Ids(db.GetUsers(2)) == [1, 3]
+    assert _Ids(db.GetUsers(2, after=3)) == [5, 7]
+    assert _Ids(db.GetUsers(2, after=7)) == [9]
+    assert _Ids(db.GetUsers(2, after=9)) == []
+    db.UpsertProducts(ProductData(id_, f'Course{id_}') for id_ in range(1, 6))
+    assert [prod.Id for prod in db.GetProducts(2)] == [1, 2]
+    assert [prod.Id for prod in db.GetProducts(2, after=2)] == [3, 4]
+    assert [prod.Id for prod in db.GetProducts(2, before=5)] == [3, 4]
+    assert [prod.Id for prod in db.GetProducts(2, before=2)] == [1]
+    assert db.AddUsersProducts([(3, 2), (1, 4), (1, 2), (1, 2)]) == 4
+    assert db.GetUsersProductsPairs(2) == ((1, 2), (1, 4),)
+    assert db.GetUsersProductsPairs(2, after=(1, 4)) == ((3, 2),)
+    assert [prod.Id for prod in db.GetUserProducts(1)] == [2, 4]
+    assert db.GetProductOwners(2) == (1, 3,)
+    products = db.GetUsersProducts([1, 5])
+    assert [prod.Id for prod in products[1]] == [2, 4]
+    assert products[5] == ()
+
+
+def test_bulk_rollback(db: IDatabase) -> None:
+    db.UpsertUser(_User(1))
+    with pytest.raises(RuntimeError):
+        db.UpsertUsers(_Fail(
+            [_User(1, first_name='Reza'), _User(2), _User(3)],
+            2))
+    assert _Ids(db.GetUsers(10)) == [1]
+    assert db.GetUser(1).FirstName == 'Ali'
+    assert db.GetUsersCount() == 1
+    assert db.SearchUsers('Last2', 10) == ()
+    with pytest.raises(RuntimeError):
+        db.UpsertProducts(_Fail([ProductData(1, 'A'), ProductData(2, 'B')], 1))
+    assert db.GetProducts(10) == ()
+    db.UpsertProduct(ProductData(1, 'A'))
+    with pytest.raises(RuntimeError):
+        db.AddUsersProducts(_Fail([(1, 1), (1, 1)], 1))
+    assert db.GetUsersProductsPairs(10) == ()
+    assert db.GetUserProducts(1) == ()
+
+
+def test_broadcasts(db: IDatabase) -> None:
+    first = db.CreateBroadcast('Hello', True, 1_000)
+    second = db.CreateBroadcast('Bye', False, 2_000)
+    assert first.Id != second.Id
+    first.Pass = 3
+    first.Cursor = 42
+    first.Sent = 10
+    first.Failed = 1
+    db.UpdateBroadcast(first)
+    second.Done = True
+    db.UpdateBroadcast(second)
+    unfinished = db.GetUnfinishedBroadcasts()
+    assert len(unfinished) == 1
+    broadcast = unfinished[0]
+    assert (broadcast.Id, broadcast.Text, bool(broadcast.ByPeak),
+        broadcast.StartedAt) == (first.Id, 'Hello', True, 1_000,)
+    assert (broadcast.Pass, broadcast.Cursor, broadcast.Sent,
+        broadcast.Failed, bool(broadcast.Done)) == (3, 42, 10, 1, False,)
+
+
+def test_broadcast_brands(db: IDatabase) -> None:
+    plain = db.CreateBroadcast('Hello', False, 1_000)
+    branded = db.CreateBroadcast('سلام', False, 1_000, brand='کلاس')
+    branded.Sent = 5
+    db.UpdateBroadcast(branded)
+    assert [bc.Id for bc in db.GetUnfinishedBroadcasts()] == [plain.Id]
+    unfinished = db.GetUnfinishedBroadcasts(brand='کلاس')
+    assert [(bc.Id, bc.Brand, bc.Sent) for bc in unfinished] == [
+        (branded.Id, 'کلاس', 5)]
+    assert db.GetUnfinishedBroadcasts(brand='other') == ()
+
+
+def test_stats(db: IDatabase) -> None:
+    from datetime import date, timedelta
+    assert db.GetUsersCount() == 0
+    db.UpsertUsers(_User(id_) for id_ in range(1, 4))
+    db.UpsertUser(_User(4))
+    db.UpsertUser(_User(4, first_name='Reza'))
+    assert db.GetUsersCount() == 4
+    assert db.RebuildStats() == (4, 4,)
+    today = date.today()
+    yesterday = (today - timedelta(days=1)).isoformat()
+    db.IncrementSignups(yesterday)
+    db.IncrementSignups(today.isoformat())
+    db.IncrementSignups(today.isoformat())
+    # Days before the window are left out...
+    db.IncrementSignups((today - timedelta(days=7)).isoformat())
+    db.IncrementSignups((today - timedelta(days=6)).isoformat())
+    assert db.GetSignups(7) == (
+        (today.isoformat(), 2),
+        (yesterday, 1),
+        ((today - timedelta(days=6)).isoformat(), 1),)
+    assert db.GetSignups(1) == ((today.isoformat(), 2),)
+    db.AddActiveUsers('2024-01-01', 13, 2)
+    db.AddActiveUsers('2024-01-01', 9, 1)
+    db.AddActiveUsers('2024-01-01', 13, 3)
+    db.AddActiveUsers('2024-01-02', 0, 1)
+    assert db.GetActiveUsers('2024-01-01') == ((9, 1), (13, 5),)
+    assert db.GetActiveUsers('2024-01-03') == ()
+
+
+def test_search(db: IDatabase) -> None:
+    db.UpsertUsers([
+        UserData(1, 'علی', 'رضایی', '09121110001'),
+        UserData(2, 'علیرضا', 'کریمی', '09121110002'),
+        UserData(3, 'Maryam', 'Karimi', '09351110003'),
+        UserData(4, 'كريم', 'Ahmadi', '09121110004'),])
+    # Arabic yeh & kaf and Persian digits are normalized...
+    assert _Ids(db.SearchUsers('كريمي', 10)) == [2]
+    assert _Ids(db.SearchUsers('علی', 10)) == [1, 2]
+    assert _Ids(db.SearchUsers('۰۹۱۲۱', 10)) == [1, 2, 4]
+    assert _Ids(db.SearchUsers('karimi', 10)) == [3]
+    assert _Ids(db.SearchUsers('کریم 0004', 10)) == [4]
+    # Short terms are ignored...
+    assert _Ids(db.SearchUsers('عل', 10)) == []
+    assert _Ids(db.SearchUsers('0912 ab', 2)) == [1, 2]
+    assert _Ids(db.SearchUsers('0912 ab', 2, after=2)) == [4]
+
+
+def test_in_memory_sync(tmp_path) -> None:
+    import asyncio
+    path = tmp_path / 'db.db3'
+    database = SqliteDb(path, in_memory=True)
+    database.UpsertUser(_User(1))
+    # Syncing in the background on a running loop...
+    assert asyncio.run(database.SyncAsync())
+    assert not asyncio.run(database.SyncAsync())
+    onDisk = SqliteDb(path)
+    assert _Ids(onDisk.GetUsers(10)) == [1]
+    onDisk.Close()
+    # Syncing upon closing...
+    database.UpsertUsers([_User(2), _User(3)])
+    database.IncrementSignups('2024-01-01')
+    database.Close()
+    reopened = SqliteDb(path, in_memory=True)
+    assert _Ids(reopened.GetUsers(10)) == [1, 2, 3]
+    assert reopened.GetUsersCount() == 3
+    assert reopened.SearchUsers('Last3', 10)[0].Id == 3
+    reopened.Close()
+
+
+def _FillLog(database: LogDb) -> None:
+    database.UpsertUsers([_User(1, _PHONE), _User(2), _User(3, _PHONE_INTL)])
+    database.UpsertUser(_User(2, first_name='Reza'))
+    database.UpsertProducts(ProductData(id_, f'Course{id_}') for id_ in (1, 2))
+    database.AddUsersProducts([(1, 2), (2, 1)])
+    broadcast = database.CreateBroadcast('Hello', True, 1_000, brand='A')
+    broadcast.Cursor = 2
+    broadcast.Sent = 2
+    database.UpdateBroadcast(broadcast)
+    database.IncrementSignups('2024-01-01')
+    database.AddActiveUsers('2024-01-01', 13, 4)
+
+
+def _CheckLog(database: LogDb, n_users: int = 3) -> None:
+    assert _Ids(database.GetUsers(10)) == list(range(1, n_users + 1))
+    assert database.GetUser(2).FirstName == 'Reza'
+    assert database.GetUsersCount() == n_users
+    # The duplicate phone stays unindexed...
+    assert database.GetUserIdByPhone(_PHONE) == 1
+    assert _Ids(database.SearchUsers('Last3', 10)) == [3]
+    assert [prod.Name for prod in database.GetProducts(10)] == [
+        'Course1', 'Course2']
+    assert database.GetUsersProductsPairs(10) == ((1, 2), (2, 1),)
+    broadcast, = database.GetUnfinishedBroadcasts(brand='A')
+    assert (broadcast.Text, broadcast.Cursor, broadcast.Sent,) == (
+        'Hello', 2, 2,)
+    assert database.GetActiveUsers('2024-01-01') == ((13, 4),)
+
+
+def test_log_replay(tmp_path) -> None:
+    path = tmp_path / 'db.log'
+    database = LogDb(path)
+    _FillLog(database)
+    database.Close()
+    size = path.stat().st_size
+    # A torn record & garbage, as left by a crash in the middle of an
+    # append, are truncated...
+    with open(path, mode='ab') as fileObj:
+        fileObj.write(b'\x01\x00\x00\x00\x40garbage')
+    database = LogDb(path)
+    _CheckLog(database)
+    assert path.stat().st_size == size
+    # Appending after the truncation...
+    database.UpsertUser(_User(4))
+    database.Close()
+    database = LogDb(path)
+    _CheckLog(database, 4)
+    # Compacting into a snapshot of the state...
+    database.UpsertUser(_User(4, first_name='Sara'))
+    size = path.stat().st_size
+    database.Compact()
+    database.Close()
+    # Superseded records are gone...
+    assert path.stat().st_size < size
+    assert not path.with_name(path.name + '.tmp').exists()
+    database = LogDb(path)
+    _CheckLog(database, 4)
+    assert database.GetUser(4).FirstName == 'Sara'
+    database.Close()
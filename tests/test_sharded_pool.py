@@ -0,0 +1,124 @@
+#
+#
+#
+"""Checks `ShardedSDelPool` under threads. Run it from the root of the
+repository with `python -m pytest`.
+"""
+
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('bale')
+
+from utils.types import ShardedSDelPool
+
+
+_TIMINT = 0.01
+"""The deletion time interval of pools in seconds."""
+
+
+class _SavingPool(ShardedSDelPool[int, str]):
+    """Saves expired values into `saved` slowly, as a database would."""
+    def __init__(self, save_secs: float = 0.0) -> None:
+        super().__init__(del_timint=_TIMINT, shards=2)
+        self.saved: dict[int, str] = {}
+        self.saving = threading.Event()
+        self.nExpired = 0
+        self._saveSecs = save_secs
+
+    def OnExpired(self, __key: int, __value: str, /) -> None:
+        self.nExpired += 1
+        self.saving.set()
+        time.sleep(self._saveSecs)
+        self.saved[__key] = __value
+
+    def Load(self, key: int) -> str:
+        """Gets the key or loads it from `saved` upon a miss."""
+        try:
+            return self[key]
+        except KeyError:
+            value = self.saved[key]
+            self[key] = value
+            return value
+
+
+def _Start(target) -> threading.Thread:
+    thread = threading.Thread(target=target)
+    thread.start()
+    return thread
+
+
+def test_miss_waits_for_saving() -> None:
+    pool = _SavingPool(save_secs=0.1)
+    pool.saved[1] = 'old'
+    pool[1] = 'new'
+    time.sleep(_TIMINT * 2)
+    sweeper = _Start(pool.Sweep)
+    assert pool.saving.wait(1)
+    # Missing the key while it is being saved on the other thread...
+    assert pool.Load(1) == 'new'
+    sweeper.join()
+    assert pool.nExpired == 1
+
+
+def test_lazy_expiry_saves_once() -> None:
+    pool = _SavingPool()
+    pool[1] = 'a'
+    time.sleep(_TIMINT * 2)
+    with pytest.raises(KeyError):
+        pool[1]
+    assert pool.saved == {1: 'a'}
+    assert pool.nExpired == 1
+    assert pool.Sweep() == 0
+
+
+def test_failed_saving_lifts_tombstones() -> None:
+    class _FailingPool(ShardedSDelPool[int, str]):
+        def OnExpired(self, __key: int, __value: str, /) -> None:
+            raise OSError(__key)
+    pool = _FailingPool(del_timint=_TIMINT, shards=1)
+    pool[1] = 'a'
+    pool[2] = 'b'
+    time.sleep(_TIMINT * 2)
+    with pytest.raises(OSError):
+        pool.Sweep()
+    # Setting the keys must not wait for tombstones forever...
+    setter = _Start(lambda: (pool.SetItem(1, 'c'), pool.SetItem(2, 'd')))
+    setter.join(1)
+    assert not setter.is_alive()
+    assert pool.GetItemBypass(2) == 'd'
+
+
+def test_no_lost_updates() -> None:
+    pool = _SavingPool(save_secs=0.002)
+    n = 40
+    for key in range(16):
+        pool.saved[key] = '0'
+    done = threading.Event()
+    def _Sweep() -> None:
+        while not done.is_set():
+            pool.Sweep()
+    def _Increment(keys: range) -> None:
+        # Reloading the keys of this thread as the sweeper expires them...
+        for idx in range(n):
+            for key in keys:
+                pool[key] = str(int(pool.Load(key)) + 1)
+            if idx % 4 == 0:
+                time.sleep(_TIMINT * 1.5)
+    sweeper = _Start(_Sweep)
+    threads = [
+        _Start(lambda keys=range(start, start + 4): _Increment(keys))
+        for start in range(0, 16, 4)]
+    for thread in threads:
+        thread.join()
+    done.set()
+    sweeper.join()
+    assert pool.nExpired > 0
+    for key in range(16):
+        try:
+            value = pool.GetItemBypass(key)
+        except KeyError:
+            value = pool.saved[key]
+        assert value == str(n)
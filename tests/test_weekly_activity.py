@@ -0,0 +1,82 @@
+#
+#
+#
+"""Checks `WeeklyActivity`. Run it from the root of the repository with
+`python -m pytest`.
+"""
+
+import pytest
+
+from db import WeeklyActivity
+
+
+_DAY = 86_400
+
+_T0 = 1_704_106_800.0
+"""An arbitrary POSIX time (2024-01-01 11:00 UTC). Its slot depends on
+the local zone, so tests get slots by `WeeklyActivity.GetSlot`.
+"""
+
+
+def test_empty() -> None:
+    activity = WeeklyActivity()
+    assert activity.GetScores() == (0.0,) * WeeklyActivity.SLOTS
+    assert activity.GetPeakSlot() is None
+    assert activity.GetPeakHour() is None
+    restored = WeeklyActivity()
+    restored.Bytes = activity.Bytes
+    assert restored.GetScores() == (0.0,) * WeeklyActivity.SLOTS
+    restored.Bytes = None
+    assert restored.GetPeakSlot() is None
+
+
+def test_round_trip() -> None:
+    activity = WeeklyActivity(half_life=7 * _DAY)
+    activity.Record(_T0, 5)
+    activity.Record(_T0 + 3 * 3_600, 2)
+    restored = WeeklyActivity()
+    restored.Bytes = activity.Bytes
+    assert restored.HalfLife == 7 * _DAY
+    assert restored.GetPeakSlot() == WeeklyActivity.GetSlot(_T0)
+    # Scores are quantized to 16 bits relative to the maximum...
+    assert restored.GetScores(_T0) == pytest.approx(
+        activity.GetScores(_T0),
+        rel=1e-4,
+        abs=1e-4)
+
+
+def test_version_rejected() -> None:
+    buf = bytearray(WeeklyActivity().Bytes)
+    buf[0] = WeeklyActivity.VERSION + 1
+    with pytest.raises(ValueError):
+        WeeklyActivity().Bytes = bytes(buf)
+
+
+def test_decay() -> None:
+    activity = WeeklyActivity(half_life=_DAY)
+    slot = WeeklyActivity.GetSlot(_T0)
+    activity.Record(_T0, 8)
+    assert activity.GetScores(_T0)[slot] == pytest.approx(8)
+    assert activity.GetScores(_T0 + _DAY)[slot] == pytest.approx(4)
+    assert activity.GetScores(_T0 + 3 * _DAY)[slot] == \
+        pytest.approx(1)
+    # Later accesses weigh more than older ones...
+    later = _T0 + 2 * _DAY + 3_600
+    activity.Record(later, 2)
+    scores = activity.GetScores(later)
+    assert scores[WeeklyActivity.GetSlot(later)] == pytest.approx(2)
+    assert scores[slot] == pytest.approx(8 * 2 ** (-(later - _T0) / _DAY))
+
+
+def test_rebase() -> None:
+    activity = WeeklyActivity(half_life=3_600)
+    slot = WeeklyActivity.GetSlot(_T0)
+    activity.Record(_T0, 1_000)
+    # Beyond 32 half-lives the weight exceeds the rebasing threshold...
+    later = _T0 + 40 * 3_600
+    activity.Record(later, 3)
+    assert activity._landmark == int(later)
+    scores = activity.GetScores(later)
+    assert scores[WeeklyActivity.GetSlot(later)] == pytest.approx(3)
+    assert scores[slot] == pytest.approx(1_000 * 2 ** -40)
+    assert activity.GetPeakSlot() == WeeklyActivity.GetSlot(later)
@@ -0,0 +1,7 @@
+#
+#
+#
+"""This sub-package offers development tools for the Bot, such as
+stand-in servers and benchmarks. Nothing in here is imported by the Bot
+itself at runtime.
+"""
@@ -0,0 +1,255 @@
+#
+#
+#
+"""This module exports and imports the users, products and the products
+of users (`user_proc`) of the Bot as CSV or JSON Lines with constant
+memory. Exports stream keyset pages of the database; imports validate
+and decode rows as they are read and upsert them through the bulk
+methods of `IDatabase` in one transaction per file, so derived data
+(normalized phones, the full-text index & statistics) stays in sync.
+
+#### Row formats:
+1. `users`: `user_id`, `first_name`, `last_name`, `phone`,
+`hourly_freqs` (24 integers; space-separated in CSV) & `weekly_activity`
+(the hex of the serialized `WeeklyActivity`, or empty).
+2. `products`: `prod_id` & `prod_name`.
+3. `user_proc`: `user_id` & `proc_id`.
+
+#### Command line:
+`python -m tools.bulk_io export users users.csv --db db.db3`
+`python -m tools.bulk_io import users users.jsonl --db db.db3`
+
+The format is chosen by the extension of the file (`.csv` or `.jsonl`).
+"""
+
+from __future__ import annotations
+import csv
+import json
+import logging
+from pathlib import Path
+from struct import Struct, error as StructError
+from typing import Any, Callable, Iterable, Iterator
+
+from db import (
+    ID, HourlyFrequencies, IDatabase, ProductData, UserData, WeeklyActivity)
+
+
+TABLES = ('users', 'products', 'user_proc')
+"""The tables which can be exported & imported."""
+
+_COLUMNS: dict[str, tuple[str, ...]] = {
+    'users': ('user_id', 'first_name', 'last_name', 'phone',
+        'hourly_freqs', 'weekly_activity'),
+    'products': ('prod_id', 'prod_name'),
+    'user_proc': ('user_id', 'proc_id'),}
+
+_PAGE = 10_000
+"""The number of rows read from the database at a time."""
+
+_FREQS = Struct('>24H')
+"""The layout of serialized `HourlyFrequencies` of two-byte frequencies."""
+
+
+def Export(db: IDatabase, table: str, path: Path) -> int:
+    """Exports the table to the CSV or JSON Lines file and returns the
+    number of rows written.
+    """
+    rows = _ReadTable(db, table)
+    return _WriteRows(path, _COLUMNS[table], rows)
+
+
+def Import(db: IDatabase, table: str, path: Path) -> tuple[int, int]:
+    """Imports the CSV or JSON Lines file into the table and returns the
+    numbers of imported and skipped (invalid) rows.
+    """
+    skipped = 0
+    def _Decoded() -> Iterator[Any]:
+        nonlocal skipped
+        decode = _DECODERS[table]
+        for lineNum, row in _ReadRows(path, _COLUMNS[table]):
+            if row is None:
+                skipped += 1
+                logging.warning(f'{path}:{lineNum}: skipped: malformed JSON')
+                continue
+            try:
+                yield decode(row)
+            except (KeyError, TypeError, ValueError, StructError) as err:
+                skipped += 1
+                logging.warning(f'{path}:{lineNum}: skipped: {err!r}')
+    match table:
+        case 'users':
+            imported = db.UpsertUsers(_Decoded())
+        case 'products':
+            imported = db.UpsertProducts(_Decoded())
+        case 'user_proc':
+            imported = db.AddUsersProducts(_Decoded())
+    return (imported, skipped,)
+
+
+def _ReadTable(db: IDatabase, table: str) -> Iterator[tuple]:
+    """Streams the rows of the table from the database page by page."""
+    match table:
+        case 'users':
+            after = None
+            while users := db.GetUsers(_PAGE, after=after):
+                for user in users:
+                    # Leaving out activities without any score...
+                    activity = user.Activity.Bytes
+                    yield (
+                        user.Id,
+                        user.FirstName,
+                        user.LastName,
+                        user.Phone,
+                        user.Frequencies.Frequencies,
+                        activity.hex() if any(activity[13:]) else '',)
+                after = users[-1].Id
+        case 'products':
+            after = None
+            while products := db.GetProducts(_PAGE, after=after):
+                for product in products:
+                    yield (product.Id, product.Name,)
+                after = products[-1].Id
+        case 'user_proc':
+            after = None
+            while pairs := db.GetUsersProductsPairs(_PAGE, after=after):
+                yield from pairs
+                after = pairs[-1]
+
+
+def _WriteRows(
+        path: Path,
+        columns: tuple[str, ...],
+        rows: Iterable[tuple],
+        ) -> int:
+    count = 0
+    with open(path, mode='wt', encoding='utf-8', newline='') as fileObj:
+        if path.suffix == '.csv':
+            writer = csv.writer(fileObj)
+            writer.writerow(columns)
+            for row in rows:
+                writer.writerow(
+                    ' '.join(map(str, value)) if isinstance(value, tuple)
+                        else value
+                    for value in row)
+                count += 1
+        else:
+            for row in rows:
+                fileObj.write(json.dumps(
+                    dict(zip(columns, row)),
+                    ensure_ascii=False))
+                fileObj.write('\n')
+                count += 1
+    return count
+
+
+def _ReadRows(
+        path: Path,
+        columns: tuple[str, ...],
+        ) -> Iterator[tuple[int, dict[str, Any]]]:
+    """Streams `(line number, row)` pairs of the file. Malformed JSON
+    lines are yielded as `None` rows for the decoders to reject.
+    """
+    with open(path, mode='rt', encoding='utf-8', newline='') as fileObj:
+        if path.suffix == '.csv':
+            reader = csv.DictReader(fileObj)
+            missing = set(columns) - set(reader.fieldnames or ())
+            if missing:
+                raise ValueError(f'{path}: missing columns: {missing}')
+            for row in reader:
+                yield (reader.line_num, row,)
+        else:
+            for lineNum, line in enumerate(fileObj, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    row = None
+                yield (lineNum, row,)
+
+
+def _DecodeId(value: Any) -> ID:
+    if isinstance(value, str):
+        value = int(value)
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise TypeError(f'an integer ID is required not {value!r}')
+    if not -(1 << 63) <= value < (1 << 63):
+        raise ValueError(f'{value} is out of the range of IDs')
+    return value
+
+
+def _DecodeText(value: Any, *, required: bool = True) -> str:
+    if not isinstance(value, str):
+        raise TypeError(f'a string is required not {value!r}')
+    value = value.strip()
+    if required and not value:
+        raise ValueError('an empty string')
+    return value
+
+
+def _DecodeUser(row: dict[str, Any]) -> UserData:
+    # Decoding hourly frequencies all at once...
+    freqs = row['hourly_freqs']
+    if isinstance(freqs, str):
+        freqs = freqs.split()
+    hFreqs = HourlyFrequencies()
+    if freqs:
+        hFreqs.Bytes = _FREQS.pack(*map(int, freqs))
+    activity = WeeklyActivity()
+    if row.get('weekly_activity'):
+        activity.Bytes = bytes.fromhex(row['weekly_activity'])
+    return UserData(
+        _DecodeId(row['user_id']),
+        _DecodeText(row['first_name']),
+        _DecodeText(row['last_name'], required=False),
+        _DecodeText(row['phone'], required=False),
+        hFreqs,
+        activity)
+
+
+def _DecodeProduct(row: dict[str, Any]) -> ProductData:
+    return ProductData(
+        _DecodeId(row['prod_id']),
+        _DecodeText(row['prod_name']))
+
+
+def _DecodePair(row: dict[str, Any]) -> tuple[ID, ID]:
+    return (_DecodeId(row['user_id']), _DecodeId(row['proc_id']),)
+
+
+_DECODERS: dict[str, Callable[[dict[str, Any]], Any]] = {
+    'users': _DecodeUser,
+    'products': _DecodeProduct,
+    'user_proc': _DecodePair,}
+
+
+def main() -> None:
+    import argparse
+    import time
+    from db.sqlite3 import SqliteDb
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('action', choices=('export', 'import'))
+    parser.add_argument('table', choices=TABLES)
+    parser.add_argument('file', type=Path)
+    parser.add_argument('--db', type=Path, default=Path('db.db3'))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.file.suffix not in ('.csv', '.jsonl'):
+        parser.error('the file must be .csv or .jsonl')
+    db = SqliteDb(args.db)
+    start = time.perf_counter()
+    try:
+        if args.action == 'export':
+            count = Export(db, args.table, args.file)
+            logging.info(f'exported {count} rows of {args.table}')
+        else:
+            imported, skipped = Import(db, args.table, args.file)
+            logging.info(f'imported {imported} rows into {args.table}; '
+                f'{skipped} skipped')
+    finally:
+        db.Close()
+    logging.info(f'done in {time.perf_counter() - start:.3f}s')
+
+
+if __name__ == '__main__':
+    main()
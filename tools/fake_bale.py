@@ -0,0 +1,371 @@
+#
+#
+#
+"""This module realizes a local stand-in for the Bale Bot API on top of
+`aiohttp`. It implements the endpoints the Bot uses (`getMe`,
+`getUpdates`, `sendMessage`, `editMessageText`, `answerCallbackQuery`,
+`deleteMessage`, `setWebhook` & `deleteWebhook`) so the real polling and
+sending path can be exercised without the network.
+
+To run the Bot against it, set `BALE_BASE_URL` in `config.toml` to the
+address of this server, e.g. `"http://127.0.0.1:8080"`.
+
+#### Control endpoints (not part of the Bale API):
+1. `POST /_fake/updates`: enqueues a raw update (or a list of them).
+2. `GET /_fake/sent`: returns the messages the Bot has sent so far.
+3. `GET /_fake/stats`: returns request counters and reply latencies.
+
+#### Command line:
+`python -m tools.fake_bale --port 8080 --latency 0.05 --error-rate 0.01
+--rate-limit 30 --simulate 1000 --rps 200`
+"""
+
+from __future__ import annotations
+import asyncio
+import itertools
+import json
+import logging
+import random
+import time
+from typing import Any
+
+from aiohttp import web
+
+
+class FakeBaleServer:
+    """Holds the state of a fake Bale server. Arguments are as follow:
+
+    * `latency`: the fixed delay in seconds added to every API call.
+    * `jitter`: the maximum random delay in seconds added on top of
+    `latency`.
+    * `error_rate`: the probability (0 to 1) that an API call fails with
+    an internal server error.
+    * `rate_limit`: the maximum number of API calls per second before
+    responding with `429 Too Many Requests`. Zero disables the limit.
+    """
+
+    BOT_USER = {
+        'id': 1,
+        'is_bot': True,
+        'first_name': 'happy_eng_bot',
+        'username': 'happy_eng_bot',}
+
+    def __init__(
+            self,
+            *,
+            latency: float = 0.0,
+            jitter: float = 0.0,
+            error_rate: float = 0.0,
+            rate_limit: int = 0,
+            ) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self._updates: list[dict[str, Any]] = []
+        """The queue of unconfirmed updates."""
+        self._updateId = itertools.count(1)
+        self._msgId = itertools.count(1)
+        self._cbId = itertools.count(1)
+        self._newUpdate = asyncio.Event()
+        self._sent: list[dict[str, Any]] = []
+        """All the messages the Bot has sent."""
+        self._injected: dict[int, list[float]] = {}
+        """Mapping of `chat ID -> injection times` of updates awaiting
+        a reply, used to measure reply latency.
+        """
+        self._latencies: list[float] = []
+        self._counters: dict[str, int] = {}
+        self._window = (0, 0)
+        """A 2-tuple of `(second, number of calls in that second)`."""
+        self._webhook: str | None = None
+        self._webhookSecret: str | None = None
+
+    def MakeApp(self) -> web.Application:
+        """Makes the `aiohttp` application of this server."""
+        app = web.Application()
+        app.add_routes([
+            web.post('/_fake/updates', self._HandleInject),
+            web.get('/_fake/sent', self._HandleSent),
+            web.get('/_fake/stats', self._HandleStats),
+            web.route('*', '/{token}/{method}', self._HandleApi),])
+        return app
+
+    def PushMessage(self, user_id: int, text: str) -> dict[str, Any]:
+        """Enqueues a private text message from the specified user and
+        returns the update.
+        """
+        return self.PushUpdate({'message': self._MakeMessage(
+            user_id,
+            text,
+            self._MakeUser(user_id))})
+
+    def PushCallback(self, user_id: int, data: str) -> dict[str, Any]:
+        """Enqueues a callback query from the specified user and returns
+        the update.
+        """
+        return self.PushUpdate({'callback_query': {
+            'id': str(next(self._cbId)),
+            'from': self._MakeUser(user_id),
+            'message': self._MakeMessage(user_id, '', self.BOT_USER),
+            'data': data,}})
+
+    def PushUpdate(self, update: dict[str, Any]) -> dict[str, Any]:
+        """Enqueues a raw update. If the update has no `update_id`, a new
+        one is assigned.
+        """
+        if 'update_id' not in update:
+            update['update_id'] = next(self._updateId)
+        self._updates.append(update)
+        chatId = self._GetChatId(update)
+        if chatId is not None:
+            self._injected.setdefault(chatId, []).append(time.perf_counter())
+        self._newUpdate.set()
+        if self._webhook:
+            asyncio.get_running_loop().create_task(
+                self._PostToWebhook(update))
+        return update
+
+    def GetStats(self) -> dict[str, Any]:
+        """Returns request counters and reply latency percentiles in
+        milliseconds.
+        """
+        lats = sorted(self._latencies)
+        def _Pct(p: float) -> float | None:
+            if not lats:
+                return None
+            return round(lats[min(len(lats) - 1, int(p * len(lats)))] * 1e3, 3)
+        return {
+            'requests': dict(self._counters),
+            'pending_updates': len(self._updates),
+            'replies': len(lats),
+            'p50_ms': _Pct(0.50),
+            'p95_ms': _Pct(0.95),
+            'p99_ms': _Pct(0.99),}
+
+    async def _HandleApi(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        self._counters[method] = self._counters.get(method, 0) + 1
+        # Simulating the network...
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        # Injecting faults...
+        if self.rate_limit:
+            now = int(time.monotonic())
+            second, count = self._window
+            count = count + 1 if second == now else 1
+            self._window = (now, count)
+            if count > self.rate_limit:
+                return self._Error(429, 'Too Many Requests', retry_after=1)
+        if self.error_rate and random.random() < self.error_rate:
+            return self._Error(500, 'Internal Server Error')
+        # Dispatching the method...
+        params = await self._ReadParams(request)
+        match method:
+            case 'getMe':
+                return self._Ok(self.BOT_USER)
+            case 'getUpdates':
+                return self._Ok(await self._GetUpdates(params))
+            case 'sendMessage':
+                return self._Ok(self._SendMessage(params))
+            case 'editMessageText':
+                return self._Ok(self._SendMessage(params))
+            case 'answerCallbackQuery' | 'deleteMessage':
+                return self._Ok(True)
+            case 'setWebhook':
+                self._webhook = params.get('url') or None
+                self._webhookSecret = params.get('secret_token')
+                return self._Ok(True)
+            case 'deleteWebhook':
+                self._webhook = None
+                self._webhookSecret = None
+                return self._Ok(True)
+            case _:
+                return self._Error(404, 'Not Found')
+
+    async def _HandleInject(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        updates = data if isinstance(data, list) else [data]
+        for update in updates:
+            self.PushUpdate(update)
+        return self._Ok([update['update_id'] for update in updates])
+
+    async def _HandleSent(self, request: web.Request) -> web.Response:
+        return self._Ok(self._sent)
+
+    async def _HandleStats(self, request: web.Request) -> web.Response:
+        return self._Ok(self.GetStats())
+
+    async def _GetUpdates(self, params: dict[str, Any]) -> list[dict]:
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        timeout = float(params.get('timeout') or 0)
+        # Confirming updates before the offset...
+        if offset:
+            self._updates = [
+                update
+                for update in self._updates
+                if update['update_id'] >= offset]
+        # Long polling...
+        if not self._updates and timeout > 0:
+            self._newUpdate.clear()
+            try:
+                await asyncio.wait_for(self._newUpdate.wait(), timeout)
+            except TimeoutError:
+                pass
+        return self._updates[:limit]
+
+    def _SendMessage(self, params: dict[str, Any]) -> dict[str, Any]:
+        chatId = int(params['chat_id'])
+        message = self._MakeMessage(
+            chatId,
+            params.get('text', ''),
+            self.BOT_USER)
+        if params.get('reply_markup'):
+            markup = params['reply_markup']
+            message['reply_markup'] = (
+                json.loads(markup) if isinstance(markup, str) else markup)
+        self._sent.append(message)
+        # Measuring reply latency...
+        pending = self._injected.get(chatId)
+        if pending:
+            self._latencies.append(time.perf_counter() - pending.pop(0))
+            if not pending:
+                del self._injected[chatId]
+        return message
+
+    async def _PostToWebhook(self, update: dict[str, Any]) -> None:
+        from aiohttp import ClientSession
+        from webhook import SECRET_HEADER
+        headers = {}
+        if self._webhookSecret:
+            headers[SECRET_HEADER] = self._webhookSecret
+        try:
+            async with ClientSession(headers=headers) as session:
+                async with session.post(self._webhook, json=update) as resp:
+                    if resp.status != 200:
+                        logging.warning(f'webhook responded {resp.status} '
+                            f'to update {update["update_id"]}')
+        except Exception:
+            logging.error('failed to post an update to the webhook',
+                exc_info=True)
+
+    async def _ReadParams(self, request: web.Request) -> dict[str, Any]:
+        params: dict[str, Any] = dict(request.query)
+        if request.can_read_body:
+            if request.content_type == 'application/json':
+                params.update(await request.json())
+            else:
+                params.update(await request.post())
+        return params
+
+    def _MakeUser(self, user_id: int) -> dict[str, Any]:
+        return {
+            'id': user_id,
+            'is_bot': False,
+            'first_name': f'user{user_id}',
+            'username': f'user{user_id}',}
+
+    def _MakeMessage(
+            self,
+            chat_id: int,
+            text: str,
+            from_: dict[str, Any],
+            ) -> dict[str, Any]:
+        return {
+            'message_id': next(self._msgId),
+            'from': from_,
+            'chat': {'id': chat_id, 'type': 'private'},
+            'date': int(time.time()),
+            'text': text,}
+
+    def _GetChatId(self, update: dict[str, Any]) -> int | None:
+        if 'message' in update:
+            return update['message']['chat']['id']
+        if 'callback_query' in update:
+            return update['callback_query']['from']['id']
+        return None
+
+    def _Ok(self, result: Any) -> web.Response:
+        return web.json_response({'ok': True, 'result': result})
+
+    def _Error(
+            self,
+            code: int,
+            description: str,
+            **params,
+            ) -> web.Response:
+        body: dict[str, Any] = {
+            'ok': False,
+            'error_code': code,
+            'description': description,}
+        if params:
+            body['parameters'] = params
+        return web.json_response(body, status=code)
+
+
+async def Simulate(
+        server: FakeBaleServer,
+        n_users: int,
+        rps: float,
+        duration: float,
+        ) -> None:
+    """Injects `/start` & `/help` commands from `n_users` random users at
+    `rps` updates per second for `duration` seconds, then logs the stats.
+    """
+    cmds = ('/start', '/help', '/showcase')
+    interval = 1 / rps
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        server.PushMessage(
+            random.randint(1_000, 1_000 + n_users - 1),
+            random.choice(cmds))
+        await asyncio.sleep(interval)
+    # Letting the Bot reply the remaining updates...
+    await asyncio.sleep(2)
+    logging.info(json.dumps(server.GetStats(), indent=2))
+
+
+def main() -> None:
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=int, default=0)
+    parser.add_argument('--simulate', type=int, default=0, metavar='USERS',
+        help='number of simulated users (0 disables simulation)')
+    parser.add_argument('--rps', type=float, default=50.0)
+    parser.add_argument('--duration', type=float, default=30.0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    async def _main() -> None:
+        server = FakeBaleServer(
+            latency=args.latency,
+            jitter=args.jitter,
+            error_rate=args.error_rate,
+            rate_limit=args.rate_limit)
+        runner = web.AppRunner(server.MakeApp())
+        await runner.setup()
+        await web.TCPSite(runner, args.host, args.port).start()
+        logging.info(f'fake Bale server on http://{args.host}:{args.port}')
+        try:
+            if args.simulate:
+                await Simulate(server, args.simulate, args.rps, args.duration)
+            else:
+                await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+
+    try:
+        asyncio.run(_main())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+#
+#
+#
+"""This module replays recorded raw updates against a running webhook
+of the Bot. The input is a JSON Lines file with one raw Bale update per
+line, e.g. as captured from `getUpdates`.
+
+#### Command line:
+`python -m tools.replay_updates updates.jsonl http://127.0.0.1:8443/webhook
+--secret SECRET --rps 100`
+"""
+
+import asyncio
+import json
+import logging
+import time
+
+
+async def Replay(
+        filename: str,
+        url: str,
+        *,
+        secret: str | None = None,
+        rps: float = 0.0,
+        ) -> None:
+    """POSTs every update of the file to `url`, at most `rps` updates per
+    second (zero means as fast as possible), and logs the outcome.
+    """
+    from aiohttp import ClientSession
+    from webhook import SECRET_HEADER
+    headers = {SECRET_HEADER: secret} if secret else {}
+    statuses: dict[int, int] = {}
+    start = time.perf_counter()
+    async with ClientSession(headers=headers) as session:
+        with open(filename, mode='rt', encoding='utf-8') as fileObj:
+            for line in fileObj:
+                if not line.strip():
+                    continue
+                async with session.post(url, json=json.loads(line)) as resp:
+                    statuses[resp.status] = statuses.get(resp.status, 0) + 1
+                if rps:
+                    await asyncio.sleep(1 / rps)
+    elapsed = time.perf_counter() - start
+    logging.info(f'replayed {sum(statuses.values())} updates in '
+        f'{elapsed:.3f}s; statuses: {statuses}')
+
+
+def main() -> None:
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('file')
+    parser.add_argument('url')
+    parser.add_argument('--secret')
+    parser.add_argument('--rps', type=float, default=0.0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(Replay(args.file, args.url, secret=args.secret, rps=args.rps))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+#
+#
+#
+"""This module benchmarks the startup of the Bot against a time budget,
+so that regressions (e.g. a new heavy import at module level) fail loudly.
+It measures importing `main` with `-X importtime` in fresh interpreters,
+and optionally the startup stages of `main.Startup` as well, which need
+`config.toml` and the dependencies of the Bot.
+
+#### Command line:
+`python -m tools.startup_bench --runs 5 --budget-ms 150 --stages`
+
+It exits with status 1 if the median startup exceeds the budget.
+"""
+
+import json
+import logging
+from pathlib import Path
+import statistics
+import subprocess
+import sys
+
+
+APP_DIR = Path(__file__).resolve().parent.parent
+"""The directory of the Bot."""
+
+_STAGES_CODE = (
+    'import json, main\n'
+    'durations = main.Startup()\n'
+    'main._CloseDatabases()\n'
+    'print(json.dumps(durations))\n')
+
+
+def MeasureImport(module: str = 'main') -> dict[str, tuple[int, int]]:
+    """Imports the module in a fresh interpreter with `-X importtime` and
+    returns `module -> (self, cumulative)` import times in microseconds.
+    """
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=APP_DIR,
+        capture_output=True,
+        text=True,
+        check=True)
+    times: dict[str, tuple[int, int]] = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_, cumul, name = line[len('import time:'):].split('|')
+        if not self_.strip().isdigit():
+            # Skipping the header...
+            continue
+        times[name.strip()] = (int(self_), int(cumul),)
+    return times
+
+
+def MeasureStages() -> dict[str, float]:
+    """Runs `main.Startup` in a fresh interpreter and returns the
+    durations of its stages in seconds.
+    """
+    proc = subprocess.run(
+        [sys.executable, '-c', _STAGES_CODE],
+        cwd=APP_DIR,
+        capture_output=True,
+        text=True,
+        check=True)
+    return json.loads(proc.stdout.splitlines()[-1])
+
+
+def main() -> None:
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=150.0)
+    parser.add_argument('--stages', action='store_true',
+        help='also measure the startup stages (needs config.toml)')
+    parser.add_argument('--top', type=int, default=10,
+        help='the number of the slowest imports to report')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    # Measuring the import of 'main'...
+    importMs: list[float] = []
+    for _ in range(args.runs):
+        times = MeasureImport()
+        importMs.append(times['main'][1] / 1e3)
+    total = statistics.median(importMs)
+    logging.info(f"importing 'main': {total:.1f} ms (median of {args.runs})")
+    slowest = sorted(times.items(), key=lambda item: item[1][0], reverse=True)
+    for name, (self_, _) in slowest[:args.top]:
+        logging.info(f'    {self_ / 1e3:8.1f} ms  {name}')
+    # Measuring the startup stages...
+    if args.stages:
+        runs = [MeasureStages() for _ in range(args.runs)]
+        for name in runs[0]:
+            median = statistics.median(run[name] for run in runs) * 1e3
+            logging.info(f'stage {name!r}: {median:.1f} ms')
+            total += median
+    logging.info(f'startup: {total:.1f} ms; budget: {args.budget_ms:.1f} ms')
+    if total > args.budget_ms:
+        logging.error('the startup exceeds the budget')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
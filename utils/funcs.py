@@ -5,6 +5,11 @@
 
 #### Functions:
 1. `PathLikeToPath`
+2. `SplitOnDash`
+3. `EncodeCallback`
+4. `DecodeCallback`
+5. `NormalizeFaText`
+6. `NormalizePhone`
 """
 
 
@@ -17,6 +22,29 @@ def PathLikeToPath(__pl: PathLike, /) -> Path:
     return __pl if isinstance(__pl, Path) else Path(fspath(__pl))
 
 
+_FA_TEXT_TABLE = str.maketrans({
+    # Arabic yeh, alef maksura & kaf to Persian ones...
+    '\u064a': '\u06cc',
+    '\u0649': '\u06cc',
+    '\u0643': '\u06a9',
+    # Variants of alef & heh...
+    '\u0623': '\u0627',
+    '\u0625': '\u0627',
+    '\u0622': '\u0627',
+    '\u0629': '\u0647',
+    '\u06c0': '\u0647',
+    # ZWNJ, ZWJ & tatweel...
+    '\u200c': ' ',
+    '\u200d': None,
+    '\u0640': None,
+    # Harakat...
+    **{chr(code): None for code in range(0x064b, 0x0653)},
+    # Persian & Arabic-Indic digits...
+    **{chr(0x06f0 + n): str(n) for n in range(10)},
+    **{chr(0x0660 + n): str(n) for n in range(10)},})
+"""The translation table of `NormalizeFaText`."""
+
+
 def SplitOnDash(__str: str, /) -> tuple[str, str]:
     """Splits the dash-delimited argument and returns it as a 2-tuple of
     before-dash part as first element and after-dash part as second element.
@@ -27,3 +55,78 @@ def SplitOnDash(__str: str, /) -> tuple[str, str]:
     if len(parts) == 1:
         parts.append('')
     return tuple(parts)
+
+
+def EncodeCallback(uid: int, code: int, arg: str = '', /) -> str:
+    """Encodes the callback data of an inline button of an operation into
+    a compact, checksummed string. Arguments are as follow:
+
+    * `uid`: the 64-bit unique ID of the operation.
+    * `code`: the callback code (0 to 255) meaningful to the operation.
+    * `arg`: an optional free-form argument, e.g. a command.
+
+    The result starts with 15 URL-safe base64 characters (never a slash,
+    so it cannot be mistaken for a command), followed by `~<arg>` if
+    `arg` is not empty.
+    """
+    from base64 import urlsafe_b64encode
+    from zlib import crc32
+    header = uid.to_bytes(8) + code.to_bytes(1)
+    checksum = crc32(header + arg.encode()) & 0xff_ff
+    data = urlsafe_b64encode(header + checksum.to_bytes(2)).decode()
+    data = data.rstrip('=')
+    return f'{data}~{arg}' if arg else data
+
+
+def DecodeCallback(__data: str, /) -> tuple[int, int, str]:
+    """Decodes the callback data produced by `EncodeCallback` and returns
+    it as a 3-tuple of `(uid, code, arg)`.
+
+    #### Exceptions:
+    * `ValueError`: the data is malformed or its checksum does not match.
+    """
+    from base64 import urlsafe_b64decode
+    from binascii import Error as BinasciiError
+    from zlib import crc32
+    data, _, arg = __data.partition('~')
+    if len(data) != 15:
+        raise ValueError(f"'{__data}' is not an encoded callback data")
+    try:
+        raw = urlsafe_b64decode(data + '=')
+    except BinasciiError as err:
+        raise ValueError(f"'{__data}' is not an encoded callback data") \
+            from err
+    header, checksum = raw[:9], int.from_bytes(raw[9:])
+    if checksum != crc32(header + arg.encode()) & 0xff_ff:
+        raise ValueError(f"checksum of '{__data}' does not match")
+    return int.from_bytes(header[:8]), header[8], arg
+
+
+def NormalizeFaText(__text: str, /) -> str:
+    """Normalizes Persian text for searching: Arabic yeh and kaf become
+    Persian ones, ZWNJ becomes a space, diacritics and tatweel are
+    removed, Persian and Arabic digits become ASCII digits, the text is
+    lower-cased, and runs of whitespace are collapsed.
+    """
+    return ' '.join(__text.translate(_FA_TEXT_TABLE).lower().split())
+
+
+def NormalizePhone(__phone: str, /) -> str | None:
+    """Canonicalizes an Iranian mobile number to `+989XXXXXXXXX`. Persian
+    and Arabic digits, separators, and the `+98`, `0098`, `98` & `0`
+    prefixes are accepted. It returns `None` if the argument is not a
+    mobile number.
+    """
+    digits = ''.join(
+        char
+        for char in __phone.translate(_FA_TEXT_TABLE)
+        if char not in ' -()+')
+    if not digits.isdecimal() or not digits.isascii():
+        return None
+    for prefix in ('0098', '98', '0'):
+        if digits.startswith(prefix) and len(digits) - len(prefix) == 10:
+            digits = digits[len(prefix):]
+            break
+    if len(digits) != 10 or digits[0] != '9':
+        return None
+    return f'+98{digits}'
@@ -16,28 +16,64 @@ from abc import ABC, abstractmethod
 import enum
 from typing import Any, Callable, TypeVar
 import logging
-from typing import Any, Coroutine, TypeVar
+from typing import Any, Coroutine, NamedTuple, TypeVar
 
 from bale import (
     Bot, Message, User, InlineKeyboardButton, InlineKeyboardMarkup)
 
-from db import ID, IDatabase, UserData
+from db import ID, IDatabase, UserData, WeeklyActivity
 import lang
 
 
 class HappyEngBot(Bot):
+    """A Bot bundled with all of its state, so that several bots can be
+    hosted on one event loop. Handlers take the bot they serve and reach
+    everything through it. Arguments are as follow:
+
+    * `token`: the token of the Bale bot.
+    * `db`: the database, which bots may share.
+    * `cmd_dispatcher`: the dispatcher of commands; it takes this bot
+    before the arguments of `OperationPool` dispatchers.
+    * `limiter`: the rate limiter of broadcasts, which bots may share.
+    * `brand`: the name of this bot among hosted bots, e.g. in logs.
+    * `admin_ids`: the IDs of admin users of this bot.
+    * `hwm`: the persisted high-water mark of processed updates.
+    * `flood_rate` & `flood_burst`: the arguments of `FloodGuard`.
+    * `user_pool`: the pool of users of `db`, which bots sharing `db` must
+    share too; a new one is made if `None`.
+    """
+
     def __init__(
             self,
             token: str,
             db: IDatabase,
-            user_pool: UserPool,
-            op_pool: OperationPool,
+            cmd_dispatcher: Callable[
+                [HappyEngBot, Message, User, str],
+                Coroutine[Any, Any, Message]],
+            limiter: AsyncTokenBucket,
+            *,
+            brand: str = '',
+            admin_ids: tuple[int, ...] = (),
+            hwm: int = 0,
+            flood_rate: float = 1.0,
+            flood_burst: float = 5.0,
+            user_pool: UserPool | None = None,
             **kwargs,
             ) -> None:
+        from functools import partial
+        from broadcast import Broadcaster
         super().__init__(token, **kwargs)
+        self.brand = brand
         self.db = db
-        self.user_pool = user_pool
-        self.op_pool = op_pool
+        self.admin_ids = admin_ids
+        self.user_pool = UserPool(db) if user_pool is None else user_pool
+        self.op_pool = OperationPool(
+            self.user_pool,
+            partial(cmd_dispatcher, self))
+        self.recent_updates = RecentIds(hwm=hwm)
+        """The IDs of recently processed updates to drop duplicates."""
+        self.flood_guard = FloodGuard(flood_rate, flood_burst)
+        self.broadcaster = Broadcaster(self, db, limiter, brand=brand)
 
 
 class Commands(enum.Enum):
@@ -58,6 +94,196 @@ class InputType(enum.IntEnum):
     CALLBACK = 1
 
 
+class RecentIds:
+    """
+    ### Recently seen IDs
+
+    A fixed-memory record of recently seen, roughly increasing integer
+    IDs (such as update IDs) to detect duplicates in O(1). It holds the
+    last `capacity` IDs in a ring buffer mirrored by a set. IDs evicted
+    from the ring raise a floor, and any ID at or below the floor counts
+    as a duplicate as well.
+
+    The high-water mark (the largest seen ID) can be persisted and
+    passed back at the next start, so updates which were processed before
+    a restart are dropped too.
+
+    This class is NOT thread-safe.
+    """
+
+    def __init__(self, capacity: int = 4096, *, hwm: int = 0) -> None:
+        """Initializes a new instance of this type. Arguments are as follow:
+
+        * `capacity`: the number of recent IDs to remember.
+        * `hwm`: a previously persisted high-water mark.
+        """
+        from array import array
+        if capacity < 1:
+            raise ValueError('capacity must be a positive integer')
+        self._ring = array('q', bytes(8 * capacity))
+        """The ring buffer of recent IDs. Zeros are empty slots."""
+        self._set: set[int] = set()
+        self._idx = 0
+        """The index of the next slot of the ring to be overwritten."""
+        self._floor = hwm
+        """All IDs less than or equal to this one are duplicates."""
+        self._hwm = hwm
+    
+    def __contains__(self, __id: int, /) -> bool:
+        return __id <= self._floor or __id in self._set
+    
+    def __len__(self) -> int:
+        return len(self._set)
+    
+    @property
+    def HighWaterMark(self) -> int:
+        """Gets the largest ID seen so far."""
+        return self._hwm
+    
+    def Add(self, __id: int, /) -> bool:
+        """Records the ID. It returns `True` if the ID is new and `False`
+        if it is a duplicate.
+        """
+        if __id in self:
+            return False
+        evicted = self._ring[self._idx]
+        if evicted:
+            self._set.discard(evicted)
+            if evicted > self._floor:
+                self._floor = evicted
+        self._ring[self._idx] = __id
+        self._set.add(__id)
+        self._idx = (self._idx + 1) % len(self._ring)
+        if __id > self._hwm:
+            self._hwm = __id
+        return True
+
+
+class AsyncTokenBucket:
+    """
+    ### Asynchronous token bucket
+
+    A rate limiter for `asyncio` code. Tokens refill at `rate` per second
+    up to `capacity`, and `Acquire` waits until enough tokens are
+    available. It is fair to concurrent waiters in their arrival order.
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None) -> None:
+        """Initializes a new instance of this type. Arguments are as follow:
+
+        * `rate`: the number of tokens added per second.
+        * `capacity`: the maximum burst; defaults to `rate`.
+        """
+        import asyncio
+        from time import monotonic
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        self._rate = rate
+        self._capacity = rate if capacity is None else capacity
+        self._tokens = self._capacity
+        self._last = monotonic()
+        self._lock = asyncio.Lock()
+    
+    @property
+    def Rate(self) -> float:
+        """Gets the number of tokens added per second."""
+        return self._rate
+    
+    async def Acquire(self, __n: float = 1, /) -> None:
+        """Waits until `n` tokens are available and takes them."""
+        import asyncio
+        from time import monotonic
+        async with self._lock:
+            while True:
+                now = monotonic()
+                self._tokens = min(
+                    self._capacity,
+                    self._tokens + (now - self._last) * self._rate)
+                self._last = now
+                if self._tokens >= __n:
+                    self._tokens -= __n
+                    return
+                await asyncio.sleep((__n - self._tokens) / self._rate)
+
+
+class FloodVerdict(enum.IntEnum):
+    """The verdicts of `FloodGuard` on an input of a user."""
+    PASS = 0
+    """The input must be handled."""
+    DROP = 1
+    """The input must be dropped silently."""
+    WARN = 2
+    """The input must be dropped and the user be noticed to slow down.
+    This happens at most once per flood.
+    """
+
+
+class FloodGuard:
+    """
+    ### Per-user flood guard
+
+    Token buckets of users in a bounded LRU mapping. Tokens of a user
+    refill at `rate` per second up to `burst`, and every input takes one.
+    Inputs without a token are dropped; only the first of them in a row
+    gets `FloodVerdict.WARN`. Each bucket is a 3-tuple, and once the
+    mapping holds `capacity` users the least recently seen one is
+    evicted, which at worst grants it a full bucket again.
+
+    This class is NOT thread-safe.
+    """
+
+    def __init__(
+            self,
+            rate: float = 1.0,
+            burst: float = 5.0,
+            *,
+            capacity: int = 10_000,
+            ) -> None:
+        """Initializes a new instance of this type. Arguments are as follow:
+
+        * `rate`: the number of inputs per second a user is allowed.
+        * `burst`: the maximum number of inputs in a row.
+        * `capacity`: the maximum number of users to track.
+        """
+        from collections import OrderedDict
+        if rate <= 0 or burst < 1:
+            raise ValueError('rate must be positive and burst at least one')
+        if capacity < 1:
+            raise ValueError('capacity must be a positive integer')
+        self._rate = rate
+        self._burst = burst
+        self._capacity = capacity
+        self._buckets: OrderedDict[ID, tuple[float, float, bool]] = \
+            OrderedDict()
+        """The mapping of `user ID -> (tokens, last refill, warned)` in
+        the order of the last input.
+        """
+    
+    def __len__(self) -> int:
+        return len(self._buckets)
+    
+    def Check(self, __id: ID, /) -> FloodVerdict:
+        """Takes a token of the user and tells what to do with the
+        input.
+        """
+        from time import monotonic
+        now = monotonic()
+        try:
+            tokens, last, warned = self._buckets[__id]
+        except KeyError:
+            if len(self._buckets) >= self._capacity:
+                self._buckets.popitem(last=False)
+            self._buckets[__id] = (self._burst - 1, now, False,)
+            return FloodVerdict.PASS
+        self._buckets.move_to_end(__id)
+        tokens = min(self._burst, tokens + (now - last) * self._rate)
+        if tokens >= 1:
+            self._buckets[__id] = (tokens - 1, now, False,)
+            return FloodVerdict.PASS
+        self._buckets[__id] = (tokens, now, True,)
+        return FloodVerdict.DROP if warned else FloodVerdict.WARN
+
+
 _Hashable = TypeVar('_Hashable')
 
 _SDelType = TypeVar('_SDelType')
@@ -182,6 +408,15 @@ class SDelPool[_Hashable, _SDelType]:
             self.DeleteItemBypass,
             key)
 
+    def CancelTimers(self) -> None:
+        """Cancels the deletion timers of all member objects at once,
+        which keeps them in the pool. This suits shutting down.
+        """
+        for timer in self._timers.values():
+            if timer is not None:
+                timer.cancel()
+        self._timers = dict.fromkeys(self._timers)
+
     def UnscheduleDel(self, key: _Hashable) -> None:
         """Unschedules a key for deletion. If it has not scheduled, it
         has no eefect.
@@ -193,6 +428,285 @@ class SDelPool[_Hashable, _SDelType]:
             self._timers[key] = None
 
 
+class _PoolShard[_Hashable, _SDelType]:
+    """A shard of `ShardedSDelPool` guarded by its own lock."""
+
+    __slots__ = ('lock', 'items', 'deadlines', 'expiring',)
+
+    def __init__(self) -> None:
+        from collections import OrderedDict
+        import threading
+        self.lock = threading.Lock()
+        self.items: dict[_Hashable, _SDelType] = {}
+        self.deadlines: OrderedDict[_Hashable, float] = OrderedDict()
+        """The monotonic deadlines of scheduled keys. As the time interval
+        is the same for all keys, moving a rescheduled key to the end
+        keeps them sorted, so the expired keys are always at the front.
+        """
+        self.expiring: dict[_Hashable, threading.Event] = {}
+        """The tombstones of expired keys whose `OnExpired` has not
+        returned yet. Operations on such keys wait for their events.
+        """
+
+
+class ShardedSDelPool[_Hashable, _SDelType]:
+    """
+    ### Sharded deletion-scheduled pool of objects
+
+    A thread-safe counterpart of `SDelPool` for pools touched by worker
+    threads. The key space is split across shards by the hash of keys,
+    and each shard has its own lock and its own expiry order, so threads
+    working on different keys rarely contend. Instead of timers of
+    `asyncio`, each key gets a monotonic deadline upon access. Expired
+    keys are deleted lazily by the operations on their shard and by
+    `Sweep`, which the owner should call periodically.
+
+    Subclasses can override `OnExpired` to act on expired member objects,
+    e.g. to save them. It is called outside the lock of the shard, but
+    the expired key keeps a tombstone until it returns: `GetItem` and
+    `SetItem` of that key wait meanwhile, so a miss is never followed by
+    loading a value the saving has not stored yet.
+
+    #### Operators:
+    1. `a = pool[key]`
+    2. `pool[key] = a`
+    3. `del pool[key]`
+    4. `key in pool`
+    5. `len(pool)`
+    """
+
+    _LAZY_EXPIRY = 8
+    """The maximum number of expired keys an operation deletes along."""
+
+    def __init__(
+            self,
+            *,
+            del_timint: float = 3_600,
+            shards: int = 16,
+            ) -> None:
+        """Initializes a new instance of this type. Arguments are as follow:
+
+        * `del_timint`: the time interval after which any member object
+        will be deleted if it has not accessed.
+        * `shards`: the number of shards.
+        """
+        if shards < 1:
+            raise ValueError('shards must be a positive integer')
+        self._DEL_TIMINT = del_timint
+        """The time interval for deletion in seconds."""
+        self._shards: tuple[_PoolShard[_Hashable, _SDelType], ...] = tuple(
+            _PoolShard() for _ in range(shards))
+    
+    def __getitem__(self, __key: _Hashable, /) -> _SDelType:
+        return self.GetItem(__key)
+
+    def __setitem__(self, __key: _Hashable, __value: _SDelType, /) -> None:
+        self.SetItem(__key, __value)
+
+    def __delitem__(self, __key: _Hashable, /) -> None:
+        self.DelItem(__key)
+    
+    def __contains__(self, __key: _Hashable, /) -> bool:
+        try:
+            self.GetItem(__key)
+            return True
+        except KeyError:
+            return False
+    
+    def __len__(self) -> int:
+        return sum(len(shard.items) for shard in self._shards)
+    
+    def GetItemBypass(self, __key: _Hashable, /) -> _SDelType:
+        """Gets the member object associated with the key bypassing
+        deletion scheduling. It raises `KeyError` if the key does not
+        exist.
+        """
+        shard = self._GetShard(__key)
+        with shard.lock:
+            return shard.items[__key]
+    
+    def GetItem(self, __key: _Hashable, /) -> _SDelType:
+        """Gets the member object at the specified key and reschedules
+        its deletion. It raises `KeyError` if the key does not exist.
+        """
+        from time import monotonic
+        import threading
+        shard = self._GetShard(__key)
+        self._AcquireKey(shard, __key)
+        try:
+            now = monotonic()
+            expired = self._PopExpired(shard, now, self._LAZY_EXPIRY)
+            # Deleting the key itself if expired but not yet popped...
+            if shard.deadlines.get(__key, now + 1) <= now:
+                del shard.deadlines[__key]
+                shard.expiring[__key] = threading.Event()
+                expired.append((__key, shard.items.pop(__key),))
+            found = __key in shard.items
+            if found:
+                item = shard.items[__key]
+                self._Schedule(shard, __key, now)
+        finally:
+            shard.lock.release()
+        self._NotifyExpired(shard, expired)
+        if not found:
+            raise KeyError(__key)
+        return item
+    
+    def SetItem(self, __key: _Hashable, __value: _SDelType, /) -> None:
+        """Sets the member object at the specified key and schedules it
+        for deletion.
+        """
+        from time import monotonic
+        shard = self._GetShard(__key)
+        self._AcquireKey(shard, __key)
+        try:
+            now = monotonic()
+            expired = self._PopExpired(shard, now, self._LAZY_EXPIRY)
+            shard.items[__key] = __value
+            self._Schedule(shard, __key, now)
+        finally:
+            shard.lock.release()
+        self._NotifyExpired(shard, expired)
+    
+    def DelItem(self, __key: _Hashable, /) -> None:
+        """Deletes the member object at the specified key. It raises
+        `KeyError` if the key does not exist.
+        """
+        shard = self._GetShard(__key)
+        with shard.lock:
+            del shard.items[__key]
+            shard.deadlines.pop(__key, None)
+    
+    def ScheduleDel(self, key: _Hashable) -> None:
+        """Schedules a key for deletion. If it is already scheduled, it
+        resets scheduling. It raises `KeyError` if the key does not exist.
+        """
+        from time import monotonic
+        shard = self._GetShard(key)
+        with shard.lock:
+            if key not in shard.items:
+                raise KeyError(key)
+            self._Schedule(shard, key, monotonic())
+    
+    def UnscheduleDel(self, key: _Hashable) -> None:
+        """Unschedules a key for deletion, so that it stays until deleted
+        explicitly. If it has not scheduled, it has no effect.
+        """
+        shard = self._GetShard(key)
+        with shard.lock:
+            shard.deadlines.pop(key, None)
+    
+    def Sweep(self) -> int:
+        """Deletes all the expired member objects and returns their
+        number. Shards are locked one at a time.
+        """
+        from time import monotonic
+        count = 0
+        for shard in self._shards:
+            with shard.lock:
+                expired = self._PopExpired(shard, monotonic())
+            self._NotifyExpired(shard, expired)
+            count += len(expired)
+        return count
+    
+    def OnExpired(self, __key: _Hashable, __value: _SDelType, /) -> None:
+        """Gets called for every member object deleted on expiry. It is
+        called outside of the locks, maybe on another thread than the one
+        which set the object. It must not get or set its own key, as they
+        wait for it to return.
+        """
+        pass
+    
+    def _GetShard(
+            self,
+            __key: _Hashable,
+            /,
+            ) -> _PoolShard[_Hashable, _SDelType]:
+        return self._shards[hash(__key) % len(self._shards)]
+    
+    def _AcquireKey(
+            self,
+            shard: _PoolShard[_Hashable, _SDelType],
+            key: _Hashable,
+            ) -> None:
+        """Acquires the lock of the shard once the key has no tombstone,
+        i.e. `OnExpired` of the key has returned. The caller must release
+        the lock.
+        """
+        while True:
+            shard.lock.acquire()
+            tombstone = shard.expiring.get(key)
+            if tombstone is None:
+                return
+            shard.lock.release()
+            tombstone.wait()
+    
+    def _Schedule(
+            self,
+            shard: _PoolShard[_Hashable, _SDelType],
+            key: _Hashable,
+            now: float,
+            ) -> None:
+        """Sets the deadline of the key. The lock of the shard must be
+        held.
+        """
+        shard.deadlines[key] = now + self._DEL_TIMINT
+        shard.deadlines.move_to_end(key)
+    
+    def _PopExpired(
+            self,
+            shard: _PoolShard[_Hashable, _SDelType],
+            now: float,
+            limit: int | None = None,
+            ) -> list[tuple[_Hashable, _SDelType]]:
+        """Deletes up to `limit` expired keys of the shard, all if `None`,
+        and returns them with their values. Deleted keys get tombstones
+        until `_NotifyExpired` lifts them. The lock of the shard must be
+        held.
+        """
+        import threading
+        expired: list[tuple[_Hashable, _SDelType]] = []
+        deadlines = shard.deadlines
+        while deadlines and (limit is None or len(expired) < limit):
+            key, deadline = next(iter(deadlines.items()))
+            if deadline > now:
+                break
+            del deadlines[key]
+            shard.expiring[key] = threading.Event()
+            expired.append((key, shard.items.pop(key),))
+        return expired
+    
+    def _NotifyExpired(
+            self,
+            shard: _PoolShard[_Hashable, _SDelType],
+            expired: list[tuple[_Hashable, _SDelType]],
+            ) -> None:
+        """Calls `OnExpired` for the expired keys of the shard and lifts
+        the tombstone of each key once it returns. The lock of the shard
+        must not be held.
+        """
+        for idx, (key, value,) in enumerate(expired):
+            logging.debug(f'Deletion of {key} key occurred in '
+                f'{self.__class__.__qualname__}')
+            try:
+                self.OnExpired(key, value)
+            except BaseException:
+                self._LiftTombstones(shard, expired[idx:])
+                raise
+            self._LiftTombstones(shard, expired[idx:idx + 1])
+    
+    def _LiftTombstones(
+            self,
+            shard: _PoolShard[_Hashable, _SDelType],
+            expired: list[tuple[_Hashable, _SDelType]],
+            ) -> None:
+        """Lifts the tombstones of the keys and wakes their waiters."""
+        with shard.lock:
+            tombstones = [shard.expiring.pop(key) for key, _ in expired]
+        for tombstone in tombstones:
+            tombstone.set()
+
+
 class LSDelPool(ABC, SDelPool[_Hashable, _SDelType]):
     """
     #### Load-save SDelPool
@@ -210,6 +724,11 @@ class LSDelPool(ABC, SDelPool[_Hashable, _SDelType]):
         self._db = db
         """The database object"""
     
+    @property
+    def Db(self) -> IDatabase:
+        """Gets the database of this pool."""
+        return self._db
+    
     @abstractmethod
     def Load(self, key: _Hashable) -> _SDelType:
         """Loads member object when the key is not available. If it cannot
@@ -247,20 +766,114 @@ class LSDelPool(ABC, SDelPool[_Hashable, _SDelType]):
         self.Save(__key)
         super().DeleteItemBypass(__key)
     
-    def close(self) -> None:
+    def SaveAll(self) -> None:
+        """Saves all the member objects. Subclasses should override this
+        to save in bulk.
+        """
         for key in self._items:
             self.Save(key)
+    
+    def close(self) -> None:
+        """Cancels all deletion timers, saves all the member objects, and
+        empties the pool.
+        """
+        self.CancelTimers()
+        self.SaveAll()
         self._items.clear()
+        self._timers.clear()
 
 
 class UserPool(LSDelPool[ID, UserData]):
+    """The pool of recent users of the Bot. It also records accesses of
+    users into cheap in-memory counters which are merged into their
+    `HourlyFrequencies` & `WeeklyActivity` in batches, at least every
+    `flush_timint` seconds and whenever a user is saved.
+    """
     def __init__(
             self,
             db: IDatabase,
             *,
             del_timint=20,
+            flush_timint=60,
             ) -> None:
         super().__init__(db, del_timint=del_timint)
+        from asyncio import TimerHandle
+        self._FLUSH_TIMINT = flush_timint
+        """The maximum time in seconds accesses stay in the counters."""
+        self._accesses: dict[ID, dict[int, int]] = {}
+        """The pending accesses as `user ID -> (slot -> count)` where slot
+        is the weekday×hour of `WeeklyActivity`.
+        """
+        self._slot = 0
+        """The current weekday×hour slot."""
+        self._slotEnd = 0.0
+        """The POSIX time at which the current slot ends."""
+        self._slotDay = ''
+        """The ISO day of the current slot."""
+        self._activeUsers: set[ID] = set()
+        """The distinct users who have been active in the current slot."""
+        self._nNewActive = 0
+        """The number of active users not yet added to the statistics."""
+        self._unknownIds: set[ID] = set()
+        """The IDs known to be missing from the database, so that flushes
+        do not look them up again. It is cleared with every slot, as other
+        processes might add users meanwhile.
+        """
+        self._flushTimer: TimerHandle | None = None
+    
+    def RecordAccess(self, __id: ID, /) -> None:
+        """Records an access of the specified user. This is cheap enough
+        to be called for every update; no normalization or I/O happens
+        here.
+        """
+        from time import time
+        now = time()
+        if now >= self._slotEnd:
+            self._ChangeSlot(now)
+        try:
+            slots = self._accesses[__id]
+        except KeyError:
+            slots = self._accesses[__id] = {}
+        slots[self._slot] = slots.get(self._slot, 0) + 1
+        if __id not in self._activeUsers:
+            self._activeUsers.add(__id)
+            self._nNewActive += 1
+        if self._flushTimer is None:
+            import asyncio
+            self._flushTimer = asyncio.get_running_loop().call_later(
+                self._FLUSH_TIMINT,
+                self.FlushAccesses)
+    
+    def FlushAccesses(self) -> None:
+        """Merges all the pending accesses into the frequencies of their
+        users, loading them if necessary. Accesses of unknown users (who
+        have not signed in) are dropped, and such users are not looked up
+        again until the next slot.
+        """
+        if self._flushTimer is not None:
+            self._flushTimer.cancel()
+            self._flushTimer = None
+        self._FlushActive()
+        accesses = self._accesses
+        self._accesses = {}
+        unknownIds = self._unknownIds
+        for id_, slots in accesses.items():
+            if id_ in unknownIds:
+                continue
+            try:
+                userData = self.GetItemBypass(id_)
+            except KeyError:
+                unknownIds.add(id_)
+                continue
+            self._MergeAccesses(userData, slots)
+    
+    def close(self) -> None:
+        self.FlushAccesses()
+        super().close()
+    
+    def SetItemBypass(self, __key: ID, __value: UserData, /) -> None:
+        self._unknownIds.discard(__key)
+        super().SetItemBypass(__key, __value)
     
     def Load(self, key: int) -> UserData:
         userData = self._db.GetUser(key)
@@ -271,8 +884,104 @@ class UserPool(LSDelPool[ID, UserData]):
         return userData
     
     def Save(self, key: ID) -> None:
+        try:
+            self._MergeAccesses(self._items[key], self._accesses.pop(key))
+        except KeyError:
+            pass
         self._db.UpsertUser(self._items[key])
         logging.debug(f'{self._items[key]} saved to the database.')
+    
+    def SaveAll(self) -> None:
+        """Saves all the resident users in one transaction."""
+        for id_, userData in self._items.items():
+            try:
+                self._MergeAccesses(userData, self._accesses.pop(id_))
+            except KeyError:
+                pass
+        count = self._db.UpsertUsers(self._items.values())
+        logging.info(f'{count} users saved to the database')
+    
+    def _ChangeSlot(self, __now: float, /) -> None:
+        """Moves the counters to the slot of the specified time."""
+        from time import localtime, mktime, strftime
+        self._FlushActive()
+        self._activeUsers.clear()
+        self._unknownIds.clear()
+        tm = localtime(__now)
+        self._slot = tm.tm_wday * 24 + tm.tm_hour
+        # Ending at the next local hour as the zone might be off by
+        # half an hour (e.g. Iran)...
+        self._slotEnd = mktime((
+            *tm[:4],
+            0,
+            0,
+            *tm[6:9],)) + 3_600
+        self._slotDay = strftime('%Y-%m-%d', tm)
+    
+    def _FlushActive(self) -> None:
+        """Adds the new active users of the current slot to the
+        statistics.
+        """
+        if self._nNewActive:
+            self._db.AddActiveUsers(
+                self._slotDay,
+                self._slot % 24,
+                self._nNewActive)
+            self._nNewActive = 0
+    
+    def _MergeAccesses(
+            self,
+            user_data: UserData,
+            slots: dict[int, int],
+            ) -> None:
+        from time import time
+        now = time()
+        hours: dict[int, int] = {}
+        for slot, count in slots.items():
+            hours[slot % 24] = hours.get(slot % 24, 0) + count
+            user_data.Activity.AddToSlot(slot, count, now)
+        user_data.Frequencies.AddFreqs(hours)
+
+
+class ReplyDescriptor(NamedTuple):
+    """A compact description of a reply of an operation which is rendered
+    anew on demand. Unlike a bound `Message.reply`, it does not pin Bale
+    objects and consists of plain values, so it is cheap to keep and can
+    be persisted.
+    """
+    chat_id: ID
+    message_id: int
+    """The ID of the message to reply to."""
+    text_key: str
+    """The name of the text in `lang`."""
+    fmt_args: tuple[Any, ...] = ()
+    """The arguments to format the text with, if any."""
+    buttons: tuple[tuple[str, int], ...] = ()
+    """The inline buttons as `(text key, callback code)` pairs."""
+
+    def Render(
+            self,
+            bot: Bot,
+            cb_data: Callable[[int], str],
+            ) -> Coroutine[Any, Any, Message]:
+        """Renders the reply. `cb_data` gets the callback data of the
+        callback codes of buttons.
+        """
+        text = getattr(lang, self.text_key)
+        if self.fmt_args:
+            text = text.format(*self.fmt_args)
+        buttons = None
+        if self.buttons:
+            buttons = InlineKeyboardMarkup()
+            for textKey, code in self.buttons:
+                buttons.add(InlineKeyboardButton(
+                    getattr(lang, textKey),
+                    callback_data=cb_data(code)))
+        return bot.send_message(
+            self.chat_id,
+            text,
+            components=buttons,
+            reply_to_message_id=self.message_id)
 
 
 class AbsOperation(ABC):
@@ -288,17 +997,33 @@ class AbsOperation(ABC):
     method.
     """
 
+    _nonce: int | None = None
+    """A random 32-bit number which makes UIDs of this process differ
+    from those of other processes and of earlier runs.
+    """
+
     @classmethod
     def GenerateUid(cls) -> int:
-        """Generates a unique id. This uniqueness is guaranteed among
-        all instances of this class even deleted ones.
+        """Generates a unique 64-bit id. The high 32 bits are a random
+        nonce of the process and the low 32 bits a counter, so the
+        uniqueness holds among all instances of this class even deleted
+        ones, and (with overwhelming probability) across processes and
+        restarts.
         """
-        uid = cls._nId
-        cls._nId += 1
-        if cls._nId > 0xff_ff_ff_ff:
-            cls._nId = 1
+        if AbsOperation._nonce is None:
+            AbsOperation._RenewNonce()
+        uid = (AbsOperation._nonce << 32) | AbsOperation._nId
+        AbsOperation._nId += 1
+        if AbsOperation._nId > 0xff_ff_ff_ff:
+            AbsOperation._nId = 1
+            AbsOperation._RenewNonce()
         return uid
     
+    @staticmethod
+    def _RenewNonce() -> None:
+        from secrets import randbits
+        AbsOperation._nonce = randbits(32)
+    
     def __init__(
             self,
             user_data: UserData | None = None
@@ -310,7 +1035,7 @@ class AbsOperation(ABC):
         """The unique ID of this operation."""
         self._userData = user_data
         """The optional user data associated with this operation."""
-        self._lastReply: Coroutine[Any, Any, Message] | None = None
+        self._lastReply: ReplyDescriptor | None = None
         """The last reply of the operation."""
     
     def __hash__(self) -> int:
@@ -332,30 +1057,53 @@ class AbsOperation(ABC):
         return self._userData
     
     @property
-    def LastReply(self) -> Coroutine[Any, Any, Message] | None:
+    def LastReply(self) -> ReplyDescriptor | None:
         """Gets the last reply of the operation."""
         return self._lastReply
     
+    def CallbackData(self, code: int, arg: str = '') -> str:
+        """Gets the encoded callback data of an inline button of this
+        operation. Codes 0 to 9 are reserved for `OperationPool`.
+        """
+        from .funcs import EncodeCallback
+        return EncodeCallback(self._UID, code, arg)
+    
     def Reply(
             self,
-            __coro: Coroutine[Any, Any, Message] | None,
+            __message: Message | None,
+            __text_key: str = '',
             /,
-            *args,
-            **kwargs,
+            *fmt_args: Any,
+            buttons: tuple[tuple[str, int], ...] = (),
             ) -> Coroutine[Any, Any, Message] | None:
-        """Saves the last reply and returns it."""
-        from functools import partial
-        if __coro is None:
+        """Saves the last reply and returns it rendered. The reply is to
+        `__message` with the text of `lang` named by `__text_key`,
+        formatted by `fmt_args`, and the inline `buttons` of this
+        operation as `(text key, callback code)` pairs. `None` as the
+        message clears the last reply.
+        """
+        if __message is None:
             self._lastReply = None
-        else:
-            self._lastReply = partial(__coro, *args, **kwargs)
-        return self.GetLastReply()
+            return None
+        self._lastReply = ReplyDescriptor(
+            __message.chat.id,
+            __message.message_id,
+            __text_key,
+            fmt_args,
+            buttons)
+        return self.GetLastReply(__message.get_bot())
     
-    def GetLastReply(self) -> Coroutine[Any, Any, Message] | None:
+    def GetLastReply(
+            self,
+            bot: Bot,
+            ) -> Coroutine[Any, Any, Message] | None:
+        """Renders the last reply anew, or returns `None` if there is
+        not any.
+        """
         if self._lastReply is None:
             return None
         else:
-            return self._lastReply()
+            return self._lastReply.Render(bot, self.CallbackData)
     
     @abstractmethod
     def Start(
@@ -379,12 +1127,14 @@ class AbsOperation(ABC):
     def ReplyCallback(
             self,
             message: Message,
-            cb: str,
+            cb_code: int,
+            cb_arg: str,
             ) -> tuple[Coroutine[Any, Any, Message] | None, bool]:
         """Optionally replies the provided callback. It must return `True`
-        if the operation finished otherwise `False`. Callback data are in the
-        format of `<uid>-<cbnum>-<optional>`. The `Uid` must be eliminated
-        by operation manager and the rest must be fed into this method.
+        if the operation finished otherwise `False`. Callback data are
+        produced by `CallbackData` method; the operation manager decodes
+        them, checks the UID, and feeds the code and the argument into this
+        method.
         """
         pass
 
@@ -394,9 +1144,12 @@ class SigninOp(AbsOperation):
     this operation by calling `Start` method.
     """
 
-    CONFIRM_CBD = '10'
+    CONFIRM_CBD = 10
+
+    RESTART_CBD = 11
 
-    RESTART_CBD = '11'
+    _RESTART_BTN = (('RESTART', RESTART_CBD,),)
+    """The spec of the restart button of replies."""
 
     def __init__(
             self,
@@ -418,7 +1171,7 @@ class SigninOp(AbsOperation):
             self,
             message: Message
             ) -> Coroutine[Any, Any, Message]:
-        return self.Reply(message.reply, lang.SIGN_IN_ENTER_FIRST_NAME)
+        return self.Reply(message, 'SIGN_IN_ENTER_FIRST_NAME')
 
     def ReplyText(
             self,
@@ -431,45 +1184,47 @@ class SigninOp(AbsOperation):
         3. e-mail
         4. phone no.
         """
-        buttons = InlineKeyboardMarkup()
         if self._firstName is None:
             self._firstName = text
-            self._AppendRestartBtn(buttons)
             return (
                 self.Reply(
-                    message.reply,
-                    lang.SIGN_IN_ENTER_LAST_NAME,
-                    components=buttons),
+                    message,
+                    'SIGN_IN_ENTER_LAST_NAME',
+                    buttons=self._RESTART_BTN),
                 False)
         elif self._lastName is None:
             self._lastName = text
-            self._AppendRestartBtn(buttons)
             return (
                 self.Reply(
-                    message.reply,
-                    lang.SIGN_IN_ENTER_PHONE,
-                    components=buttons),
+                    message,
+                    'SIGN_IN_ENTER_PHONE',
+                    buttons=self._RESTART_BTN),
                 False)
         elif self._phone is None:
+            # Validating the phone...
+            from utils.funcs import NormalizePhone
+            phone = NormalizePhone(text)
+            if phone is None or self._IsPhoneTaken(phone):
+                return (
+                    self.Reply(
+                        message,
+                        'SIGN_IN_INVALID_PHONE' if phone is None else
+                            'SIGN_IN_PHONE_TAKEN',
+                        buttons=self._RESTART_BTN),
+                    False)
             # Saving data to 'phone'...
-            self._phone = text
+            self._phone = phone
             # Confirming all data...
-            buttons.add(InlineKeyboardButton(
-                lang.CONFIRM,
-                callback_data=f'{self.CONFIRM_CBD}'))
-            buttons.add(InlineKeyboardButton(
-                lang.RESTART,
-                callback_data=f'{self.RESTART_CBD}'))
-            response = '{0}\n{1}: {2}\n{3}: {4}\n{5}: {6}'.format(
-                lang.CONFIRM_DATA,
-                lang.FIRST_NAME,
-                self._firstName,
-                lang.LAST_NAME,
-                self._lastName,
-                lang.PHONE,
-                self._phone)
             return (
-                self.Reply(message.reply, response, components=buttons),
+                self.Reply(
+                    message,
+                    'SIGN_IN_CONFIRM_DATA',
+                    self._firstName,
+                    self._lastName,
+                    self._phone,
+                    buttons=(
+                        ('CONFIRM', self.CONFIRM_CBD,),
+                        *self._RESTART_BTN,)),
                 False,)
         else:
             logging.error('E1-3')
@@ -478,44 +1233,60 @@ class SigninOp(AbsOperation):
     def ReplyCallback(
             self,
             bale_msg: Message,
-            cb_data: str,
+            cb_code: int,
+            cb_arg: str,
             ) -> tuple[Coroutine[Any, Any, Message] | None, bool]:
-        match cb_data:
+        match cb_code:
             case self.CONFIRM_CBD:
-                self._userPool[self._baleId] = UserData(
+                from datetime import date
+                from db import PhoneTakenError
+                userData = UserData(
                     self._baleId,
                     self._firstName,
                     self._lastName,
                     self._phone)
+                # Saving before pooling so the phone is reserved in the
+                # database; another user might have registered it
+                # meanwhile...
+                try:
+                    self._userPool.Db.UpsertUser(userData)
+                except PhoneTakenError:
+                    self._phone = None
+                    return (
+                        self.Reply(
+                            bale_msg,
+                            'SIGN_IN_PHONE_TAKEN',
+                            buttons=self._RESTART_BTN),
+                        False,)
+                self._userPool[self._baleId] = userData
+                self._userPool.Db.IncrementSignups(date.today().isoformat())
                 return (self.Reply(None), True,)
             case self.RESTART_CBD:
                 self._firstName = None
                 self._lastName = None
                 self._phone = None
-                return (self.Reply(self.Start, bale_msg), False,)
+                return (self.Start(bale_msg), False,)
             case _:
-                logging.error(f'{cb_data}: unknown callback in '
+                logging.error(f'{cb_code}: unknown callback in '
                     f'{self.__class__.__qualname__}')
                 return (None, False,)
     
-    def _AppendRestartBtn(self, buttons: InlineKeyboardMarkup) -> None:
-        buttons.add(InlineKeyboardButton(
-        lang.RESTART,
-        callback_data=f'{self.RESTART_CBD}'))
+    def _IsPhoneTaken(self, phone: str) -> bool:
+        """Specifies whether another user has registered the phone."""
+        owner = self._userPool.Db.GetUserIdByPhone(phone)
+        return owner is not None and owner != self._baleId
 
 
 class OperationPool(SDelPool[ID, AbsOperation]):
 
-    CANCELED_BY_CMD_CBD = '1'
-    """The infix of the callback data denotes cancelation of this
-    operation by a command. The callback data must have this format:
-    `<uid>-1-/<cmd>`
+    CANCELED_BY_CMD_CBD = 1
+    """The callback code which denotes cancelation of this operation by
+    a command. The command is the argument of the callback data.
     """
 
-    CONTINUE_CBD = '2'
-    """The suffix of the callback data which denotes that this operation
-    to be continued. The callback data must have this format:
-    `<uid>-2`
+    CONTINUE_CBD = 2
+    """The callback code which denotes that this operation to be
+    continued.
     """
 
     def __init__(
@@ -530,11 +1301,27 @@ class OperationPool(SDelPool[ID, AbsOperation]):
         self._cmdDispatcher = cmd_dispatcher
         self._userPool = user_pool
         """The user pool of the Bot."""
-        self._UID = 0
-        """The unique ID of the operation pool. All operations' UID are
-        positive (as a result larger than 0).
+        self._uids: dict[int, ID] = {}
+        """The index of `operation UID -> user ID` of ongoing operations
+        to route callbacks directly to their operations.
         """
 
+    def SetItemBypass(self, __key: ID, __value: AbsOperation, /) -> None:
+        try:
+            del self._uids[self._items[__key].Uid]
+        except KeyError:
+            pass
+        super().SetItemBypass(__key, __value)
+        self._uids[__value.Uid] = __key
+
+    def DeleteItemBypass(self, __key: ID, /) -> None:
+        self._uids.pop(self._items[__key].Uid, None)
+        super().DeleteItemBypass(__key)
+
+    def DelItem(self, __key: ID, /) -> None:
+        self._uids.pop(self._items[__key].Uid, None)
+        super().DelItem(__key)
+
     def GetTextReply(
             self,
             bale_msg: Message,
@@ -561,37 +1348,38 @@ class OperationPool(SDelPool[ID, AbsOperation]):
             bale_user: User,
             cb_data: str,
             ) -> Coroutine[Any, Any, Message] | None:
-        """Gets the optional reply of the callback. It raises
-        `KeyError` if the user does not have an ongoing operation.
+        """Gets the optional reply of the callback. It raises `KeyError`
+        if the callback data is malformed or does not belong to an ongoing
+        operation of the user, e.g. a stale button from before a restart.
         """
+        # Routing the callback to its operation...
+        from .funcs import DecodeCallback
+        try:
+            uid, code, arg = DecodeCallback(cb_data)
+        except ValueError as err:
+            raise KeyError(cb_data) from err
+        userId = self._uids[uid]
+        if userId != bale_user.id:
+            raise KeyError(cb_data)
         # Re-scheduling the user...
         try:
             self._userPool[bale_user.id]
         except KeyError:
             pass
-        self.GetItem(bale_user.id)
+        op = self.GetItem(userId)
         # Getting the reply...
-        from .funcs import SplitOnDash
         cmd = None
-        parts = SplitOnDash(cb_data)
-        if parts[0] != str(self._UID):
-            reply, finished = self._items[bale_user.id].ReplyCallback(
-                bale_msg,
-                cb_data)
-        else:
-            match parts[1].split('-'):
-                case [self.CANCELED_BY_CMD_CBD, cmd,]:
-                    finished = True
-                case [self.CONTINUE_CBD,]:
-                    reply = self[bale_user.id].GetLastReply()
-                    finished = False
-                case _:
-                    logging.error(f'{cb_data}: unknown callback in '
-                        f'{self.__class__.__qualname__}')
-                    reply = None
-                    finished = False
+        match code:
+            case self.CANCELED_BY_CMD_CBD:
+                cmd = arg
+                finished = True
+            case self.CONTINUE_CBD:
+                reply = op.GetLastReply(bale_msg.get_bot())
+                finished = False
+            case _:
+                reply, finished = op.ReplyCallback(bale_msg, code, arg)
         if finished:
-            self.DelItem(bale_user.id)
+            self.DelItem(userId)
         if cmd is None:
             return reply
         else:
@@ -613,13 +1401,13 @@ class OperationPool(SDelPool[ID, AbsOperation]):
         except KeyError:
             pass
         # Checking if the user has an ongoing operation...
-        self.GetItem(bale_user.id)
+        op = self.GetItem(bale_user.id)
         # Asking for cancelation...
         buttons = InlineKeyboardMarkup()
         buttons.add(InlineKeyboardButton(
             lang.CONTINUE_OP,
-            callback_data=f'{self._UID}-{self.CONTINUE_CBD}'))
+            callback_data=op.CallbackData(self.CONTINUE_CBD)))
         buttons.add(InlineKeyboardButton(
             lang.CANCEL_OP,
-            callback_data=f'{self._UID}-{self.CANCELED_BY_CMD_CBD}-{cmd}'))
+            callback_data=op.CallbackData(self.CANCELED_BY_CMD_CBD, cmd)))
         return bale_msg.reply(lang.DISRUPTIVE_CMD, components=buttons)
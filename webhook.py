@@ -0,0 +1,148 @@
+#
+#
+#
+"""This module offers the webhook ingestion mode of the Bot as an
+alternative to long-polling. Bale pushes every update to an `aiohttp`
+server which validates it and feeds it to the same dispatch path as
+polling.
+
+#### Types:
+1. `WebhookServer`
+
+#### Functions:
+1. `SetWebhook`: registers (or with an empty URL, removes) the webhook
+on the Bale servers.
+"""
+
+from __future__ import annotations
+import asyncio
+import hmac
+import json
+import logging
+from typing import Any, Callable, Coroutine
+
+from aiohttp import web
+
+
+SECRET_HEADER = 'X-Bale-Bot-Api-Secret-Token'
+"""The header carrying the secret token of the webhook."""
+
+
+class WebhookServer:
+    """An `aiohttp` server receiving updates from Bale. Arguments are as
+    follow:
+
+    * `handler`: the coroutine function which handles a raw update.
+    * `path`: the URL path of the webhook. Choosing an unguessable path
+    is the first line of validation.
+    * `secret`: requests must carry it in the `X-Bale-Bot-Api-Secret-Token`
+    header; it is mandatory as anyone who learns the URL could otherwise
+    forge updates, e.g. of admins. It raises `ValueError` if empty.
+    * `max_body`: the maximum accepted size of a request body in bytes.
+    """
+
+    def __init__(
+            self,
+            handler: Callable[[dict[str, Any]], Coroutine[Any, Any, None]],
+            *,
+            path: str = '/webhook',
+            secret: str,
+            max_body: int = 1 << 20,
+            ) -> None:
+        if not secret:
+            raise ValueError('the secret of the webhook is empty')
+        self._handler = handler
+        self._path = path
+        self._secret = secret
+        self._maxBody = max_body
+        self._accepting = False
+        """Specifies whether new updates are accepted or not."""
+        self._tasks: set[asyncio.Task] = set()
+        """The in-flight handler tasks."""
+        self._runner: web.AppRunner | None = None
+
+    @property
+    def InFlight(self) -> int:
+        """Gets the number of updates being handled."""
+        return len(self._tasks)
+
+    async def Start(self, host: str, port: int) -> None:
+        """Starts listening on the specified host and port."""
+        app = web.Application(client_max_size=self._maxBody)
+        app.add_routes([web.post(self._path, self._HandlePost)])
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        self._accepting = True
+        logging.info(f'webhook listening on {host}:{port}{self._path}')
+
+    async def Drain(self, deadline: float = 10.0) -> None:
+        """Stops accepting updates, waits up to `deadline` seconds for the
+        in-flight ones, cancels the rest, and then stops the server.
+        """
+        self._accepting = False
+        if self._tasks:
+            _, pending = await asyncio.wait(self._tasks, timeout=deadline)
+            for task in pending:
+                task.cancel()
+            if pending:
+                logging.warning(f'{len(pending)} updates were cancelled '
+                    'while draining the webhook')
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _HandlePost(self, request: web.Request) -> web.Response:
+        # Refusing new work while draining...
+        if not self._accepting:
+            return web.Response(status=503)
+        # Validating the request...
+        token = request.headers.get(SECRET_HEADER, '')
+        if not hmac.compare_digest(token, self._secret):
+            logging.warning('a webhook request with a wrong secret from '
+                f'{request.remote}')
+            return web.Response(status=403)
+        if request.content_type != 'application/json':
+            return web.Response(status=415)
+        try:
+            update = await request.json()
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return web.Response(status=400)
+        if not isinstance(update, dict) or \
+                not isinstance(update.get('update_id'), int):
+            return web.Response(status=400)
+        # Acknowledging at once & handling in the background...
+        task = asyncio.get_running_loop().create_task(self._Handle(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _Handle(self, update: dict[str, Any]) -> None:
+        try:
+            await self._handler(update)
+        except Exception:
+            logging.error(f'failed to handle update {update["update_id"]}',
+                exc_info=True)
+
+
+async def SetWebhook(
+        base_url: str,
+        token: str,
+        url: str,
+        secret: str | None = None,
+        ) -> None:
+    """Registers `url` as the webhook of the Bot on the Bale servers. An
+    empty `url` removes the webhook. It raises `RuntimeError` if Bale
+    rejects the request.
+    """
+    from aiohttp import ClientSession
+    params: dict[str, Any] = {'url': url}
+    if secret is not None:
+        params['secret_token'] = secret
+    async with ClientSession() as session:
+        async with session.post(
+                f'{base_url}/bot{token}/setWebhook',
+                json=params) as resp:
+            body = await resp.json()
+    if not body.get('ok'):
+        raise RuntimeError(f'setWebhook failed: {body}')